@@ -5,12 +5,16 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+
+The payment status stream (payments/views.py → payment_status_stream) holds
+its connection open; serve it from this entry point so a waiting fan does
+not occupy a WSGI worker.
 """
 
 import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'vibeninjas.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DopeEvents.DopeEvents.settings')
 
 application = get_asgi_application()
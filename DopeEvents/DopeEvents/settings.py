@@ -101,7 +101,9 @@ if config('DATABASE_URL', default=None):
     DATABASES = {
         'default': dj_database_url.config(
             default=config('DATABASE_URL'),
-            conn_max_age=600,
+            # The web process is served over ASGI (Procfile), where each request runs
+            # its sync code on a fresh thread — a persistent connection is never reused
+            conn_max_age=config('DB_CONN_MAX_AGE', default=0, cast=int),
             conn_health_checks=True,
         )
     }
@@ -113,6 +115,21 @@ else:
         }
     }
 
+# Shared by every process (web, worker, reconciler): payment status wake-ups, page
+# fragments, idempotency keys and locks are only seen across processes through it.
+# Redis when REDIS_URL is set, otherwise the database (python manage.py createcachetable).
+REDIS_URL = config('REDIS_URL', default='')
+CACHES = {
+    'default': {
+        'BACKEND': config(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.redis.RedisCache' if REDIS_URL
+            else 'django.core.cache.backends.db.DatabaseCache',
+        ),
+        'LOCATION': config('CACHE_LOCATION', default=REDIS_URL or 'django_cache'),
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -180,9 +197,11 @@ _mpesa_env = config('MPESA_ENVIRONMENT', default='sandbox')
 MPESA_ENVIRONMENT = _mpesa_env
 
 if _mpesa_env == 'production':
-    MPESA_BASE_URL = 'https://api.safaricom.co.ke'
+    _mpesa_default_url = 'https://api.safaricom.co.ke'
 else:
-    MPESA_BASE_URL = 'https://sandbox.safaricom.co.ke'
+    _mpesa_default_url = 'https://sandbox.safaricom.co.ke'
+# Override to point at the local simulator: python manage.py run_daraja_simulator
+MPESA_BASE_URL = config('MPESA_BASE_URL', default=_mpesa_default_url)
 
 MPESA_CONSUMER_KEY = config('MPESA_CONSUMER_KEY', default='')
 MPESA_CONSUMER_SECRET = config('MPESA_CONSUMER_SECRET', default='')
@@ -192,6 +211,42 @@ MPESA_INITIATOR_NAME = config('MPESA_INITIATOR_NAME', default='')
 MPESA_SECURITY_CREDENTIAL = config('MPESA_SECURITY_CREDENTIAL', default='')
 MPESA_CALLBACK_URL = config('MPESA_CALLBACK_URL', default='https://www.zozaprime.com/payments/mpesa-callback/')
 
+# Daraja HTTP client (payments/daraja.py)
+MPESA_CONNECT_TIMEOUT = config('MPESA_CONNECT_TIMEOUT', default=5, cast=float)
+MPESA_READ_TIMEOUT = config('MPESA_READ_TIMEOUT', default=30, cast=float)
+MPESA_MAX_RETRIES = config('MPESA_MAX_RETRIES', default=2, cast=int)
+MPESA_RETRY_BACKOFF_MAX = config('MPESA_RETRY_BACKOFF_MAX', default=2, cast=float)
+MPESA_POOL_SIZE = config('MPESA_POOL_SIZE', default=20, cast=int)
+# Circuit breaker (payments/circuit_breaker.py)
+MPESA_BREAKER_ERROR_RATE = config('MPESA_BREAKER_ERROR_RATE', default=0.5, cast=float)
+MPESA_BREAKER_COOLDOWN = config('MPESA_BREAKER_COOLDOWN', default=30, cast=int)
+MPESA_MIN_READ_TIMEOUT = config('MPESA_MIN_READ_TIMEOUT', default=5, cast=float)
+# Send STK pushes from a background pool instead of inside the request (payments/dispatcher.py)
+MPESA_ASYNC_INITIATION = config('MPESA_ASYNC_INITIATION', default=False, cast=bool)
+MPESA_DISPATCH_WORKERS = config('MPESA_DISPATCH_WORKERS', default=8, cast=int)
+# Safaricom STK status queries per second from the reconciliation worker
+MPESA_STATUS_QUERY_RATE = config('MPESA_STATUS_QUERY_RATE', default=5, cast=float)
+# Seconds an inconclusive (ResultCode 1) STK status answer is reused before asking again
+MPESA_STATUS_NEGATIVE_CACHE_SECONDS = config('MPESA_STATUS_NEGATIVE_CACHE_SECONDS', default=10, cast=int)
+
+# Seconds a fan's tickets stay reserved while they complete the STK prompt
+TICKET_HOLD_TTL_SECONDS = config('TICKET_HOLD_TTL_SECONDS', default=300, cast=int)
+# Ticket codes each web process reserves per database round trip (events/ticket_codes.py)
+TICKET_CODE_BLOCK_SIZE = config('TICKET_CODE_BLOCK_SIZE', default=1000, cast=int)
+# Issue one ticket per admitted person for bundle categories (events/issuance.py)
+TICKETS_PER_ADMISSION = config('TICKETS_PER_ADMISSION', default=False, cast=bool)
+# Seconds a checkout/RSVP response is kept for replay under its Idempotency-Key
+IDEMPOTENCY_TTL_SECONDS = config('IDEMPOTENCY_TTL_SECONDS', default=3600, cast=int)
+# Seconds a duplicate submit waits for the first one's response before a 409 (holds a worker thread)
+IDEMPOTENCY_WAIT_SECONDS = config('IDEMPOTENCY_WAIT_SECONDS', default=8, cast=int)
+# Admin dashboard metrics snapshot (events/platform_metrics.py): seconds between scheduled refreshes,
+# age at which it is flagged stale, and seconds between live counter polls (0 = off)
+METRICS_REFRESH_SECONDS = config('METRICS_REFRESH_SECONDS', default=300, cast=int)
+METRICS_SNAPSHOT_STALE_SECONDS = config('METRICS_SNAPSHOT_STALE_SECONDS', default=900, cast=int)
+METRICS_LIVE_REFRESH_SECONDS = config('METRICS_LIVE_REFRESH_SECONDS', default=30, cast=int)
+# Longest a cached event card / ticket table lives; writes invalidate it sooner (events/page_cache.py)
+PAGE_CACHE_TTL_SECONDS = config('PAGE_CACHE_TTL_SECONDS', default=600, cast=int)
+
 # ════════════════════════════════════════════════════════════════════
 # PAYSTACK SETTINGS
 # ════════════════════════════════════════════════════════════════════
@@ -1,19 +1,38 @@
 from django.utils import timezone
+from django import forms
 from django.contrib import admin
 from django.contrib.auth.models import Group
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
 
-from .models import Event, Ticket, Category, TicketCategory, PromoCode
+from .cancellation import cancel_tickets
+from .forms import StockEditMixin
+from .inventory import adjust_stock, enable_sharding
+from .models import Event, Ticket, Category, TicketCategory, PromoCode, WaitingRoom
 
 User = get_user_model()
 
 
+class TicketCategoryAdminForm(StockEditMixin, forms.ModelForm):
+    class Meta:
+        model = TicketCategory
+        fields = '__all__'
+
+
+def apply_stock_edits(forms):
+    """Stock edits on existing categories, as moves through the inventory module."""
+    for form in forms:
+        delta = form.stock_delta()
+        if delta:
+            adjust_stock(form.instance.pk, delta)
+
+
 class TicketCategoryInline(admin.TabularInline):
     model = TicketCategory
+    form = TicketCategoryAdminForm
     extra = 1
     fields = [
-        'name', 'category_type', 'price', 'available_tickets',
+        'name', 'category_type', 'price', 'available_tickets', 'stock_loaded',
         'is_free', 'is_bundle', 'bundle_size',
         'sales_start', 'sales_end', 'display_order'
     ]
@@ -27,6 +46,11 @@ class EventAdmin(admin.ModelAdmin):
     list_editable = ['is_active']
     inlines = [TicketCategoryInline]
 
+    def save_formset(self, request, form, formset, change):
+        super().save_formset(request, form, formset, change)
+        if formset.model is TicketCategory:
+            apply_stock_edits(f for f in formset.initial_forms if f not in formset.deleted_forms)
+
     def lowest_ticket_price(self, obj):
         return f"Ksh {obj.lowest_ticket_price}" if obj.lowest_ticket_price else "Free / No price"
     lowest_ticket_price.short_description = "Starting Price"
@@ -41,6 +65,16 @@ class TicketAdmin(admin.ModelAdmin):
     list_filter = ['status', 'purchased_at', 'event']
     search_fields = ['buyer_name', 'buyer_email', 'ticket_code']
     readonly_fields = ['ticket_code', 'purchased_at', 'unit_price', 'total_amount']
+    actions = ('cancel_and_restock',)
+
+    @admin.action(description='Cancel selected tickets and restock')
+    def cancel_and_restock(self, request, queryset):
+        result = cancel_tickets(queryset)
+        self.message_user(
+            request,
+            f"Cancelled {result['cancelled']} ticket(s); returned {result['restocked']} "
+            f"to stock across {result['categories']} categories.",
+        )
 
 
 @admin.register(Category)
@@ -52,16 +86,37 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(TicketCategory)
 class TicketCategoryAdmin(admin.ModelAdmin):
+    form = TicketCategoryAdminForm
     list_display = [
         'name', 'event', 'category_type', 'price',
-        'available_tickets', 'is_free', 'is_bundle', 'bundle_size', 'sales_status'
+        'live_stock', 'is_free', 'is_bundle', 'bundle_size', 'sales_status'
     ]
     list_filter = ['category_type', 'is_free', 'is_bundle', 'event']
     search_fields = ['name', 'event__title']
     readonly_fields = ['sales_status', 'tickets_sold']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_live_stock()
+
+    def save_model(self, request, obj, form, change):
+        # Stock and shard_count are not written by the save; they move
+        # through the inventory module below
+        shard_count = obj.shard_count
+        if not change:
+            # Created unsharded, then split with its shards in one transaction
+            obj.shard_count = 1
+        super().save_model(request, obj, form, change)
+        if change:
+            apply_stock_edits([form])
+        if shard_count != (form.initial.get('shard_count', 1) if change else 1):
+            enable_sharding(obj, shard_count)
+
+    @admin.display(description='Available')
+    def live_stock(self, obj):
+        return obj.live_available
+
     def sales_status(self, obj):
-        if obj.available_tickets <= 0:
+        if obj.live_available <= 0:
             return "Sold Out"
         now = timezone.now()
         if obj.sales_start and obj.sales_start > now:
@@ -103,4 +158,12 @@ class PromoCodeAdmin(admin.ModelAdmin):
     list_display = ('code', 'discount_type', 'discount_value', 'event', 'uses_count', 'is_active')
     list_filter = ('discount_type', 'is_active', 'event')
     search_fields = ('code',)
-    readonly_fields = ('uses_count',) # Don't let people manually edit the count easily
\ No newline at end of file
+    readonly_fields = ('uses_count',) # Don't let people manually edit the count easily
+
+@admin.register(WaitingRoom)
+class WaitingRoomAdmin(admin.ModelAdmin):
+    list_display = ('event', 'is_active', 'opens_at', 'admit_per_second', 'admission_minutes', 'next_position')
+    list_filter = ('is_active',)
+    search_fields = ('event__title',)
+    raw_id_fields = ('event',)
+    readonly_fields = ('next_position',)
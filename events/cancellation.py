@@ -0,0 +1,109 @@
+"""
+ZOZAPRIME Ticket Cancellation
+=============================
+Location: events/cancellation.py
+
+Cancels tickets and puts their stock back, in one transaction.
+
+  1. lock the still-cancellable rows (pending / confirmed) of the batch
+  2. flip them to 'cancelled' with one UPDATE
+     and take them out of the sales counters and daily rollup
+     (events/sales_counters.py)
+  3. return their quantity to each category — one CASE UPDATE for the
+     whole batch (inventory.return_stock_many), grouped by category
+  4. refresh the affected events' available_tickets snapshot
+
+Tickets already cancelled or used are skipped, so cancelling the same
+ticket twice never restocks twice. No per-row save() anywhere — the
+admin action cancels thousands of tickets in a few statements.
+
+CALLED BY:
+  events/models.py → Ticket.cancel()
+  events/admin.py  → TicketAdmin 'Cancel and restock' action
+"""
+import logging
+
+from django.db import transaction as db_transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .inventory import return_stock_many
+from .models import Event, Ticket, TicketCategory
+from .sales_counters import record_status_change
+
+logger = logging.getLogger(__name__)
+
+CANCELLABLE_STATUSES = ('pending', 'confirmed')
+BATCH_SIZE = 500
+
+
+def cancel_tickets(tickets):
+    """
+    Cancel tickets (a queryset or an iterable of ids) and restock them.
+    Returns {'cancelled': n, 'restocked': n_tickets_returned, 'categories': n}.
+    """
+    if hasattr(tickets, 'values_list'):
+        ticket_ids = list(tickets.values_list('id', flat=True))
+    else:
+        ticket_ids = list(tickets)
+
+    now = timezone.now()
+    cancelled = 0
+    restock = {}
+    events = set()
+
+    with db_transaction.atomic():
+        for start in range(0, len(ticket_ids), BATCH_SIZE):
+            chunk = ticket_ids[start:start + BATCH_SIZE]
+            rows = list(
+                Ticket.objects.select_for_update()
+                .filter(id__in=chunk, status__in=CANCELLABLE_STATUSES)
+                .values_list('id', 'ticket_category_id', 'event_id', 'quantity', 'status', 'total_amount', 'purchased_at')
+            )
+            if not rows:
+                continue
+
+            cancelled += Ticket.objects.filter(
+                id__in=[row[0] for row in rows],
+                status__in=CANCELLABLE_STATUSES,
+            ).update(status='cancelled', cancelled_at=now)
+
+            record_status_change(
+                [(event_id, category_id, status, quantity, amount, purchased_at)
+                 for _, category_id, event_id, quantity, status, amount, purchased_at in rows],
+                'cancelled',
+            )
+
+            for _, category_id, event_id, quantity, *_ in rows:
+                events.add(event_id)
+                if category_id:
+                    restock[category_id] = restock.get(category_id, 0) + quantity
+
+        return_stock_many(restock)
+        _refresh_event_stock(events)
+
+    restocked = sum(restock.values())
+    if cancelled:
+        logger.info(
+            f"[CANCEL] {cancelled} ticket(s) cancelled, {restocked} returned "
+            f"to {len(restock)} categor{'y' if len(restock) == 1 else 'ies'}"
+        )
+    return {'cancelled': cancelled, 'restocked': restocked, 'categories': len(restock)}
+
+
+def _refresh_event_stock(event_ids):
+    """Recompute Event.available_tickets (a display snapshot) from live stock."""
+    if not event_ids:
+        return
+    totals = dict(
+        TicketCategory.objects.with_live_stock()
+        .filter(event_id__in=event_ids)
+        .values('event_id')
+        .annotate(total=Sum('_live_available'))
+        .values_list('event_id', 'total')
+    )
+    Event.objects.bulk_update(
+        [Event(id=event_id, available_tickets=totals.get(event_id, 0)) for event_id in event_ids],
+        ['available_tickets'],
+        batch_size=BATCH_SIZE,
+    )
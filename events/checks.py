@@ -0,0 +1,32 @@
+"""
+ZOZAPRIME System Checks
+=======================
+Location: events/checks.py
+
+Page fragment versions (events/page_cache.py), idempotency keys, waiting
+room config, payment status wake-ups and the metrics refresh lock are all
+shared through Django's cache. A per-process backend silently breaks them
+across gunicorn workers and the worker / reconciler / metrics processes:
+a bump in one process never reaches another's fragments.
+
+    python manage.py check
+"""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+PER_PROCESS_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register('caches')
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PER_PROCESS_BACKENDS:
+        return []
+    return [Warning(
+        f"The default cache ({backend}) is not shared between processes.",
+        hint="Set REDIS_URL, or use the database cache (python manage.py createcachetable).",
+        id='events.W001',
+    )]
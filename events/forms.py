@@ -4,7 +4,28 @@ from django.forms import inlineformset_factory
 from .models import User, Event, Category, TicketCategory
 
 
-class TicketCategoryForm(forms.ModelForm):
+class StockEditMixin(forms.Form):
+    """
+    For TicketCategory forms: shows the live stock (shards included) and
+    remembers it in a hidden field, so the edit can be applied as a move
+    (inventory.adjust_stock) rather than by saving the column.
+    """
+    stock_loaded = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial['available_tickets'] = self.initial['stock_loaded'] = self.instance.live_available
+
+    def stock_delta(self):
+        """Tickets to add (or remove) for an existing category; 0 for a new one."""
+        loaded = self.cleaned_data.get('stock_loaded')
+        if loaded is None or self.cleaned_data.get('available_tickets') is None:
+            return 0
+        return self.cleaned_data['available_tickets'] - loaded
+
+
+class TicketCategoryForm(StockEditMixin, forms.ModelForm):
     class Meta:
         model = TicketCategory
         fields = [
@@ -0,0 +1,165 @@
+"""
+ZOZAPRIME Idempotency Keys
+==========================
+Location: events/idempotency.py
+
+Double taps on "Pay with M-Pesa" and retried form posts must not create a
+second Transaction, a second STK prompt or a second free ticket.
+
+The checkout page sends a key with every POST (Idempotency-Key header or
+an `idempotency_key` form field). @idempotent(scope) on the view:
+
+  - FIRST:     claims the key (cache.add), runs the view, stores the
+               response for IDEMPOTENCY_TTL_SECONDS
+  - DUPLICATE: while the first is still running → waits for its response
+               (up to WAIT_SECONDS, then 409; the page retries with the
+               same key and gets the replay once the first finishes)
+  - REPLAY:    after it finished → returns the stored response; the view
+               never runs, so Safaricom and the stock tables are untouched
+
+A key reused with a different form body is refused with 422. POSTs
+without a key go straight to the view. 5xx responses and exceptions are
+not stored — the key is freed so the fan can retry.
+
+Like the waiting room, this lives in Django's cache. CACHES (settings)
+is a backend every web worker shares — Redis, or the database cache — so
+a double tap that lands on two workers still meets the same key. A
+waiting duplicate holds a worker thread, so WAIT_SECONDS stays short.
+
+USED BY:
+  payments/views.py → initiate_mpesa_payment
+  events/views.py   → checkout (free RSVP POST)
+"""
+import hashlib
+import logging
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+FORM_FIELD = 'idempotency_key'
+TTL_SECONDS = getattr(settings, 'IDEMPOTENCY_TTL_SECONDS', 3600)
+# How long a claim is honoured if the worker that made it dies mid-request
+LOCK_SECONDS = 90
+# How long a duplicate waits for the first request's response before its 409
+WAIT_SECONDS = getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 8)
+POLL_INTERVAL_SECONDS = 0.2
+MAX_KEY_LENGTH = 100
+
+IN_PROGRESS = 'in_progress'
+DONE = 'done'
+
+# Form fields that may differ between a request and its retry
+_UNSIGNED_FIELDS = ('csrfmiddlewaretoken', FORM_FIELD)
+
+
+def get_key(request):
+    """The client's idempotency key for this request, or None."""
+    key = request.META.get(HEADER) or request.POST.get(FORM_FIELD)
+    key = (key or '').strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return None
+    return key
+
+
+def _cache_key(scope, request, key):
+    owner = request.user.pk if request.user.is_authenticated else 'anon'
+    digest = hashlib.sha256(f"{scope}:{owner}:{key}".encode()).hexdigest()
+    return f"idempotency:{digest}"
+
+
+def _fingerprint(request):
+    items = sorted(
+        (name, value)
+        for name in request.POST
+        if name not in _UNSIGNED_FIELDS
+        for value in request.POST.getlist(name)
+    )
+    raw = f"{request.path}|{items!r}".encode()
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _store(cache_key, fingerprint, response):
+    cache.set(cache_key, {
+        'state': DONE,
+        'fingerprint': fingerprint,
+        'status': response.status_code,
+        'content': response.content,
+        'content_type': response.get('Content-Type'),
+        'location': response.get('Location'),
+    }, TTL_SECONDS)
+
+
+def _replay(entry):
+    response = HttpResponse(
+        entry['content'],
+        status=entry['status'],
+        content_type=entry['content_type'],
+    )
+    if entry['location']:
+        response['Location'] = entry['location']
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _conflict(message, status):
+    return JsonResponse({'success': False, 'error': message}, status=status)
+
+
+def idempotent(scope):
+    """
+    Make a POST view safe to repeat under the same idempotency key.
+
+    `scope` namespaces the keys, so the same key sent to two different
+    views does not collide.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped(request, *args, **kwargs):
+            if request.method != 'POST':
+                return view_func(request, *args, **kwargs)
+            key = get_key(request)
+            if key is None:
+                return view_func(request, *args, **kwargs)
+
+            cache_key = _cache_key(scope, request, key)
+            fingerprint = _fingerprint(request)
+            deadline = time.monotonic() + WAIT_SECONDS
+
+            while True:
+                claim = {'state': IN_PROGRESS, 'fingerprint': fingerprint}
+                if cache.add(cache_key, claim, LOCK_SECONDS):
+                    break
+
+                entry = cache.get(cache_key)
+                if entry is None:
+                    continue  # freed or expired between add() and get()
+                if entry['fingerprint'] != fingerprint:
+                    logger.warning(f"[IDEMPOTENCY] {scope}: key reused with a different request")
+                    return _conflict('This request key was already used for a different request.', 422)
+                if entry['state'] == DONE:
+                    logger.info(f"[IDEMPOTENCY] {scope}: replayed stored response")
+                    return _replay(entry)
+                if time.monotonic() >= deadline:
+                    return _conflict('Your previous request is still being processed. Please wait.', 409)
+                time.sleep(POLL_INTERVAL_SECONDS)
+
+            try:
+                response = view_func(request, *args, **kwargs)
+            except Exception:
+                cache.delete(cache_key)
+                raise
+
+            if response.status_code >= 500 or response.streaming:
+                cache.delete(cache_key)
+            else:
+                _store(cache_key, fingerprint, response)
+            return response
+
+        return _wrapped
+    return decorator
@@ -0,0 +1,340 @@
+"""
+ZOZAPRIME Inventory Service
+===========================
+Location: events/inventory.py
+
+Stock movements for TicketCategory.available_tickets.
+
+Every movement is a single conditional UPDATE, so no caller ever holds a
+row lock while waiting on the network (M-Pesa PIN entry, Safaricom API,
+email delivery). The database applies the check and the decrement in one
+statement:
+
+    UPDATE ... SET available_tickets = available_tickets - qty
+    WHERE id = ? AND available_tickets >= qty
+
+SHARDED MODE (flash sales):
+  A category with shard_count > 1 keeps its stock in InventoryShard rows.
+  Purchases decrement a random shard, so concurrent buyers hit different
+  rows instead of queueing on the category row. The category's own
+  available_tickets column is a folded snapshot for display — it is
+  refreshed whenever stock is returned or a shard runs dry. Exact reads
+  go through TicketCategory.objects.with_live_stock() / .live_available.
+
+CALLED BY:
+  payments/reservations.py → create_hold(), release_hold(), confirm_hold()
+  events/issuance.py       → issue_tickets() (free RSVPs, via take_stock_many)
+  events/cancellation.py   → cancel_tickets() (via return_stock_many)
+
+These UPDATEs send no model signals, so each movement that changes what
+the public pages show (the category's available_tickets) bumps the
+event's page-cache version itself (events/page_cache.py).
+"""
+import logging
+import random
+
+from django.db import transaction as db_transaction
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from . import page_cache
+from .models import TicketCategory, InventoryShard
+
+logger = logging.getLogger(__name__)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# TAKE / RETURN
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def take_stock(category_id, quantity):
+    """
+    Atomically remove `quantity` tickets from a category.
+    Returns True if the stock was taken, False if not enough was left.
+    """
+    if quantity <= 0:
+        return True
+
+    # Unsharded fast path — shard_count is part of the WHERE clause, so a
+    # sharded category simply matches nothing and falls through.
+    updated = TicketCategory.objects.filter(
+        id=category_id,
+        shard_count__lte=1,
+        available_tickets__gte=quantity,
+    ).update(available_tickets=F('available_tickets') - quantity)
+
+    if updated:
+        page_cache.bump_categories([category_id])
+        return True
+
+    return _take_from_shards(category_id, quantity)
+
+
+def take_stock_many(quantities):
+    """
+    Take stock for several categories at once — all or nothing.
+    `quantities` maps category_id → quantity. Returns True if every
+    category was covered; otherwise nothing is taken and returns False.
+
+    Unsharded categories are decremented by ONE conditional UPDATE
+    (a CASE per category); it must touch every row it targets or the
+    whole movement is rolled back.
+    """
+    quantities = {category_id: qty for category_id, qty in quantities.items() if qty > 0}
+    if not quantities:
+        return True
+
+    shard_counts = dict(
+        TicketCategory.objects.filter(id__in=quantities).values_list('id', 'shard_count')
+    )
+    if len(shard_counts) != len(quantities):
+        return False
+    unsharded = [category_id for category_id, count in shard_counts.items() if count <= 1]
+    sharded = [category_id for category_id, count in shard_counts.items() if count > 1]
+
+    try:
+        with db_transaction.atomic():
+            if unsharded:
+                covered = Q()
+                for category_id in unsharded:
+                    covered |= Q(id=category_id, available_tickets__gte=quantities[category_id])
+                updated = TicketCategory.objects.filter(covered, shard_count__lte=1).update(
+                    available_tickets=Case(
+                        *[
+                            When(id=category_id, then=F('available_tickets') - quantities[category_id])
+                            for category_id in unsharded
+                        ],
+                        default=F('available_tickets'),
+                        output_field=IntegerField(),
+                    )
+                )
+                if updated != len(unsharded):
+                    raise _NotCovered()
+                page_cache.bump_categories(unsharded)
+
+            for category_id in sharded:
+                if not _take_from_shards(category_id, quantities[category_id]):
+                    raise _NotCovered()
+    except _NotCovered:
+        return False
+    return True
+
+
+class _NotCovered(Exception):
+    """Rolls back a partial take_stock_many()."""
+
+
+def return_stock_many(quantities):
+    """
+    Put stock back for several categories at once (cancellations).
+    `quantities` maps category_id → quantity. Unsharded categories get
+    ONE CASE UPDATE; sharded ones go back through return_stock().
+    """
+    quantities = {category_id: qty for category_id, qty in quantities.items() if qty > 0}
+    if not quantities:
+        return
+
+    sharded = set(
+        TicketCategory.objects.filter(id__in=quantities, shard_count__gt=1).values_list('id', flat=True)
+    )
+    unsharded = [category_id for category_id in quantities if category_id not in sharded]
+
+    if unsharded:
+        TicketCategory.objects.filter(id__in=unsharded, shard_count__lte=1).update(
+            available_tickets=Case(
+                *[
+                    When(id=category_id, then=F('available_tickets') + quantities[category_id])
+                    for category_id in unsharded
+                ],
+                default=F('available_tickets'),
+                output_field=IntegerField(),
+            )
+        )
+        page_cache.bump_categories(unsharded)
+    for category_id in sharded:
+        return_stock(category_id, quantities[category_id])
+
+
+def return_stock(category_id, quantity):
+    """Atomically put `quantity` tickets back into a category."""
+    if quantity <= 0:
+        return
+
+    updated = TicketCategory.objects.filter(
+        id=category_id,
+        shard_count__lte=1,
+    ).update(available_tickets=F('available_tickets') + quantity)
+
+    if updated:
+        page_cache.bump_categories([category_id])
+        return
+
+    shard_ids = list(
+        InventoryShard.objects.filter(category_id=category_id).values_list('id', flat=True)
+    )
+    if not shard_ids:
+        return
+
+    InventoryShard.objects.filter(id=random.choice(shard_ids)).update(
+        available=F('available') + quantity
+    )
+    fold_shards(category_id)
+
+
+def _take_from_shards(category_id, quantity):
+    """Decrement one random shard that can cover the whole quantity."""
+    candidates = list(
+        InventoryShard.objects.filter(
+            category_id=category_id,
+            available__gte=quantity,
+        ).values_list('id', flat=True)
+    )
+    random.shuffle(candidates)
+
+    for shard_id in candidates:
+        updated = InventoryShard.objects.filter(
+            id=shard_id,
+            available__gte=quantity,
+        ).update(available=F('available') - quantity)
+
+        if updated:
+            if not InventoryShard.objects.filter(id=shard_id, available__gt=0).exists():
+                fold_shards(category_id)
+            return True
+
+    # No single shard can cover it — either sold out, or the remaining
+    # stock is spread thin across shards. Drain across them under lock.
+    return _take_across_shards(category_id, quantity)
+
+
+def _take_across_shards(category_id, quantity):
+    with db_transaction.atomic():
+        shards = list(
+            InventoryShard.objects.select_for_update().filter(
+                category_id=category_id,
+                available__gt=0,
+            ).order_by('index')
+        )
+        if sum(shard.available for shard in shards) < quantity:
+            return False
+
+        remaining = quantity
+        for shard in shards:
+            if not remaining:
+                break
+            take = min(shard.available, remaining)
+            shard.available -= take
+            remaining -= take
+        InventoryShard.objects.bulk_update(shards, ['available'])
+
+    fold_shards(category_id)
+    return True
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SHARD MANAGEMENT
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def fold_shards(category_id):
+    """Write the exact shard total back into the category's available_tickets."""
+    total = InventoryShard.objects.filter(category_id=category_id).aggregate(
+        total=Sum('available')
+    )['total'] or 0
+
+    TicketCategory.objects.filter(id=category_id, shard_count__gt=1).update(
+        available_tickets=total
+    )
+    page_cache.bump_categories([category_id])
+    return total
+
+
+def enable_sharding(category, shard_count):
+    """
+    Split a category's current stock evenly across `shard_count` shard rows.
+    Calling it again re-balances the existing stock over the new count.
+    shard_count is set here, with the shards, in one transaction — never
+    by saving the category.
+    """
+    if shard_count <= 1:
+        return disable_sharding(category)
+
+    with db_transaction.atomic():
+        category = TicketCategory.objects.select_for_update().get(pk=category.pk)
+        total = _current_total(category)
+        _spread(category, total, shard_count)
+
+    logger.info(f"[INVENTORY] Category {category.pk}: {total} tickets over {shard_count} shards")
+    return total
+
+
+def disable_sharding(category):
+    """Fold all shards back into the category row and drop them."""
+    with db_transaction.atomic():
+        category = TicketCategory.objects.select_for_update().get(pk=category.pk)
+        total = _current_total(category)
+
+        InventoryShard.objects.filter(category=category).delete()
+        TicketCategory.objects.filter(pk=category.pk).update(
+            shard_count=1,
+            available_tickets=total,
+        )
+        page_cache.bump_categories([category.pk])
+
+    return total
+
+
+def _spread(category, total, shard_count):
+    """Replace the shards with `shard_count` rows holding `total` evenly (category row locked)."""
+    InventoryShard.objects.filter(category=category).delete()
+
+    base, extra = divmod(total, shard_count)
+    InventoryShard.objects.bulk_create([
+        InventoryShard(
+            category=category,
+            index=i,
+            available=base + (1 if i < extra else 0),
+        )
+        for i in range(shard_count)
+    ])
+
+    TicketCategory.objects.filter(pk=category.pk).update(
+        shard_count=shard_count,
+        available_tickets=total,
+    )
+    page_cache.bump_categories([category.pk])
+
+
+def _current_total(category):
+    """Stock held by a category — its shards if it has any, else its own column."""
+    shards = InventoryShard.objects.filter(category=category)
+    if shards.exists():
+        return shards.aggregate(total=Sum('available'))['total'] or 0
+    return category.available_tickets
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CAPACITY EDITS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def adjust_stock(category_id, delta):
+    """
+    Apply a seller or admin stock edit as a move of `delta` tickets, so
+    sales made while the form was open are kept. Never goes below zero.
+    Sharded categories are re-spread evenly over their shards. Returns the
+    new stock.
+    """
+    with db_transaction.atomic():
+        category = TicketCategory.objects.select_for_update().get(pk=category_id)
+        if category.is_sharded:
+            total = max(0, _current_total(category) + delta)
+            _spread(category, total, category.shard_count)
+        else:
+            if delta:
+                TicketCategory.objects.filter(pk=category_id).update(
+                    available_tickets=Greatest(F('available_tickets') + delta, Value(0))
+                )
+                page_cache.bump_categories([category_id])
+            total = TicketCategory.objects.values_list('available_tickets', flat=True).get(pk=category_id)
+
+    logger.info(f"[INVENTORY] Category {category_id}: stock moved by {delta:+d} to {total}")
+    return total
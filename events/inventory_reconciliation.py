@@ -0,0 +1,238 @@
+"""
+ZOZAPRIME Inventory Reconciliation
+==================================
+Location: events/inventory_reconciliation.py
+
+Finds (and optionally repairs) stock that has drifted from what the sales
+records say it should be.
+
+For every category:
+
+    expected = initial_tickets - sold - held
+    sold     = Sum(Ticket.quantity), every status except cancelled
+    held     = Sum(TicketReservation.quantity) still 'held'
+
+sold and held are each ONE grouped aggregate over the whole table, and
+categories are streamed, so 100k+ categories cost three queries plus the
+repair writes. Events get total_tickets = Sum(initial_tickets) and
+available_tickets = Sum(live stock) of their categories.
+
+REPAIR:
+  Drift is only repaired if a second read shows the same drift — a
+  purchase between take_stock() and its reservation row looks like
+  drift for a moment. Stock is then shifted BY the drift
+  (available_tickets = available_tickets + delta), one UPDATE per
+  batch of categories with the same delta, so sales that land between
+  the read and the write are preserved. Sharded categories are
+  rebalanced under a row lock. A category that sold more than it ever
+  had (expected < 0) is reported as oversold and set to 0.
+
+    python manage.py reconcile_inventory [--repair] [--json PATH]
+"""
+import logging
+import time
+
+from django.apps import apps
+from django.db import transaction as db_transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .inventory import fold_shards
+from .models import Event, InventoryShard, Ticket, TicketCategory
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+# Drift rows listed in full in the report (counts always cover everything)
+REPORT_LIMIT = 1000
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# SNAPSHOT
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _grouped(queryset, category_ids=None):
+    if category_ids is not None:
+        queryset = queryset.filter(ticket_category_id__in=category_ids)
+    return dict(
+        queryset.values('ticket_category_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('ticket_category_id', 'total')
+    )
+
+
+def _snapshot(category_ids=None, event_id=None):
+    """{category_id: row} with stored, sold, held and expected stock."""
+    TicketReservation = apps.get_model('payments', 'TicketReservation')
+
+    categories = TicketCategory.objects.with_live_stock()
+    if category_ids is not None:
+        categories = categories.filter(id__in=category_ids)
+    if event_id is not None:
+        categories = categories.filter(event_id=event_id)
+
+    sold = _grouped(Ticket.objects.exclude(status='cancelled'), category_ids)
+    held = _grouped(TicketReservation.objects.filter(status='held'), category_ids)
+
+    rows = {}
+    for category_id, event, initial, live, shard_count in categories.values_list(
+        'id', 'event_id', 'initial_tickets', '_live_available', 'shard_count'
+    ).iterator(chunk_size=5000):
+        category_sold = sold.get(category_id, 0)
+        category_held = held.get(category_id, 0)
+        rows[category_id] = {
+            'category_id': category_id,
+            'event_id': event,
+            'initial': initial,
+            'sold': category_sold,
+            'held': category_held,
+            'available': live,
+            'expected': initial - category_sold - category_held,
+            'sharded': shard_count > 1,
+        }
+    return rows
+
+
+def _drifted(rows):
+    return {
+        category_id: row for category_id, row in rows.items()
+        if row['available'] != max(row['expected'], 0)
+    }
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# REPAIR
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _repair_unsharded(rows):
+    """
+    Shift each category's stock by its drift with F() updates, grouped by
+    drift so a whole batch is one statement. A relative correction stays
+    right even if tickets sell between the read and the write.
+    """
+    by_delta = {}
+    for row in rows:
+        delta = max(row['expected'], 0) - row['available']
+        by_delta.setdefault(delta, []).append(row['category_id'])
+
+    repaired = set()
+    for delta, ids in by_delta.items():
+        for start in range(0, len(ids), BATCH_SIZE):
+            chunk = ids[start:start + BATCH_SIZE]
+            targets = TicketCategory.objects.filter(
+                id__in=chunk,
+                shard_count__lte=1,
+                available_tickets__gte=max(0, -delta),
+            )
+            if delta < 0 and targets.count() != len(chunk):
+                chunk = list(targets.values_list('id', flat=True))
+                targets = TicketCategory.objects.filter(id__in=chunk)
+            targets.update(available_tickets=F('available_tickets') + delta)
+            repaired.update(chunk)
+    return repaired
+
+
+def _repair_sharded(row):
+    """Shift a sharded category's total by its drift and spread it over the shards."""
+    delta = max(row['expected'], 0) - row['available']
+    with db_transaction.atomic():
+        shards = list(
+            InventoryShard.objects.select_for_update()
+            .filter(category_id=row['category_id'])
+            .order_by('index')
+        )
+        if not shards:
+            return False
+        total = max(sum(shard.available for shard in shards) + delta, 0)
+        base, extra = divmod(total, len(shards))
+        for i, shard in enumerate(shards):
+            shard.available = base + (1 if i < extra else 0)
+        InventoryShard.objects.bulk_update(shards, ['available'])
+    fold_shards(row['category_id'])
+    return True
+
+
+def _event_totals(rows):
+    """Sum(initial) and Sum(live stock) per event from the snapshot."""
+    totals = {}
+    for row in rows.values():
+        total, available = totals.get(row['event_id'], (0, 0))
+        totals[row['event_id']] = (total + row['initial'], available + row['available'])
+    return totals
+
+
+def _repair_events(rows):
+    totals = _event_totals(rows)
+    stale = []
+    for event_id, stored_total, stored_available in Event.objects.filter(
+        id__in=list(totals)
+    ).values_list('id', 'total_tickets', 'available_tickets').iterator(chunk_size=5000):
+        total, available = totals[event_id]
+        if (stored_total, stored_available) != (total, available):
+            stale.append(Event(id=event_id, total_tickets=total, available_tickets=available))
+    Event.objects.bulk_update(stale, ['total_tickets', 'available_tickets'], batch_size=BATCH_SIZE)
+    return len(stale)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ENTRY POINT
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def reconcile_inventory(repair=False, event_id=None):
+    """Check every category (or one event's); repair drift if asked. Returns the report."""
+    started = time.perf_counter()
+
+    rows = _snapshot(event_id=event_id)
+    drifted = _drifted(rows)
+    confirmed = {}
+    if drifted:
+        ids = list(drifted)
+        for start in range(0, len(ids), BATCH_SIZE):
+            again = _drifted(_snapshot(category_ids=ids[start:start + BATCH_SIZE]))
+            confirmed.update({
+                category_id: row for category_id, row in again.items()
+                if row['available'] - row['expected'] == drifted[category_id]['available'] - drifted[category_id]['expected']
+            })
+
+    repaired = set()
+    events_repaired = 0
+    if repair:
+        repaired = _repair_unsharded([row for row in confirmed.values() if not row['sharded']])
+        for row in confirmed.values():
+            if row['sharded'] and _repair_sharded(row):
+                repaired.add(row['category_id'])
+        for category_id in repaired:
+            rows[category_id]['available'] = max(rows[category_id]['expected'], 0)
+        events_repaired = _repair_events(rows)
+
+    details = []
+    for row in confirmed.values():
+        details.append({
+            **row,
+            'drift': row['available'] - max(row['expected'], 0),
+            'oversold': max(0, -row['expected']),
+            'repaired': row['category_id'] in repaired,
+        })
+    details.sort(key=lambda d: abs(d['drift']), reverse=True)
+
+    report = {
+        'generated_at': timezone.now().isoformat(),
+        'repair': repair,
+        'event_id': event_id,
+        'categories_checked': len(rows),
+        'drifted': len(confirmed),
+        'transient': len(drifted) - len(confirmed),
+        'oversold': sum(1 for d in details if d['oversold']),
+        'tickets_missing': sum(-d['drift'] for d in details if d['drift'] < 0),
+        'tickets_extra': sum(d['drift'] for d in details if d['drift'] > 0),
+        'repaired': len(repaired),
+        'skipped': len(confirmed) - len(repaired) if repair else 0,
+        'events_repaired': events_repaired,
+        'elapsed_s': round(time.perf_counter() - started, 2),
+        'categories': details[:REPORT_LIMIT],
+    }
+    logger.info(
+        f"[STOCK] Checked {report['categories_checked']} categories: {report['drifted']} drifted, "
+        f"{report['oversold']} oversold, {report['repaired']} repaired ({report['elapsed_s']}s)"
+    )
+    return report
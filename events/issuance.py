@@ -0,0 +1,131 @@
+"""
+ZOZAPRIME Ticket Issuance
+=========================
+Location: events/issuance.py
+
+One set-based path for turning an order into Ticket rows, shared by paid
+M-Pesa orders and free RSVPs.
+
+  1. codes    all ticket codes for the order in one allocate_many() call
+              (before any write, so the allocator's block reservation
+              never waits on this transaction's locks)
+  2. stock    take_stock_many() — every category in one conditional
+              UPDATE. Skipped for paid orders: their stock was already
+              held at STK push time (payments/reservations.py).
+  3. tickets  one bulk_create
+  4. counters sold / confirmed / revenue shifted per category and event
+              (events/sales_counters.py)
+  all inside one atomic block — a sold-out category issues nothing.
+
+PER-ADMISSION TICKETS (TICKETS_PER_ADMISSION):
+  A bundle (Couple Pass, Table of 8) normally gets one ticket admitting
+  bundle_size people. Per-admission mode issues one ticket per person
+  instead: per bundle bought, a lead ticket carrying quantity 1 and the
+  price, plus bundle_size - 1 guest tickets with quantity 0 — so
+  Sum('quantity') and revenue still count bundles sold, not people.
+
+CALLED BY:
+  events/views.py      → handle_free_rsvp()
+  payments/services.py → MpesaService._create_ticket_from_txn()
+"""
+import logging
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+
+from .inventory import take_stock_many
+from .models import Ticket, TicketCategory
+from .sales_counters import record_issued
+from .ticket_codes import allocate_ticket_codes
+
+logger = logging.getLogger(__name__)
+
+PER_ADMISSION = getattr(settings, 'TICKETS_PER_ADMISSION', False)
+
+
+class SoldOut(Exception):
+    """Not enough stock left for one of the order's categories."""
+
+    def __init__(self, category, available):
+        self.category = category
+        self.available = available
+        super().__init__(f"Only {available} left for {category.name}")
+
+
+def issue_tickets(event, selections, buyer_name, buyer_email, buyer_phone='',
+                  buyer=None, transaction=None, transaction_code=None,
+                  take_stock=True, per_admission=None):
+    """
+    Issue confirmed tickets for an order. Returns the list of Tickets.
+
+    `selections` is a list of dicts with 'category', 'quantity' and
+    optionally 'unit_price' (defaults to the category's effective price)
+    and 'total' (the amount actually charged, e.g. after a promo code).
+    Raises SoldOut — with nothing issued — if take_stock is set and a
+    category cannot cover its quantity.
+    """
+    if per_admission is None:
+        per_admission = PER_ADMISSION
+
+    rows = []
+    for selection in selections:
+        category = selection['category']
+        quantity = selection['quantity']
+        unit_price = Decimal(str(selection.get('unit_price', category.effective_price)))
+        total = Decimal(str(selection.get('total', unit_price * quantity)))
+
+        if per_admission and category.bundle_size > 1:
+            per_bundle = (total / quantity).quantize(Decimal('0.01'))
+            for n in range(quantity):
+                # Last lead ticket absorbs the rounding, so totals add up exactly
+                lead_total = total - per_bundle * (quantity - 1) if n == quantity - 1 else per_bundle
+                rows.append((category, 1, unit_price, lead_total))
+                rows.extend((category, 0, unit_price, Decimal('0.00')) for _ in range(category.bundle_size - 1))
+        else:
+            rows.append((category, quantity, unit_price, total))
+
+    codes = allocate_ticket_codes(len(rows))
+    tickets = [
+        Ticket(
+            event=event,
+            ticket_category=category,
+            buyer=buyer,
+            buyer_name=buyer_name,
+            buyer_email=buyer_email,
+            buyer_phone=buyer_phone or '',
+            quantity=quantity,
+            unit_price=unit_price,
+            total_amount=total,
+            ticket_code=code,
+            transaction_code=transaction_code,
+            transaction=transaction,
+            status='confirmed',
+        )
+        for (category, quantity, unit_price, total), code in zip(rows, codes)
+    ]
+
+    with db_transaction.atomic():
+        if take_stock:
+            wanted = {}
+            for selection in selections:
+                category_id = selection['category'].id
+                wanted[category_id] = wanted.get(category_id, 0) + selection['quantity']
+
+            if not take_stock_many(wanted):
+                short = _first_short_category(wanted) or selections[0]['category']
+                raise SoldOut(short, short.live_available)
+
+        tickets = Ticket.objects.bulk_create(tickets)
+        record_issued(tickets)
+
+    logger.info(f"[ISSUE] {len(tickets)} ticket(s) for {buyer_email} — event {event.pk}")
+    return tickets
+
+
+def _first_short_category(wanted):
+    categories = TicketCategory.objects.with_live_stock().filter(id__in=wanted)
+    for category in categories:
+        if category.live_available < wanted[category.id]:
+            return category
+    return None
@@ -0,0 +1,110 @@
+"""
+Benchmark concurrent ticket purchases against one hot TicketCategory.
+
+    python manage.py bench_inventory --threads 32 --purchases 4000 --shards 1 16
+
+Each run seeds a throwaway event with enough stock for every purchase,
+fires `--purchases` take_stock() calls from `--threads` worker threads,
+and reports purchases/sec. Run it against PostgreSQL for meaningful
+numbers — SQLite serialises all writers on a single database lock, so
+sharding cannot help there.
+"""
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, close_old_connections
+from django.utils import timezone
+
+from events.inventory import take_stock, enable_sharding
+from events.models import Event, TicketCategory, User
+
+
+class Command(BaseCommand):
+    help = 'Benchmark purchases/sec on a hot ticket category with and without sharded counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--purchases', type=int, default=2000)
+        parser.add_argument('--shards', type=int, nargs='+', default=[1, 16])
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        purchases = options['purchases']
+
+        self.stdout.write(
+            f"Backend: {connection.vendor} | threads={threads} | purchases={purchases}"
+        )
+
+        organizer, _ = User.objects.get_or_create(
+            username='bench_inventory', defaults={'is_seller': True}
+        )
+
+        for shard_count in options['shards']:
+            event = Event.objects.create(
+                organizer=organizer,
+                title=f"Inventory bench {uuid.uuid4().hex[:8]}",
+                description='Benchmark event',
+                date=timezone.now() + timedelta(days=30),
+                location='Benchmark',
+                is_active=False,
+            )
+            category = TicketCategory.objects.create(
+                event=event,
+                name='Early Bird',
+                price=1000,
+                available_tickets=purchases,
+            )
+            if shard_count > 1:
+                enable_sharding(category, shard_count)
+
+            try:
+                elapsed, sold, failed = self._run(category.id, threads, purchases)
+                category = TicketCategory.objects.with_live_stock().get(pk=category.pk)
+                self.stdout.write(
+                    f"shards={shard_count:>3}  {sold / elapsed:>9.1f} purchases/sec  "
+                    f"sold={sold} failed={failed} left={category.live_available} "
+                    f"({elapsed:.2f}s)"
+                )
+            finally:
+                event.delete()
+
+    def _run(self, category_id, threads, purchases):
+        per_thread, remainder = divmod(purchases, threads)
+        counts = {'sold': 0, 'failed': 0}
+        lock = threading.Lock()
+        start_gate = threading.Barrier(threads)
+
+        def worker(n):
+            sold = failed = 0
+            try:
+                start_gate.wait()
+                for _ in range(n):
+                    try:
+                        if take_stock(category_id, 1):
+                            sold += 1
+                        else:
+                            failed += 1
+                    except Exception:
+                        failed += 1
+            finally:
+                close_old_connections()
+                connection.close()
+            with lock:
+                counts['sold'] += sold
+                counts['failed'] += failed
+
+        pool = [
+            threading.Thread(target=worker, args=(per_thread + (1 if i < remainder else 0),))
+            for i in range(threads)
+        ]
+        started = time.perf_counter()
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        return elapsed, counts['sold'], counts['failed']
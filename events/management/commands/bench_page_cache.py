@@ -0,0 +1,125 @@
+"""
+Benchmark the public event pages with and without their cached fragments.
+
+    python manage.py bench_page_cache --requests 200 --write-every 20 [--seed 50]
+
+For home, event_list and up to `--details` event pages it reports the
+mean latency and query count with every fragment cold (all event versions
+bumped before each request) and warm. It then replays `--requests` mixed
+page views, bumping one random event every `--write-every` requests as a
+sale would, and reports the fragment hit ratio. `--seed` adds throwaway
+active events (deleted afterwards) when the database has too few.
+"""
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from events import page_cache
+from events.models import Event, TicketCategory, User
+
+
+class Command(BaseCommand):
+    help = 'Benchmark public page latency and fragment hit ratio with the page cache cold and warm'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--rounds', type=int, default=10)
+        parser.add_argument('--write-every', type=int, default=20)
+        parser.add_argument('--details', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        seeded = self._seed(options['seed']) if options['seed'] else []
+        try:
+            self._run(options)
+        finally:
+            for event in seeded:
+                event.delete()
+
+    def _run(self, options):
+        host = next((h for h in settings.ALLOWED_HOSTS if h and '*' not in h), 'localhost').lstrip('.')
+        client = Client(HTTP_HOST=host)
+
+        event_ids = list(Event.objects.filter(is_active=True).values_list('id', flat=True))
+        slugs = list(
+            Event.objects.filter(is_active=True, slug__isnull=False)
+            .order_by('date').values_list('slug', flat=True)[:options['details']]
+        )
+        pages = [reverse('home'), reverse('event_list')] + [reverse('event_detail', args=[s]) for s in slugs]
+        self.stdout.write(f"Backend: {connection.vendor} | active events={len(event_ids)} | pages={len(pages)}")
+
+        rounds = options['rounds']
+        cold_ms, warm_ms = [], []
+        for path in pages:
+            cold = [self._get(client, path, before=lambda: page_cache.bump_now(event_ids)) for _ in range(rounds)]
+            self._get(client, path)
+            warm = [self._get(client, path) for _ in range(rounds)]
+
+            cold_mean = statistics.mean(ms for ms, _ in cold)
+            warm_mean = statistics.mean(ms for ms, _ in warm)
+            cold_ms.append(cold_mean)
+            warm_ms.append(warm_mean)
+            self.stdout.write(
+                f"{path:<40} cold {cold_mean:>7.1f}ms {cold[-1][1]:>3}q   "
+                f"warm {warm_mean:>7.1f}ms {warm[-1][1]:>3}q   x{cold_mean / warm_mean:.1f}"
+            )
+
+        page_cache.reset_stats()
+        write_every = options['write_every']
+        mixed = []
+        for n in range(options['requests']):
+            if write_every and n and n % write_every == 0 and event_ids:
+                page_cache.bump_now([random.choice(event_ids)])
+            mixed.append(self._get(client, random.choice(pages))[0])
+
+        stats = page_cache.stats()
+        self.stdout.write(
+            f"all pages: cold {statistics.mean(cold_ms):.1f}ms -> warm {statistics.mean(warm_ms):.1f}ms"
+        )
+        self.stdout.write(
+            f"mixed ({options['requests']} requests, 1 write / {write_every}): "
+            f"mean {statistics.mean(mixed):.1f}ms  hit ratio {stats['hit_rate']}% "
+            f"(hits={stats['hits']} misses={stats['misses']} bumps={stats['bumps']})"
+        )
+
+    def _get(self, client, path, before=None):
+        if before:
+            before()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(path, secure=True)
+            elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}")
+        return elapsed, len(queries)
+
+    def _seed(self, count):
+        organizer, _ = User.objects.get_or_create(
+            username='bench_page_cache', defaults={'is_seller': True}
+        )
+        events = []
+        for i in range(count):
+            event = Event.objects.create(
+                organizer=organizer,
+                title=f"Page cache bench {uuid.uuid4().hex[:8]}",
+                description='Benchmark event',
+                date=timezone.now() + timedelta(days=7 + i),
+                location='Benchmark',
+            )
+            TicketCategory.objects.bulk_create([
+                TicketCategory(event=event, name='Regular', price=1000, available_tickets=100, initial_tickets=100),
+                TicketCategory(event=event, name='VIP', price=5000, available_tickets=20, initial_tickets=20),
+                TicketCategory(event=event, name='Free', price=0, is_free=True, available_tickets=50, initial_tickets=50),
+            ])
+            events.append(event)
+        return events
@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from events.inventory_reconciliation import reconcile_inventory
+
+
+class Command(BaseCommand):
+    help = 'Compare ticket stock with sales and holds; optionally repair drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help='Write the expected stock back (default: report only)')
+        parser.add_argument('--event', type=int, help='Only this event ID')
+        parser.add_argument('--json', metavar='PATH',
+                            help="Write the report as JSON ('-' for stdout)")
+
+    def handle(self, *args, **options):
+        report = reconcile_inventory(repair=options['repair'], event_id=options['event'])
+
+        if options['json'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if options['json']:
+            with open(options['json'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+
+        for row in report['categories'][:20]:
+            self.stdout.write(
+                f"category {row['category_id']:>7} (event {row['event_id']}): "
+                f"stock {row['available']}, expected {max(row['expected'], 0)} "
+                f"[initial {row['initial']} - sold {row['sold']} - held {row['held']}]"
+                f"{'  OVERSOLD ' + str(row['oversold']) if row['oversold'] else ''}"
+                f"{'  repaired' if row['repaired'] else ''}"
+            )
+
+        style = self.style.SUCCESS if not report['drifted'] else self.style.WARNING
+        self.stdout.write(style(
+            f"{report['categories_checked']} categories in {report['elapsed_s']}s: "
+            f"{report['drifted']} drifted ({report['tickets_missing']} missing, "
+            f"{report['tickets_extra']} extra), {report['oversold']} oversold, "
+            f"{report['repaired']} repaired, {report['events_repaired']} event totals fixed"
+        ))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from events.platform_metrics import REFRESH_SECONDS, refresh_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Recompute the admin dashboard metrics snapshot (once, or every few minutes with --loop)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Rebuild the 30-day chart series and buyer counts instead of only what changed')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep refreshing until interrupted')
+        parser.add_argument('--every', type=float, default=REFRESH_SECONDS,
+                            help='Seconds between refreshes (with --loop)')
+
+    def handle(self, *args, **options):
+        full = options['full']
+        try:
+            while True:
+                snapshot = refresh_snapshot(full=full)
+                if snapshot is None:
+                    self.stdout.write(self.style.WARNING('Another refresh is running; skipped'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"Metrics snapshot computed at {snapshot.computed_at:%Y-%m-%d %H:%M:%S} "
+                        f"in {snapshot.duration_ms}ms"
+                    ))
+                if not options['loop']:
+                    break
+                if snapshot is not None:
+                    full = False  # later rounds are incremental
+                time.sleep(options['every'])
+        except KeyboardInterrupt:
+            pass
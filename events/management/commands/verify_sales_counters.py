@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from events.sales_counters import verify_sales_counters
+
+
+class Command(BaseCommand):
+    help = 'Compare the denormalized sales counters with the ticket rows; optionally rebuild them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Rewrite stale counters from the ticket rows (default: report only)')
+        parser.add_argument('--event', type=int, help='Only this event ID')
+        parser.add_argument('--json', metavar='PATH',
+                            help="Write the report as JSON ('-' for stdout)")
+
+    def handle(self, *args, **options):
+        report = verify_sales_counters(rebuild=options['rebuild'], event_id=options['event'])
+
+        if options['json'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if options['json']:
+            with open(options['json'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+
+        for row in report['rows'][:20]:
+            stored, expected = row['stored'], row['expected']
+            self.stdout.write(
+                f"{row['model']} {row['id']:>7}: "
+                f"sold {stored['sold_count']} (expected {expected['sold_count']}), "
+                f"confirmed {stored['confirmed_count']} (expected {expected['confirmed_count']}), "
+                f"revenue {stored['revenue']} (expected {expected['revenue']})"
+            )
+
+        stale = report['stale_categories'] + report['stale_events']
+        style = self.style.SUCCESS if not stale else self.style.WARNING
+        self.stdout.write(style(
+            f"{report['stale_categories']} stale categories, {report['stale_events']} stale events "
+            f"in {report['elapsed_s']}s{' — rebuilt' if report['rebuild'] and stale else ''}"
+        ))
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0015_event_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticketcategory',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Split stock across N counter rows for high-demand drops (1 = off)'),
+        ),
+        migrations.CreateModel(
+            name='InventoryShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('available', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_shards', to='events.ticketcategory')),
+            ],
+            options={
+                'ordering': ['category', 'index'],
+                'unique_together': {('category', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0016_inventory_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WaitingRoom',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_active', models.BooleanField(default=True)),
+                ('opens_at', models.DateTimeField(default=django.utils.timezone.now, help_text='When admissions start — usually the ticket sales start')),
+                ('admit_per_second', models.PositiveIntegerField(default=10, help_text='How many fans are let through to checkout each second')),
+                ('admission_minutes', models.PositiveIntegerField(default=15, help_text='How long an admitted fan may stay in checkout')),
+                ('next_position', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='waiting_room', to='events.event')),
+            ],
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_transaction_queued_status'),
+        ('events', '0017_waitingroom'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='transaction',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tickets', to='payments.transaction'),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='transaction_code',
+            field=models.CharField(blank=True, db_index=True, max_length=50, null=True),
+        ),
+    ]
@@ -0,0 +1,87 @@
+from collections import defaultdict
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def link_tickets(apps, schema_editor):
+    """
+    Point legacy tickets at the transaction that produced them.
+
+    Tickets carried the payment only as a string in transaction_code —
+    the M-Pesa receipt, TXN_<transaction_id> or QUERY_<transaction_id>.
+    Resolve those in bulk; successful transactions still without a ticket
+    are then matched on buyer details, amount and time order.
+    """
+    Ticket = apps.get_model('events', 'Ticket')
+    Transaction = apps.get_model('payments', 'Transaction')
+
+    code_to_txn = {}
+    for txn_id, receipt in Transaction.objects.values_list('transaction_id', 'receipt_number').iterator():
+        code_to_txn[f"TXN_{txn_id}"] = txn_id
+        code_to_txn[f"QUERY_{txn_id}"] = txn_id
+        if receipt:
+            code_to_txn[receipt] = txn_id
+
+    pending = []
+    unlinked = Ticket.objects.filter(transaction__isnull=True, transaction_code__isnull=False)
+    for ticket in unlinked.only('id', 'transaction_code').iterator():
+        txn_id = code_to_txn.get(ticket.transaction_code)
+        if txn_id:
+            ticket.transaction_id = txn_id
+            pending.append(ticket)
+        if len(pending) >= BATCH_SIZE:
+            Ticket.objects.bulk_update(pending, ['transaction'])
+            pending = []
+    if pending:
+        Ticket.objects.bulk_update(pending, ['transaction'])
+
+    # Same fallback ticket_confirmation used to apply on every page view,
+    # made deterministic: per event, category and buyer email, payments in
+    # time order each take the oldest unlinked ticket for the same amount
+    # issued no earlier than the payment. A repeat buyer's tickets then go
+    # to the right payment, and an ambiguous one stays unlinked.
+    orphans = defaultdict(list)
+    for txn in (
+        Transaction.objects.filter(status='success', tickets__isnull=True)
+        .order_by('timestamp', 'transaction_id')
+        .values('transaction_id', 'event_id', 'ticket_category_id', 'buyer_email', 'amount', 'timestamp')
+        .iterator()
+    ):
+        key = (txn['event_id'], txn['ticket_category_id'], txn['buyer_email'])
+        orphans[key].append(txn)
+    if not orphans:
+        return
+
+    candidates = defaultdict(list)
+    unlinked = (
+        Ticket.objects.filter(transaction__isnull=True, event_id__in={key[0] for key in orphans})
+        .order_by('purchased_at', 'id')
+        .only('id', 'event_id', 'ticket_category_id', 'buyer_email', 'total_amount', 'purchased_at')
+    )
+    for ticket in unlinked.iterator():
+        key = (ticket.event_id, ticket.ticket_category_id, ticket.buyer_email)
+        if key in orphans:
+            candidates[key].append(ticket)
+
+    linked = []
+    for key, txns in orphans.items():
+        tickets = candidates.get(key, [])
+        for txn in txns:
+            for i, ticket in enumerate(tickets):
+                if ticket.purchased_at >= txn['timestamp'] and ticket.total_amount == txn['amount']:
+                    ticket.transaction_id = txn['transaction_id']
+                    linked.append(tickets.pop(i))
+                    break
+    Ticket.objects.bulk_update(linked, ['transaction'], batch_size=BATCH_SIZE)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0018_ticket_transaction'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_tickets, migrations.RunPython.noop),
+    ]
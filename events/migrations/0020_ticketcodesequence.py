@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:03
+
+import secrets
+
+from django.db import migrations, models
+
+
+def create_ticket_sequence(apps, schema_editor):
+    TicketCodeSequence = apps.get_model('events', 'TicketCodeSequence')
+    TicketCodeSequence.objects.get_or_create(
+        name='ticket',
+        defaults={'key': secrets.token_hex(32)},
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0019_backfill_ticket_transaction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketCodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.BigIntegerField(default=0)),
+                ('key', models.CharField(max_length=64)),
+            ],
+        ),
+        migrations.RunPython(create_ticket_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:21
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Q, Sum
+
+BATCH_SIZE = 1000
+
+
+def fill_counters(apps, schema_editor):
+    """Seed the sales counters from the existing ticket rows, one grouped query per model."""
+    Ticket = apps.get_model('events', 'Ticket')
+    TicketCategory = apps.get_model('events', 'TicketCategory')
+    Event = apps.get_model('events', 'Event')
+
+    for model, group_field in ((TicketCategory, 'ticket_category_id'), (Event, 'event_id')):
+        rows = (
+            Ticket.objects.exclude(status='cancelled')
+            .filter(**{f'{group_field}__isnull': False})
+            .order_by().values(group_field)
+            .annotate(
+                sold=Sum('quantity'),
+                confirmed=Sum('quantity', filter=Q(status='confirmed')),
+                total=Sum('total_amount'),
+            )
+            .values_list(group_field, 'sold', 'confirmed', 'total')
+        )
+        pending = [
+            model(id=pk, sold_count=sold or 0, confirmed_count=confirmed or 0, revenue=total or Decimal('0.00'))
+            for pk, sold, confirmed, total in rows
+        ]
+        model.objects.bulk_update(pending, ['sold_count', 'confirmed_count', 'revenue'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0021_metricssnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='confirmed_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='revenue',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='sold_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ticketcategory',
+            name='confirmed_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ticketcategory',
+            name='revenue',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='ticketcategory',
+            name='sold_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+BATCH_SIZE = 1000
+
+
+def fill_sales_daily(apps, schema_editor):
+    """Seed the rollup from the existing tickets — one grouped query."""
+    Ticket = apps.get_model('events', 'Ticket')
+    SalesDaily = apps.get_model('events', 'SalesDaily')
+
+    rows = (
+        Ticket.objects.exclude(status='cancelled').order_by()
+        .annotate(day=TruncDate('purchased_at'))
+        .values('day', 'event__organizer_id', 'event_id', 'ticket_category_id')
+        .annotate(n=Count('id'), qty=Sum('quantity'), total=Sum('total_amount'))
+    )
+    SalesDaily.objects.bulk_create(
+        (
+            SalesDaily(
+                date=row['day'], organizer_id=row['event__organizer_id'],
+                event_id=row['event_id'], ticket_category_id=row['ticket_category_id'],
+                tickets=row['n'], quantity=row['qty'] or 0, revenue=row['total'] or 0,
+            )
+            for row in rows.iterator()
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0022_sales_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('tickets', models.IntegerField(default=0)),
+                ('quantity', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_daily', to='events.event')),
+                ('organizer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_daily', to=settings.AUTH_USER_MODEL)),
+                ('ticket_category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sales_daily', to='events.ticketcategory')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['organizer', 'date'], name='events_sale_organiz_00077c_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='salesdaily',
+            constraint=models.UniqueConstraint(fields=('date', 'organizer', 'event', 'ticket_category'), name='sales_daily_unique_key'),
+        ),
+        migrations.RunPython(fill_sales_daily, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0023_salesdaily'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ticket',
+            name='buyer_email',
+            field=models.EmailField(db_index=True, max_length=254),
+        ),
+    ]
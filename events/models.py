@@ -1,8 +1,9 @@
-from django.db import models
+from django.db import models, transaction as db_transaction
 from django.contrib.auth.models import AbstractUser
 from django.urls import reverse
 from django.utils import timezone
 from django.conf import settings
+from django.db.models.functions import Coalesce
 from decimal import Decimal
 from django.utils.text import slugify
 
@@ -71,6 +72,73 @@ class Category(models.Model):
         return reverse('category_detail', kwargs={'slug': self.slug})
 
 
+# Sales counters, kept in step by events/sales_counters.py with F() updates
+COUNTER_FIELDS = ('sold_count', 'confirmed_count', 'revenue')
+
+
+def _skip_on_update(instance, kwargs, fields):
+    """
+    Leave `fields` out of a full save() of an existing row. A row loaded
+    earlier (a form, the admin) would otherwise write back values that
+    F() updates have moved since.
+    """
+    if not instance._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+        kwargs['update_fields'] = [
+            field.name for field in instance._meta.concrete_fields
+            if not field.primary_key and field.name not in fields
+        ]
+
+
+class EventQuerySet(models.QuerySet):
+    def with_listing_summary(self):
+        """
+        Annotate what an event card shows, in the same SELECT — one
+        correlated subquery per value, so nothing fans out:
+
+          _min_price             cheapest category ("from Ksh ...")
+          _lowest_paid_price     cheapest paid category
+          _highest_price         dearest category
+          _has_free              any free category
+          _category_count        categories at all
+          _available_categories  categories on sale with live stock
+          _is_sold_out           has categories, none available
+
+        The matching properties (starting_price, lowest_ticket_price,
+        is_sold_out, ...) read these instead of querying when present.
+        """
+        categories = TicketCategory.objects.filter(event=models.OuterRef('pk')).order_by().values('event')
+
+        def first(queryset, field, output_field):
+            return models.Subquery(queryset.values(field)[:1], output_field=output_field)
+
+        price = models.DecimalField(max_digits=10, decimal_places=2)
+        count = models.IntegerField()
+        return self.annotate(
+            _min_price=first(categories.order_by('price'), 'price', price),
+            _lowest_paid_price=first(categories.filter(is_free=False).order_by('price'), 'price', price),
+            _highest_price=first(categories.order_by('-price'), 'price', price),
+            _has_free=models.Exists(categories.filter(is_free=True)),
+            _category_count=Coalesce(
+                models.Subquery(categories.annotate(n=models.Count('id')).values('n'), output_field=count), 0,
+            ),
+            _available_categories=Coalesce(
+                models.Subquery(
+                    TicketCategory.objects.with_live_stock().on_sale()
+                    .filter(event=models.OuterRef('pk')).order_by().values('event')
+                    .annotate(n=models.Count('id')).values('n'),
+                    output_field=count,
+                ),
+                0,
+            ),
+        ).annotate(
+            _is_sold_out=models.Case(
+                models.When(_category_count__gt=0, _available_categories=0, then=models.Value(True)),
+                default=models.Value(False),
+                output_field=models.BooleanField(),
+            ),
+        )
+
+
 class Event(models.Model):
     organizer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='events')
     category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, related_name='events')
@@ -87,6 +155,13 @@ class Event(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+    # Sales counters, kept in step by events/sales_counters.py; never written by save()
+    sold_count = models.PositiveIntegerField(default=0, editable=False)
+    confirmed_count = models.PositiveIntegerField(default=0, editable=False)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+
+    objects = EventQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
 
@@ -101,54 +176,100 @@ class Event(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title)
+        _skip_on_update(self, kwargs, COUNTER_FIELDS)
         super().save(*args, **kwargs)
 
     @property
     def tickets_sold(self):
-        return sum(
-            category.tickets_sold
-            for category in self.ticket_categories.all()
-        )
+        return self.confirmed_count
 
     @property
     def is_sold_out(self):
+        if hasattr(self, '_is_sold_out'):
+            return self._is_sold_out
         if not self.ticket_categories.exists():
             return False
         return not self.get_available_categories().exists()
 
+    @property
+    def has_available_categories(self):
+        if hasattr(self, '_available_categories'):
+            return self._available_categories > 0
+        return self.get_available_categories().exists()
+
     @property
     def is_past_event(self):
         return self.date < timezone.now()
 
+    @property
+    def starting_price(self):
+        """Cheapest category price, free ones included (None without categories)."""
+        if hasattr(self, '_min_price'):
+            return self._min_price
+        category = self.ticket_categories.order_by('price').first()
+        return category.price if category else None
+
     @property
     def lowest_ticket_price(self):
+        if hasattr(self, '_lowest_paid_price'):
+            return self._lowest_paid_price
         paid_categories = self.ticket_categories.filter(is_free=False).order_by('price')
         category = paid_categories.first()
         return category.price if category else None
 
     @property
     def highest_ticket_price(self):
+        if hasattr(self, '_highest_price'):
+            return self._highest_price
         category = self.ticket_categories.order_by('-price').first()
         return category.price if category else None
 
     @property
     def has_free_tickets(self):
+        if hasattr(self, '_has_free'):
+            return self._has_free
         return self.ticket_categories.filter(is_free=True).exists()
 
     def get_available_categories(self):
         """Get all available ticket categories — handles null sales windows"""
-        from django.db.models import Q
-        now = timezone.now()
-        return self.ticket_categories.filter(
-            available_tickets__gt=0
-        ).filter(
-            Q(sales_start__isnull=True) | Q(sales_start__lte=now)
+        return self.ticket_categories.with_live_stock().on_sale()
+
+    def get_total_revenue(self):
+        return self.revenue
+
+class TicketCategoryQuerySet(models.QuerySet):
+    def with_live_stock(self):
+        """
+        Annotate `_live_available`: the exact stock of each category.
+        Unsharded categories read available_tickets; sharded ones sum their
+        shard rows in the same SELECT.
+        """
+        shard_total = InventoryShard.objects.filter(
+            category=models.OuterRef('pk')
+        ).values('category').annotate(
+            total=models.Sum('available')
+        ).values('total')
+
+        return self.annotate(
+            _live_available=models.Case(
+                models.When(
+                    shard_count__gt=1,
+                    then=Coalesce(models.Subquery(shard_total), 0),
+                ),
+                default=models.F('available_tickets'),
+                output_field=models.PositiveIntegerField(),
+            )
+        )
+
+    def on_sale(self, now=None):
+        """Categories with live stock inside their sales window (needs with_live_stock())."""
+        now = now or timezone.now()
+        return self.filter(_live_available__gt=0).filter(
+            models.Q(sales_start__isnull=True) | models.Q(sales_start__lte=now)
         ).filter(
-            Q(sales_end__isnull=True) | Q(sales_end__gte=now)
+            models.Q(sales_end__isnull=True) | models.Q(sales_end__gte=now)
         )
 
-    def get_total_revenue(self):
-        return sum(category.get_revenue() for category in self.ticket_categories.all())
 
 class TicketCategory(models.Model):
     CATEGORY_TYPES = [
@@ -231,12 +352,28 @@ class TicketCategory(models.Model):
         help_text="Lower numbers appear first"
     )
 
+    # Flash sales
+    shard_count = models.PositiveSmallIntegerField(
+        default=1,
+        help_text="Split stock across N counter rows for high-demand drops (1 = off)"
+    )
+
+    # Sales counters, kept in step by events/sales_counters.py; never written by save()
+    sold_count = models.PositiveIntegerField(default=0, editable=False)
+    confirmed_count = models.PositiveIntegerField(default=0, editable=False)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+
+    objects = TicketCategoryQuerySet.as_manager()
+
     class Meta:
         ordering = ['display_order', 'price']
 
     def __str__(self):
         return f"{self.event.title} — {self.name}"
 
+    # Only ever moved by events/inventory.py; never written by save()
+    STOCK_FIELDS = ('available_tickets', 'shard_count')
+
     def save(self, *args, **kwargs):
         if not self.pk and self.available_tickets:
             self.initial_tickets = self.available_tickets
@@ -246,23 +383,37 @@ class TicketCategory(models.Model):
             self.is_bundle = True
             if not self.bundle_label:
                 self.bundle_label = f"Admits {self.bundle_size}"
+        _skip_on_update(self, kwargs, self.STOCK_FIELDS + COUNTER_FIELDS)
         super().save(*args, **kwargs)
 
     @property
     def tickets_sold(self):
-        return self.tickets.filter(status='confirmed').aggregate(
-            total=models.Sum('quantity')
-        )['total'] or 0
+        return self.confirmed_count
 
     def get_sales_percentage(self):
         if not self.initial_tickets:
             return 0
         return min(100, (self.tickets_sold * 100) // self.initial_tickets)
 
+    @property
+    def is_sharded(self):
+        return self.shard_count > 1
+
+    @property
+    def live_available(self):
+        """Exact stock — folds the shard rows when the category is sharded."""
+        if hasattr(self, '_live_available'):
+            return self._live_available
+        if not self.is_sharded:
+            return self.available_tickets
+        return self.stock_shards.aggregate(
+            total=models.Sum('available')
+        )['total'] or 0
+
     @property
     def is_available(self):
         now = timezone.now()
-        if self.available_tickets <= 0:
+        if self.live_available <= 0:
             return False
         if self.sales_start and self.sales_start > now:
             return False
@@ -287,7 +438,42 @@ class TicketCategory(models.Model):
         return self.initial_tickets
 
     def get_revenue(self):
-        return sum(ticket.total_amount for ticket in self.tickets.all())
+        return self.revenue
+
+
+class InventoryShard(models.Model):
+    """
+    One slice of a sharded TicketCategory's stock.
+    Purchases decrement a random shard, so a flash sale spreads its writes
+    over N rows instead of serialising on the category row.
+    """
+    category = models.ForeignKey(
+        TicketCategory, on_delete=models.CASCADE, related_name='stock_shards'
+    )
+    index = models.PositiveSmallIntegerField()
+    available = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('category', 'index')
+        ordering = ['category', 'index']
+
+    def __str__(self):
+        return f"{self.category_id}#{self.index}: {self.available}"
+
+
+class TicketCodeSequence(models.Model):
+    """
+    Counter behind ticket codes (events/ticket_codes.py).
+    Web processes reserve blocks of numbers from `next_value`; `key`
+    seeds the permutation that turns a number into a code. Never edit
+    either by hand — codes already issued would start colliding.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=0)
+    key = models.CharField(max_length=64)
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
 
 
 class Ticket(models.Model):
@@ -308,29 +494,54 @@ class Ticket(models.Model):
         related_name='purchased_tickets', null=True, blank=True
     )
     buyer_name = models.CharField(max_length=100)
-    buyer_email = models.EmailField()
+    # Indexed for the incremental buyer counts (events/platform_metrics.py)
+    buyer_email = models.EmailField(db_index=True)
     buyer_phone = models.CharField(max_length=20, blank=True)
     quantity = models.PositiveIntegerField(default=1)
     unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     stripe_payment_intent_id = models.CharField(max_length=200, blank=True)
-    purchased_at = models.DateTimeField(auto_now_add=True)
+    purchased_at = models.DateTimeField(auto_now_add=True, db_index=True)
     ticket_code = models.CharField(max_length=50, unique=True)
-    transaction_code = models.CharField(max_length=50, blank=True, null=True)
+    transaction_code = models.CharField(max_length=50, blank=True, null=True, db_index=True)
+    # The payment that produced this ticket (None for free RSVPs and
+    # legacy rows the backfill could not resolve)
+    transaction = models.ForeignKey(
+        'payments.Transaction', on_delete=models.SET_NULL,
+        null=True, blank=True, related_name='tickets'
+    )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     used_at = models.DateTimeField(null=True, blank=True)
     cancelled_at = models.DateTimeField(null=True, blank=True)
 
     def save(self, *args, **kwargs):
-        if not self.unit_price and self.ticket_category:
+        if self.unit_price is None and self.ticket_category:
             self.unit_price = self.ticket_category.effective_price
         if self.unit_price is None:
             self.unit_price = 0
-        self.total_amount = self.unit_price * self.quantity
+        # Derived only when unset: once issued, total_amount is what the fan
+        # was charged (promo, early bird) and later saves must not reprice it
+        if self.total_amount is None:
+            self.total_amount = self.unit_price * self.quantity
         if not self.ticket_code:
-            import uuid
-            self.ticket_code = str(uuid.uuid4())[:8].upper()
-        super().save(*args, **kwargs)
+            from .ticket_codes import allocate_ticket_code
+            self.ticket_code = allocate_ticket_code()
+
+        from . import sales_counters
+        with db_transaction.atomic():
+            previous = None
+            if not self._state.adding and self.pk:
+                previous = Ticket.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'event_id', 'ticket_category_id', 'status', 'quantity', 'total_amount', 'purchased_at'
+                ).first()
+            super().save(*args, **kwargs)
+            sales_counters.apply_ticket_changes([(previous, sales_counters.ticket_state(self))])
+
+    def delete(self, *args, **kwargs):
+        from . import sales_counters
+        with db_transaction.atomic():
+            sales_counters.apply_ticket_changes([(sales_counters.ticket_state(self), None)])
+            return super().delete(*args, **kwargs)
 
     def mark_as_used(self):
         self.status = 'used'
@@ -338,9 +549,98 @@ class Ticket(models.Model):
         self.save()
 
     def cancel(self):
-        self.status = 'cancelled'
-        self.cancelled_at = timezone.now()
-        self.save()
+        """Cancel and restock (see events/cancellation.py)."""
+        from .cancellation import cancel_tickets
+        cancel_tickets([self.pk])
+        self.refresh_from_db(fields=['status', 'cancelled_at'])
+
+
+class WaitingRoom(models.Model):
+    """
+    Virtual queue in front of checkout for high-demand drops.
+
+    Fans join in FIFO order and are admitted at `admit_per_second` from
+    `opens_at`, so position N is let through once
+    (now - opens_at) * admit_per_second >= N. No worker is needed —
+    admission is a pure function of the clock.
+    """
+    event = models.OneToOneField(Event, on_delete=models.CASCADE, related_name='waiting_room')
+    is_active = models.BooleanField(default=True)
+    opens_at = models.DateTimeField(
+        default=timezone.now,
+        help_text="When admissions start — usually the ticket sales start"
+    )
+    admit_per_second = models.PositiveIntegerField(
+        default=10,
+        help_text="How many fans are let through to checkout each second"
+    )
+    admission_minutes = models.PositiveIntegerField(
+        default=15,
+        help_text="How long an admitted fan may stay in checkout"
+    )
+    next_position = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Waiting room — {self.event}"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        from django.core.cache import cache
+        cache.delete(f"waiting_room:{self.event_id}")
+
+    def delete(self, *args, **kwargs):
+        from django.core.cache import cache
+        cache.delete(f"waiting_room:{self.event_id}")
+        return super().delete(*args, **kwargs)
+
+
+class SalesDaily(models.Model):
+    """
+    Daily sales facts, one row per (date, organizer, event, category)
+    (events/sales_rollup.py). Dashboards read these instead of scanning
+    Ticket: a year of one seller's sales is a few hundred rows.
+    Cancelled tickets are not counted.
+    """
+    date = models.DateField()
+    organizer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sales_daily')
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='sales_daily')
+    ticket_category = models.ForeignKey(
+        TicketCategory, on_delete=models.CASCADE,
+        null=True, blank=True, related_name='sales_daily'
+    )
+    tickets = models.IntegerField(default=0)
+    quantity = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'organizer', 'event', 'ticket_category'],
+                name='sales_daily_unique_key',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['organizer', 'date']),
+        ]
+
+    def __str__(self):
+        return f"{self.date} event {self.event_id} / {self.ticket_category_id}: {self.tickets}"
+
+
+class MetricsSnapshot(models.Model):
+    """
+    Precomputed KPIs and chart series (events/platform_metrics.py).
+    The admin dashboard reads one row instead of aggregating every
+    ticket and user on each load; refresh_platform_metrics rewrites it.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    data = models.JSONField(default=dict)
+    computed_at = models.DateTimeField()
+    duration_ms = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} @ {self.computed_at:%Y-%m-%d %H:%M:%S}"
 
 
 class Subscription(models.Model):
@@ -0,0 +1,221 @@
+"""
+ZOZAPRIME Public Page Cache
+===========================
+Location: events/page_cache.py
+
+Shared, pre-rendered fragments for the public event pages. The heavy part
+of home, event_list and event_detail — the annotated event query, the
+ticket categories and the card / table markup — is the same for every
+visitor, so it is rendered once and reused. The rest of the page (nav and
+login state, CSRF tokens, the ?promo= session catch) is rendered per
+request as before and never enters a fragment.
+
+KEYS:
+  page:v:<event_id>                       the event's version number
+  page:<fragment>:<event_id>:<version>    rendered HTML
+
+  Fragments: card:home, card:upcoming, card:past (event cards) and
+  ticket_table (event_detail's categories + book button).
+
+INVALIDATION:
+  A change bumps the event's version, so every fragment of that event
+  misses on the next read and the old ones simply expire. Nothing is
+  deleted and nothing else is touched.
+
+    events/signals.py   post_save / post_delete on Event, TicketCategory,
+                        Ticket, and Category (its events' cards)
+    events/inventory.py stock UPDATEs, which bypass signals — unsharded
+                        takes and returns, shard folds, (un)sharding.
+                        Takes from a shard do not bump, so a sharded
+                        category's count may lag by up to the TTL during
+                        a drop; a shard running dry folds and bumps, and
+                        checkout always decides on live stock.
+
+  Bumps run on transaction commit, so a page rendered from pre-commit data
+  is never stored under the new version.
+
+  Versions and fragments live in the shared CACHES backend (settings:
+  Redis, or the database cache), so a bump from any web worker — or from
+  the inbox worker, the reconciler or release_expired_holds — reaches
+  every process. A per-process cache would leave other workers serving
+  stale stock for up to the TTL; events/checks.py warns about one.
+
+  Sale windows and event start times change a fragment without a write;
+  each fragment's TTL is cut short at the next such moment, and is never
+  longer than PAGE_CACHE_TTL_SECONDS.
+
+USED BY:
+  events/views.py → home, event_list, event_detail
+
+    python manage.py bench_page_cache
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .models import Event, TicketCategory
+
+# Longest a fragment is kept; invalidation is by version, not by TTL
+TTL_SECONDS = getattr(settings, 'PAGE_CACHE_TTL_SECONDS', 600)
+
+VERSION_KEY = 'page:v:{}'
+CATEGORY_EVENT_KEY = 'page:category_event:{}'
+CARD_TEMPLATES = {
+    'home': 'events/partials/home_event_card.html',
+    'upcoming': 'events/partials/event_card.html',
+    'past': 'events/partials/past_event_card.html',
+}
+TICKET_TABLE_TEMPLATE = 'events/partials/ticket_table.html'
+
+_stats = {'hits': 0, 'misses': 0, 'bumps': 0}
+
+
+def _count(key, n=1):
+    # Plain int += under the GIL is good enough for metrics
+    _stats[key] += n
+
+
+def stats():
+    """This process's fragment hit / miss / bump counters."""
+    data = dict(_stats)
+    lookups = data['hits'] + data['misses']
+    data['hit_rate'] = round(data['hits'] / lookups * 100, 1) if lookups else 0.0
+    return data
+
+
+def reset_stats():
+    for key in _stats:
+        _stats[key] = 0
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# VERSIONS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _new_version():
+    # Microseconds since the epoch: a version recreated after an eviction
+    # is always above any the event had before, so old fragments stay dead
+    return time.time_ns() // 1000
+
+
+def event_versions(event_ids):
+    """{event_id: version} — one get_many; unknown events get a fresh version."""
+    keys = {pk: VERSION_KEY.format(pk) for pk in event_ids}
+    found = cache.get_many(list(keys.values()))
+    versions = {}
+    for pk, key in keys.items():
+        if key not in found:
+            version = _new_version()
+            # Versions never expire; a concurrent reader may have set one first
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+            found[key] = version
+        versions[pk] = found[key]
+    return versions
+
+
+def bump_now(event_ids):
+    """Invalidate these events' fragments immediately (no transaction)."""
+    for pk in event_ids:
+        key = VERSION_KEY.format(pk)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+    _count('bumps', len(event_ids))
+
+
+def bump_event_versions(event_ids):
+    """Invalidate every fragment of these events once the current transaction commits."""
+    event_ids = {pk for pk in event_ids if pk}
+    if event_ids:
+        db_transaction.on_commit(lambda: bump_now(event_ids))
+
+
+def bump_categories(category_ids):
+    """bump_event_versions() for the events owning these ticket categories."""
+    keys = {pk: CATEGORY_EVENT_KEY.format(pk) for pk in set(category_ids) if pk}
+    if not keys:
+        return
+    # A category never changes event, so the mapping is cached for good
+    found = cache.get_many(list(keys.values()))
+    event_ids = set(found.values())
+    missing = [pk for pk, key in keys.items() if key not in found]
+    if missing:
+        fetched = dict(TicketCategory.objects.filter(id__in=missing).values_list('id', 'event_id'))
+        cache.set_many({keys[pk]: event_id for pk, event_id in fetched.items()}, None)
+        event_ids.update(fetched.values())
+    bump_event_versions(event_ids)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# FRAGMENTS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _key(fragment, event_id, version):
+    return f'page:{fragment}:{event_id}:{version}'
+
+
+def _ttl(now, moments):
+    """TTL_SECONDS, cut short at the first of `moments` still ahead of `now`."""
+    ahead = [(moment - now).total_seconds() for moment in moments if moment and moment > now]
+    return max(1, int(min([TTL_SECONDS, *ahead])))
+
+
+def event_cards(event_ids, variant, now=None):
+    """
+    Rendered cards for `event_ids`, in order. Hits are one get_many; the
+    misses are rendered from one annotated query (with_listing_summary)
+    plus one query for their sale windows.
+    """
+    now = now or timezone.now()
+    event_ids = list(event_ids)
+    versions = event_versions(event_ids)
+    fragment = f'card:{variant}'
+    keys = {pk: _key(fragment, pk, versions[pk]) for pk in event_ids}
+
+    found = cache.get_many(list(keys.values()))
+    missing = [pk for pk in event_ids if keys[pk] not in found]
+    _count('hits', len(event_ids) - len(missing))
+    _count('misses', len(missing))
+
+    if missing:
+        windows = {}
+        for event_id, start, end in TicketCategory.objects.filter(event_id__in=missing).values_list(
+            'event_id', 'sales_start', 'sales_end'
+        ):
+            windows.setdefault(event_id, []).extend((start, end))
+
+        by_ttl = {}
+        events = Event.objects.filter(id__in=missing).with_listing_summary().select_related('category')
+        for event in events:
+            html = render_to_string(CARD_TEMPLATES[variant], {'event': event})
+            found[keys[event.pk]] = html
+            by_ttl.setdefault(_ttl(now, windows.get(event.pk, [])), {})[keys[event.pk]] = html
+        for ttl, fragments in by_ttl.items():
+            cache.set_many(fragments, ttl)
+
+    return [mark_safe(found[keys[pk]]) for pk in event_ids if keys[pk] in found]
+
+
+def ticket_table(event, now=None):
+    """event_detail's ticket categories and book button, rendered."""
+    now = now or timezone.now()
+    key = _key('ticket_table', event.pk, event_versions([event.pk])[event.pk])
+
+    html = cache.get(key)
+    if html is not None:
+        _count('hits')
+        return mark_safe(html)
+    _count('misses')
+
+    categories = list(event.ticket_categories.with_live_stock())
+    html = render_to_string(TICKET_TABLE_TEMPLATE, {'event': event, 'categories': categories, 'now': now})
+    moments = [event.date, *(c.sales_start for c in categories), *(c.sales_end for c in categories)]
+    cache.set(key, html, _ttl(now, moments))
+    return mark_safe(html)
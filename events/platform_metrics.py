@@ -0,0 +1,382 @@
+"""
+ZOZAPRIME Platform Metrics Snapshot
+===================================
+Location: events/platform_metrics.py
+
+The admin dashboard used to run ~25 full-table aggregates (ticket sums,
+distinct buyer emails, repeat-buyer grouping, signup trends, tier
+breakdowns) on every load. They are now computed off the request path
+into one MetricsSnapshot row, so the page costs the same however many
+tickets and users exist.
+
+FLOW:
+  refresh_platform_metrics --loop (Procfile `metrics:`, every REFRESH_SECONDS)
+      → refresh_snapshot()
+          KPIs            grouped aggregates over users, events and the
+                          daily rollup (SalesDaily, events/sales_rollup.py),
+                          not every ticket
+          buyer counts    incremental: distinct and repeat buyers are
+                          carried forward and only tickets added since the
+                          previous run's high-water mark are read (tickets
+                          younger than BUYER_SETTLE_SECONDS wait for the
+                          next run, so a slow commit is not skipped);
+                          deleted tickets only drop out on --full
+          daily series    incremental: days before the previous run are
+                          kept from the old snapshot; only the days since
+                          (plus one day of slack for late commits) are
+                          re-aggregated, and days older than the 30-day
+                          window are dropped
+      → MetricsSnapshot('platform')
+
+  admin_dashboard        → get_snapshot()      one row, "computed N s ago"
+  "Refresh now" button   → refresh_snapshot()  on demand (None while
+                                               another refresh runs)
+  admin_dashboard_live   → live_counters()     the cheap counters only
+                                               (indexed range counts and
+                                               this worker's M-Pesa stats)
+
+    python manage.py refresh_platform_metrics [--full] [--loop]
+
+Concurrent refreshes (the loop, "Refresh now", a second worker) are
+collapsed by a cache.add() lock, which holds across processes because
+CACHES is a shared backend (settings). The first snapshot is computed
+without it — there is nothing to return instead.
+"""
+import logging
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Event, MetricsSnapshot, SalesDaily, Ticket, User
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_NAME = 'platform'
+SERIES_DAYS = 30
+# Seconds after which the dashboard flags the snapshot as stale
+STALE_SECONDS = getattr(settings, 'METRICS_SNAPSHOT_STALE_SECONDS', 900)
+# Seconds between scheduled refreshes (refresh_platform_metrics --loop)
+REFRESH_SECONDS = getattr(settings, 'METRICS_REFRESH_SECONDS', 300)
+# Seconds between live counter polls on the dashboard (0 = off)
+LIVE_REFRESH_SECONDS = getattr(settings, 'METRICS_LIVE_REFRESH_SECONDS', 30)
+REFRESH_LOCK_KEY = 'metrics:refresh:lock'
+REFRESH_LOCK_SECONDS = 300
+# Tickets younger than this are left for the next run's buyer counts
+BUYER_SETTLE_SECONDS = 300
+# Emails per IN (...) lookup when updating buyer counts
+BUYER_LOOKUP_CHUNK = 500
+
+
+def _money(value):
+    return float(value or Decimal('0.00'))
+
+
+def _percent(part, whole):
+    return round(part / whole * 100, 1) if whole > 0 else 0
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# KPIs
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _kpis(now, buyers):
+    thirty_days_ago = now - timedelta(days=30)
+    week_ago = now - timedelta(days=7)
+    today = timezone.localdate(now)
+    current_month_start = today.replace(day=1)
+    last_month_start = (current_month_start - timedelta(days=1)).replace(day=1)
+
+    users = User.objects.aggregate(
+        total=Count('id'),
+        new_week=Count('id', filter=Q(date_joined__gte=week_ago)),
+        active=Count('id', filter=Q(is_active=True)),
+    )
+    # Sales (rollup days; "this week" = the last 7 calendar days)
+    tickets = SalesDaily.objects.aggregate(
+        total=Sum('tickets'),
+        today=Sum('tickets', filter=Q(date=today)),
+        week=Sum('tickets', filter=Q(date__gt=today - timedelta(days=7))),
+        total_revenue=Sum('revenue'),
+        revenue_this_month=Sum('revenue', filter=Q(date__gte=current_month_start)),
+        revenue_last_month=Sum('revenue', filter=Q(
+            date__gte=last_month_start, date__lt=current_month_start,
+        )),
+    )
+    tickets = {key: value or 0 for key, value in tickets.items()}
+    events = Event.objects.aggregate(
+        total=Count('id'),
+        upcoming=Count('id', filter=Q(date__gte=now)),
+    )
+
+    # M-Pesa attempts
+    try:
+        Transaction = apps.get_model('payments', 'Transaction')
+        mpesa = Transaction.objects.aggregate(
+            attempts=Count('pk'),
+            successful=Count('pk', filter=Q(status='success')),
+        )
+    except LookupError:
+        mpesa = {'attempts': 0, 'successful': 0}
+
+    active_sellers = User.objects.filter(is_seller=True, events__isnull=False).distinct().count()
+
+    # Conversion (visitors to buyers, 30 days)
+    try:
+        from analytics.models import Visit
+        visits = Visit.objects.filter(timestamp__gte=thirty_days_ago).aggregate(
+            total=Count('id'),
+            unique=Count('session_id', distinct=True),
+        )
+        buyers_30d = Ticket.objects.filter(
+            purchased_at__gte=thirty_days_ago
+        ).values('buyer_email').distinct().count()
+        conversion_rate = _percent(buyers_30d, visits['unique'])
+    except Exception:
+        visits = {'total': 0, 'unique': 0}
+        conversion_rate = 0
+
+    # Users who logged in or made a purchase in the last 30 days
+    active_users_30d = User.objects.filter(
+        Q(last_login__gte=thirty_days_ago) |
+        Q(purchased_tickets__purchased_at__gte=thirty_days_ago)
+    ).distinct().count()
+
+    # Month-over-month revenue growth
+    this_month = tickets['revenue_this_month'] or Decimal('0.00')
+    last_month = tickets['revenue_last_month'] or Decimal('0.00')
+    if last_month > 0:
+        revenue_growth = round(float((this_month - last_month) / last_month * 100), 1)
+    else:
+        revenue_growth = 0 if this_month == 0 else 100
+
+    return {
+        'total_users': users['total'],
+        'new_users_week': users['new_week'],
+        'active_users_count': users['active'],
+        'total_tickets': tickets['total'],
+        'tickets_today': tickets['today'],
+        'tickets_this_week': tickets['week'],
+        'total_revenue': _money(tickets['total_revenue']),
+        'avg_ticket_price': _money(tickets['total_revenue'] / tickets['total'] if tickets['total'] else 0),
+        'total_events': events['total'],
+        'upcoming_events': events['upcoming'],
+        'mpesa_success_rate': round(mpesa['successful'] / mpesa['attempts'] * 100) if mpesa['attempts'] else 0,
+        'mpesa_total_attempts': mpesa['attempts'],
+        'active_sellers': active_sellers,
+        'conversion_rate': conversion_rate,
+        'total_visits': visits['total'],
+        'unique_visitors': visits['unique'],
+        'active_users_30d': active_users_30d,
+        'active_users_percent': _percent(active_users_30d, users['total']),
+        'revenue_growth': revenue_growth,
+        'repeat_buyers': buyers['repeat'],
+        'repeat_buyer_rate': _percent(buyers['repeat'], buyers['total']),
+    }
+
+
+def _tickets_per_buyer(tickets):
+    return tickets.order_by().values('buyer_email').annotate(n=Count('id')).values_list('buyer_email', 'n')
+
+
+def _buyers(now, previous_state=None):
+    """
+    Distinct and repeat buyers (by buyer_email) as
+    {'last_ticket_id', 'total', 'repeat'}. With the previous run's state
+    only tickets after its last_ticket_id are read, plus the earlier
+    ticket counts of the emails among them.
+    """
+    settled_before = now - timedelta(seconds=BUYER_SETTLE_SECONDS)
+    first_unsettled = Ticket.objects.filter(purchased_at__gte=settled_before).aggregate(id=Min('id'))['id']
+    high = first_unsettled - 1 if first_unsettled else (Ticket.objects.aggregate(id=Max('id'))['id'] or 0)
+
+    if previous_state is None:
+        counts = _tickets_per_buyer(Ticket.objects.filter(id__lte=high)).aggregate(
+            total=Count('buyer_email'),
+            repeat=Count('buyer_email', filter=Q(n__gt=1)),
+        )
+        return {'last_ticket_id': high, 'total': counts['total'], 'repeat': counts['repeat']}
+
+    state = dict(previous_state)
+    low = state['last_ticket_id']
+    if high <= low:
+        return state
+
+    added = dict(_tickets_per_buyer(Ticket.objects.filter(id__gt=low, id__lte=high)))
+    emails = list(added)
+    before = {}
+    for i in range(0, len(emails), BUYER_LOOKUP_CHUNK):
+        before.update(_tickets_per_buyer(
+            Ticket.objects.filter(id__lte=low, buyer_email__in=emails[i:i + BUYER_LOOKUP_CHUNK])
+        ))
+
+    for email, n in added.items():
+        had = before.get(email, 0)
+        if had == 0:
+            state['total'] += 1
+        if had <= 1 < had + n:
+            state['repeat'] += 1
+    state['last_ticket_id'] = high
+    return state
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CHART SERIES
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _daily_sales(since):
+    rows = (
+        SalesDaily.objects.filter(date__gte=since)
+        .values('date')
+        .annotate(total_sales=Sum('revenue'), count=Sum('tickets'))
+        .order_by('date')
+    )
+    return [
+        {'purchased_at__date': row['date'].isoformat(), 'total_sales': _money(row['total_sales']), 'count': row['count']}
+        for row in rows
+    ]
+
+
+def _signup_trend(since):
+    rows = (
+        User.objects.filter(date_joined__gte=since)
+        .annotate(day=TruncDate('date_joined'))
+        .values('day')
+        .annotate(
+            count=Count('id'),
+            buyers=Count('id', filter=Q(is_buyer=True)),
+            sellers=Count('id', filter=Q(is_seller=True)),
+        )
+        .order_by('day')
+    )
+    return [
+        {'signup_date': row['day'].isoformat(), 'count': row['count'],
+         'buyers': row['buyers'], 'sellers': row['sellers']}
+        for row in rows
+    ]
+
+
+def _merge(previous, fresh, key, window_start, since):
+    """Old rows from [window_start, since) plus freshly computed rows from `since` on."""
+    kept = [row for row in previous if window_start <= row[key] < since]
+    return kept + fresh
+
+
+def _series(now, previous=None):
+    local_today = timezone.localtime(now).date()
+    window_start = local_today - timedelta(days=SERIES_DAYS)
+
+    since = window_start
+    if previous and previous.data.get('series'):
+        # One day of slack: a purchase that committed after the last run
+        # may carry a purchased_at from before it
+        last_run_day = timezone.localtime(previous.computed_at).date() - timedelta(days=1)
+        since = max(window_start, last_run_day)
+    since_dt = timezone.make_aware(timezone.datetime.combine(since, timezone.datetime.min.time()))
+
+    old = previous.data['series'] if since != window_start else {'daily_sales': [], 'user_signup_trend': []}
+    window_iso, since_iso = window_start.isoformat(), since.isoformat()
+
+    tier_breakdown = [
+        {'name': name, 'sold': sold}
+        for name, sold in SalesDaily.objects.filter(ticket_category__isnull=False)
+        .values('ticket_category__name')
+        .annotate(sold=Sum('tickets'))
+        .filter(sold__gt=0)
+        .order_by('-sold')
+        .values_list('ticket_category__name', 'sold')
+    ]
+    return {
+        'daily_sales': _merge(old['daily_sales'], _daily_sales(since),
+                              'purchased_at__date', window_iso, since_iso),
+        'user_signup_trend': _merge(old['user_signup_trend'], _signup_trend(since_dt),
+                                    'signup_date', window_iso, since_iso),
+        'tier_breakdown': tier_breakdown,
+    }, since
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ENTRY POINTS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def get_snapshot():
+    """The current snapshot, computing the first one if there is none yet."""
+    snapshot = MetricsSnapshot.objects.filter(name=SNAPSHOT_NAME).first()
+    return snapshot or refresh_snapshot(full=True)
+
+
+def refresh_snapshot(full=False):
+    """
+    Recompute the snapshot and store it. Incremental unless `full` (or
+    there is no previous snapshot). Concurrent refreshes are collapsed:
+    if one is already running, nothing is computed and None is returned.
+    """
+    previous = MetricsSnapshot.objects.filter(name=SNAPSHOT_NAME).first()
+    locked = bool(previous) and cache.add(REFRESH_LOCK_KEY, 1, REFRESH_LOCK_SECONDS)
+    if previous and not locked:
+        logger.info("[METRICS] Refresh already running, skipped")
+        return None
+
+    try:
+        started = time.perf_counter()
+        now = timezone.now()
+        base = None if full else previous
+        series, since = _series(now, base)
+        buyers = _buyers(now, base.data.get('buyers') if base else None)
+        data = {'kpis': _kpis(now, buyers), 'series': series, 'buyers': buyers}
+        duration_ms = int((time.perf_counter() - started) * 1000)
+
+        snapshot, _ = MetricsSnapshot.objects.update_or_create(
+            name=SNAPSHOT_NAME,
+            defaults={'data': data, 'computed_at': now, 'duration_ms': duration_ms},
+        )
+    finally:
+        if locked:
+            cache.delete(REFRESH_LOCK_KEY)
+
+    logger.info(f"[METRICS] Snapshot refreshed in {duration_ms}ms (series from {since})")
+    return snapshot
+
+
+def live_counters():
+    """Counters cheap enough to read on every poll."""
+    now = timezone.now()
+    today_start = timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    tickets = Ticket.objects.filter(purchased_at__gte=min(today_start, now - timedelta(days=7))).aggregate(
+        today=Count('id', filter=Q(purchased_at__gte=today_start)),
+        week=Count('id', filter=Q(purchased_at__gte=now - timedelta(days=7))),
+    )
+    return {
+        'tickets_today': tickets['today'],
+        'tickets_this_week': tickets['week'],
+        **mpesa_worker_stats(),
+    }
+
+
+def mpesa_worker_stats():
+    """This worker process's Daraja token, latency, breaker and query stats (no queries)."""
+    stats = {}
+    try:
+        from payments.token_cache import all_token_stats
+        stats['mpesa_token_stats'] = all_token_stats().get(settings.MPESA_BASE_URL, {})
+    except Exception:
+        stats['mpesa_token_stats'] = {}
+    try:
+        from payments.daraja import all_client_stats, all_breaker_stats
+        stats['mpesa_stk_latency'] = all_client_stats().get(settings.MPESA_BASE_URL, {}).get('stk_push', {})
+        stats['mpesa_stk_breaker'] = all_breaker_stats().get(settings.MPESA_BASE_URL, {}).get('stk_push', {})
+    except Exception:
+        stats['mpesa_stk_latency'] = {}
+        stats['mpesa_stk_breaker'] = {}
+    try:
+        from payments.stk_query import get_query_coalescer
+        stats['mpesa_query_stats'] = get_query_coalescer().stats()
+    except Exception:
+        stats['mpesa_query_stats'] = {}
+    return stats
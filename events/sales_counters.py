@@ -0,0 +1,220 @@
+"""
+ZOZAPRIME Sales Counters
+========================
+Location: events/sales_counters.py
+
+Denormalized per-category and per-event sales totals, so tickets_sold and
+revenue are column reads instead of a Sum() per access (or a Python loop
+over every ticket):
+
+    sold_count       Sum(quantity)      every status except cancelled
+    confirmed_count  Sum(quantity)      status 'confirmed'
+    revenue          Sum(total_amount)  every status except cancelled
+
+Counters are shifted with F() expressions in the same transaction as the
+ticket write, never read-modify-written, so concurrent sales cannot lose
+an increment. Event.save() and TicketCategory.save() leave them out of
+every update, so a form or admin save of a row loaded before a sale
+cannot write the old totals back. Changes are grouped by delta — a whole cancellation batch
+is a handful of UPDATEs, not one per category. The same ticket changes
+also feed the daily sales rollup (events/sales_rollup.py).
+
+CALLED BY:
+  events/issuance.py     → issue_tickets()      (issued)
+  events/cancellation.py → cancel_tickets()     (cancelled)
+  events/models.py       → Ticket.save/delete   (used, admin edits)
+
+Bulk writes that bypass these paths (queryset.delete() in the admin,
+raw SQL) are caught by:
+
+    python manage.py verify_sales_counters [--rebuild] [--event ID]
+"""
+import logging
+import time
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from . import sales_rollup
+from .models import COUNTER_FIELDS, Event, Ticket, TicketCategory
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = COUNTER_FIELDS
+BATCH_SIZE = 500
+ZERO = (0, 0, Decimal('0.00'))
+
+
+def contribution(status, quantity, amount):
+    """What one ticket adds to (sold_count, confirmed_count, revenue)."""
+    if status == 'cancelled':
+        return ZERO
+    return (quantity, quantity if status == 'confirmed' else 0, Decimal(str(amount or 0)))
+
+
+def _plus(a, b, sign=1):
+    return tuple(x + sign * y for x, y in zip(a, b))
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# INCREMENTAL UPDATES
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def apply_changes(changes):
+    """
+    Shift the counters. `changes` is an iterable of
+    (event_id, category_id, (sold, confirmed, revenue)) deltas.
+    """
+    by_category, by_event = {}, {}
+    for event_id, category_id, delta in changes:
+        by_event[event_id] = _plus(by_event.get(event_id, ZERO), delta)
+        if category_id:
+            by_category[category_id] = _plus(by_category.get(category_id, ZERO), delta)
+
+    _shift(TicketCategory, by_category)
+    _shift(Event, by_event)
+
+
+def _shift(model, deltas):
+    groups = {}
+    for pk, delta in deltas.items():
+        if any(delta):
+            groups.setdefault(delta, []).append(pk)
+
+    for delta, ids in groups.items():
+        updates = {}
+        for field, amount in zip(COUNTERS, delta):
+            if not amount:
+                continue
+            if amount > 0:
+                updates[field] = F(field) + amount
+            else:
+                # Never below zero: drift is for verify_sales_counters to fix,
+                # not a reason to fail a cancellation
+                zero = Value(Decimal('0.00')) if field == 'revenue' else Value(0)
+                updates[field] = Greatest(F(field) + amount, zero)
+        for start in range(0, len(ids), BATCH_SIZE):
+            model.objects.filter(id__in=sorted(ids[start:start + BATCH_SIZE])).update(**updates)
+
+
+def ticket_state(ticket):
+    """The fields the counters and the rollup depend on."""
+    return (ticket.event_id, ticket.ticket_category_id, ticket.status,
+            ticket.quantity, ticket.total_amount, ticket.purchased_at)
+
+
+def apply_ticket_changes(changes):
+    """
+    Account for tickets changing. `changes` is an iterable of
+    (before, after) ticket states (see ticket_state()); before is None
+    for a new ticket, after is None for a deleted one.
+    """
+    counters, facts = [], []
+    for before, after in changes:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            event_id, category_id, status, quantity, amount, purchased_at = state
+            counters.append((event_id, category_id, _plus(ZERO, contribution(status, quantity, amount), sign)))
+            facts.append((purchased_at, event_id, category_id,
+                          _plus(sales_rollup.ZERO, sales_rollup.fact(status, quantity, amount), sign)))
+    apply_changes(counters)
+    sales_rollup.apply_changes(facts)
+
+
+def record_issued(tickets):
+    """Count freshly created tickets."""
+    apply_ticket_changes((None, ticket_state(t)) for t in tickets)
+
+
+def record_status_change(rows, new_status):
+    """
+    Move tickets to `new_status`. `rows` are
+    (event_id, category_id, old_status, quantity, total_amount, purchased_at).
+    """
+    apply_ticket_changes(
+        ((event_id, category_id, old_status, quantity, amount, purchased_at),
+         (event_id, category_id, new_status, quantity, amount, purchased_at))
+        for event_id, category_id, old_status, quantity, amount, purchased_at in rows
+    )
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# VERIFY / REBUILD
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _actual(group_field, ids=None):
+    """{id: (sold, confirmed, revenue)} from the ticket rows — one grouped query."""
+    tickets = Ticket.objects.exclude(status='cancelled').filter(**{f'{group_field}__isnull': False})
+    if ids is not None:
+        tickets = tickets.filter(**{f'{group_field}__in': ids})
+    rows = (
+        tickets.order_by().values(group_field)
+        .annotate(
+            sold=Sum('quantity'),
+            confirmed=Coalesce(Sum('quantity', filter=Q(status='confirmed')), 0),
+            total=Sum('total_amount'),
+        )
+        .values_list(group_field, 'sold', 'confirmed', 'total')
+    )
+    return {pk: (sold, confirmed, total or Decimal('0.00')) for pk, sold, confirmed, total in rows}
+
+
+def _check(model, group_field, event_id, rebuild):
+    objects = model.objects.all()
+    if event_id is not None:
+        objects = objects.filter(**({'id': event_id} if model is Event else {'event_id': event_id}))
+
+    ids = None if event_id is None else list(objects.values_list('id', flat=True))
+    actual = _actual(group_field, ids)
+
+    stale = []
+    for pk, *stored in objects.values_list('id', *COUNTERS).iterator(chunk_size=5000):
+        expected = actual.get(pk, ZERO)
+        if tuple(stored) != expected:
+            stale.append((pk, tuple(stored), expected))
+
+    if rebuild and stale:
+        with db_transaction.atomic():
+            # Lock the rows, then re-read: a sale commits its ticket and its
+            # counter shift together, so nothing lands between read and write
+            stale_ids = [pk for pk, _, _ in stale]
+            list(model.objects.select_for_update().filter(id__in=stale_ids).values_list('id'))
+            fresh = _actual(group_field, stale_ids)
+            model.objects.bulk_update(
+                [model(id=pk, **dict(zip(COUNTERS, fresh.get(pk, ZERO)))) for pk, _, _ in stale],
+                list(COUNTERS),
+                batch_size=BATCH_SIZE,
+            )
+    return stale
+
+
+def verify_sales_counters(rebuild=False, event_id=None):
+    """Compare every counter with the ticket rows; rewrite the stale ones if asked."""
+    started = time.perf_counter()
+    categories = _check(TicketCategory, 'ticket_category_id', event_id, rebuild)
+    events = _check(Event, 'event_id', event_id, rebuild)
+
+    report = {
+        'generated_at': timezone.now().isoformat(),
+        'rebuild': rebuild,
+        'event_id': event_id,
+        'stale_categories': len(categories),
+        'stale_events': len(events),
+        'elapsed_s': round(time.perf_counter() - started, 2),
+        'rows': [
+            {'model': label, 'id': pk,
+             'stored': dict(zip(COUNTERS, map(str, stored))),
+             'expected': dict(zip(COUNTERS, map(str, expected)))}
+            for label, stale in (('category', categories), ('event', events))
+            for pk, stored, expected in stale[:100]
+        ],
+    }
+    logger.info(
+        f"[SALES] {report['stale_categories']} stale categories, {report['stale_events']} stale events"
+        f"{' rebuilt' if rebuild else ''} ({report['elapsed_s']}s)"
+    )
+    return report
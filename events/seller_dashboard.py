@@ -0,0 +1,211 @@
+"""
+ZOZAPRIME Seller Dashboard
+==========================
+Location: events/seller_dashboard.py
+
+Builds the "My Shop" dashboard context in a fixed number of queries,
+however many events the seller has. Sales figures come from the daily
+rollup (SalesDaily, events/sales_rollup.py), so a year of sales is a few
+hundred rows rather than every ticket; cancelled tickets do not count.
+
+  1. sales KPIs       one conditional aggregate over the seller's rollup
+  2. events           one query; ticket count and capacity come from
+                      correlated subqueries, so the rollup and category
+                      joins cannot multiply each other's rows; revenue is
+                      the event's sales counter (events/sales_counters.py)
+  3. revenue series   one grouped query over the rollup days, folded into
+                      day / week / month buckets and zero-filled in Python
+  4. top categories   one grouped rollup query
+  5. recent sales     one query (Ticket, by the purchased_at index)
+  6. merchandise      one count
+
+Totals that used to be per-event queries (capacity, active / sold-out
+counts, top events) are folded from the events query in Python.
+
+USED BY:
+  events/views.py → dashboard
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Event, SalesDaily, Ticket, TicketCategory
+
+PERIOD_DAYS = {'7d': 7, '30d': 30, '90d': 90}
+# Revenue chart shape per period: (bucket, number of buckets, label format)
+SERIES = {
+    '7d': ('day', 7, '%a'),
+    '30d': ('day', 30, '%d'),
+    '90d': ('week', 13, '%b %d'),
+    'all': ('month', 6, '%b'),
+}
+
+
+def _start_of(bucket, day):
+    """The start of the bucket containing `day`."""
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _previous(bucket, day):
+    if bucket == 'week':
+        return day - timedelta(days=7)
+    if bucket == 'month':
+        return (day - timedelta(days=1)).replace(day=1)
+    return day - timedelta(days=1)
+
+
+def revenue_series(sales, period, now):
+    """(labels, data) for the revenue chart — one grouped query over the rollup."""
+    bucket, count, label_format = SERIES[period]
+
+    starts = [_start_of(bucket, timezone.localdate(now))]
+    while len(starts) < count:
+        starts.append(_previous(bucket, starts[-1]))
+    starts.reverse()
+
+    rows = (
+        sales.filter(date__gte=starts[0])
+        .values('date')
+        .annotate(total=Sum('revenue'))
+        .values_list('date', 'total')
+    )
+    totals = {}
+    for day, total in rows:
+        start = _start_of(bucket, day)
+        totals[start] = totals.get(start, 0) + float(total or 0)
+
+    labels = [start.strftime(label_format) for start in starts]
+    data = [totals.get(start, 0.0) for start in starts]
+    return labels, data
+
+
+def events_with_metrics(organizer):
+    """The seller's events annotated with tickets_count and capacity."""
+    sales = SalesDaily.objects.filter(event=OuterRef('pk')).order_by().values('event')
+    categories = TicketCategory.objects.filter(event=OuterRef('pk')).order_by().values('event')
+
+    return Event.objects.filter(organizer=organizer).annotate(
+        tickets_count=Coalesce(
+            Subquery(sales.annotate(n=Sum('tickets')).values('n'), output_field=IntegerField()),
+            Value(0),
+        ),
+        capacity=Coalesce(
+            Subquery(categories.annotate(total=Sum('initial_tickets')).values('total'), output_field=IntegerField()),
+            Value(0),
+        ),
+    )
+
+
+def build_dashboard(user, period='30d', now=None):
+    """The dashboard template context for `user`."""
+    now = now or timezone.now()
+    if period not in SERIES:
+        period = '30d'
+
+    today = timezone.localdate(now)
+    # Period = the last N calendar days, today included
+    in_period = Q(date__gt=today - timedelta(days=PERIOD_DAYS[period])) if period in PERIOD_DAYS else Q()
+
+    sales = SalesDaily.objects.filter(organizer=user)
+
+    # ── 1. Sales KPIs ──
+    kpis = sales.aggregate(
+        total_revenue=Sum('revenue'),
+        revenue_this_month=Sum('revenue', filter=Q(date__gte=today.replace(day=1))),
+        period_count=Sum('tickets', filter=in_period),
+        period_revenue=Sum('revenue', filter=in_period),
+        today_count=Sum('tickets', filter=Q(date=today)),
+        all_count=Sum('tickets'),
+    )
+    kpis = {key: value or 0 for key, value in kpis.items()}
+
+    # ── 2. Events ──
+    events = list(events_with_metrics(user).order_by('-created_at'))
+    total_capacity = sum(event.capacity for event in events)
+    occupancy_rate = (kpis['all_count'] / total_capacity * 100) if total_capacity > 0 else 0
+
+    events_list = [
+        {
+            'slug': event.slug,
+            'title': event.title,
+            'image': event.image,
+            'date': event.date,
+            'tickets_count': event.tickets_count,
+            'capacity': event.capacity,
+            'revenue': event.revenue,
+        }
+        for event in events
+    ]
+
+    # ── 3. Revenue chart ──
+    revenue_labels, revenue_data = revenue_series(sales, period, now)
+
+    # ── 4. Top categories ──
+    category_labels, category_data = [], []
+    for _, name, sold in (
+        sales.filter(ticket_category__isnull=False)
+        .values('ticket_category_id', 'ticket_category__name')
+        .annotate(sold=Sum('tickets'))
+        .order_by('-sold')
+        .values_list('ticket_category_id', 'ticket_category__name', 'sold')[:5]
+    ):
+        if sold > 0:
+            category_labels.append(name)
+            category_data.append(sold)
+    if not category_labels:
+        category_labels, category_data = ['No Sales Yet'], [0]
+
+    # ── 5. Recent sales ──
+    recent_sales = list(
+        Ticket.objects.filter(event__organizer=user)
+        .select_related('event', 'ticket_category').order_by('-purchased_at')[:10]
+    )
+
+    # ── 6. Merchandise ──
+    try:
+        from seller_merchandise.models import SellerMerchandise
+        total_products = SellerMerchandise.objects.filter(seller=user).count()
+    except Exception:
+        total_products = 0
+
+    return {
+        'period': period,
+
+        'events': events_list,
+        'total_events': len(events),
+        'active_events_count': sum(
+            1 for event in events
+            if event.date >= now and event.is_active and event.available_tickets > 0
+        ),
+        'sold_out_events': sum(1 for event in events if event.available_tickets == 0),
+
+        'total_revenue': kpis['total_revenue'] or Decimal('0.00'),
+        'revenue_this_month': kpis['revenue_this_month'] or Decimal('0.00'),
+        'avg_ticket_price': (
+            kpis['period_revenue'] / kpis['period_count'] if kpis['period_count'] else Decimal('0.00')
+        ),
+
+        'total_tickets_sold': kpis['period_count'],
+        'tickets_sold_today': kpis['today_count'],
+        'total_capacity': total_capacity,
+        'occupancy_rate': round(occupancy_rate, 1),
+        # Same as occupancy in this context
+        'conversion_rate': round(occupancy_rate, 1),
+
+        'top_events': sorted(events, key=lambda event: event.revenue, reverse=True)[:5],
+        'recent_sales': recent_sales,
+
+        'revenue_labels': revenue_labels,
+        'revenue_data': revenue_data,
+        'category_labels': category_labels,
+        'category_data': category_data,
+
+        'total_products': total_products,
+    }
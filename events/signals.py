@@ -0,0 +1,36 @@
+"""
+ZOZAPRIME Model Signals
+=======================
+Location: events/signals.py
+
+Invalidates the shared public-page fragments (events/page_cache.py) when
+the rows they are rendered from change. Queryset .update() and
+bulk_create() do not send these signals; the stock movements among them
+bump from events/inventory.py instead.
+
+REGISTERED BY:
+  events/apps.py → EventsConfig.ready()
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import page_cache
+from .models import Category, Event, Ticket, TicketCategory
+
+
+@receiver([post_save, post_delete], sender=Event)
+def event_changed(sender, instance, **kwargs):
+    page_cache.bump_event_versions([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=TicketCategory)
+@receiver([post_save, post_delete], sender=Ticket)
+def event_row_changed(sender, instance, **kwargs):
+    page_cache.bump_event_versions([instance.event_id])
+
+
+@receiver(post_save, sender=Category)
+def category_changed(sender, instance, created, **kwargs):
+    # Cards show the category name
+    if not created:
+        page_cache.bump_event_versions(instance.events.values_list('id', flat=True))
@@ -1,3 +1,669 @@
-from django.test import TestCase
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.http import JsonResponse
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.test import RequestFactory, TestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import page_cache
+from . import platform_metrics
+from . import waiting_room
+from .cancellation import cancel_tickets
+from .forms import TicketCategoryForm
+from .idempotency import idempotent
+from .inventory import adjust_stock, enable_sharding, take_stock
+from .issuance import issue_tickets
+from .inventory_reconciliation import reconcile_inventory
+from .models import (
+    Event, InventoryShard, MetricsSnapshot, SalesDaily, Ticket, TicketCategory, User, WaitingRoom,
+)
+from .sales_counters import verify_sales_counters
+from .sales_rollup import rebuild_sales_daily
+from .seller_dashboard import build_dashboard
+from .ticket_codes import (
+    ALPHABET, CODE_LENGTH, SPACE, TicketCodeAllocator,
+    decode, encode, permute, round_keys, unpermute,
+)
+
+MANAGE_PY = Path(__file__).resolve().parent.parent / 'manage.py'
+
+
+class TicketCodeTests(TestCase):
+
+    @tag('slow')
+    def test_no_duplicates_across_10m_codes(self):
+        # permute() is injective iff unpermute() undoes it for every input:
+        # two numbers mapping to one code would need one inverse for both.
+        # Checking that is O(1) memory, unlike a 10M-entry set.
+        keys = round_keys('test-sequence')
+        for number in range(10_000_000):
+            scrambled = permute(number, keys)
+            if not 0 <= scrambled < SPACE or unpermute(scrambled, keys) != number:
+                self.fail(f"permute() is not a bijection at {number}")
+
+    def test_encode_round_trips_without_ambiguous_characters(self):
+        keys = round_keys('test-sequence')
+        for number in range(0, 10_000_000, 997):
+            code = encode(permute(number, keys))
+            self.assertEqual(len(code), CODE_LENGTH)
+            self.assertFalse(set(code) & set('0O1I'))
+            self.assertEqual(unpermute(decode(code), keys), number)
+        self.assertEqual(decode(encode(SPACE - 1)), SPACE - 1)
+        self.assertEqual(len(set(ALPHABET)), 32)
+
+    def test_decode_rejects_malformed_codes(self):
+        with self.assertRaises(ValueError):
+            decode('ABC')
+        with self.assertRaises(ValueError):
+            decode('O' * CODE_LENGTH)
+
+    def test_allocator_spans_blocks_without_duplicates(self):
+        allocator = TicketCodeAllocator('test', block_size=100)
+        codes = allocator.allocate_many(250) + [allocator.allocate() for _ in range(60)]
+        self.assertEqual(len(set(codes)), 310)
+        # 250 at once reserves one block of 250; the singles need one more
+        self.assertEqual(allocator.stats()['blocks_reserved'], 2)
+
+        # A second process on the same sequence gets fresh numbers
+        other = TicketCodeAllocator('test', block_size=100)
+        self.assertFalse(set(other.allocate_many(50)) & set(codes))
+
+
+class SellerDashboardTests(TestCase):
+
+    def _seller_with_events(self, username, n_events):
+        seller = User.objects.create_user(username=username, password='x', is_seller=True)
+        for i in range(n_events):
+            event = Event.objects.create(
+                organizer=seller, title=f'{username} {i}', description='-',
+                date=timezone.now() + timedelta(days=10), location='Nairobi',
+                available_tickets=50,
+            )
+            category = TicketCategory.objects.create(
+                event=event, name='Regular', price=Decimal('500'),
+                available_tickets=50,
+            )
+            # Explicit codes: the code allocator's own connection would
+            # block on the test transaction under sqlite
+            Ticket.objects.bulk_create(
+                Ticket(
+                    event=event, ticket_category=category, buyer_name='Buyer',
+                    buyer_email='buyer@example.com', quantity=1,
+                    unit_price=Decimal('500'), total_amount=Decimal('500'),
+                    ticket_code=f'{username}-{i}-{n}', status='confirmed',
+                )
+                for n in range(2)
+            )
+        return seller
+
+    def test_query_count_does_not_grow_with_events(self):
+        small = self._seller_with_events('small', 1)
+        large = self._seller_with_events('large', 20)
+        # bulk_create above skips the incremental rollup; rebuild it
+        rebuild_sales_daily()
+
+        for period in ('7d', '30d', '90d', 'all'):
+            with self.assertNumQueries(6):
+                build_dashboard(small, period)
+            with self.assertNumQueries(6):
+                context = build_dashboard(large, period)
+
+        self.assertEqual(context['total_events'], 20)
+        self.assertEqual(context['total_capacity'], 1000)
+        self.assertEqual(context['total_revenue'], Decimal('20000'))
+        self.assertEqual(sum(context['revenue_data']), 20000.0)
+        self.assertEqual([e['tickets_count'] for e in context['events']], [2] * 20)
+        self.assertEqual(context['category_data'], [2] * 5)
+
+
+# Counts ORM queries only — production's cache is Redis, not the database cache
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class EventListingTests(TestCase):
+
+    def setUp(self):
+        # Event ids repeat across rolled-back tests; start from a clean page cache
+        cache.clear()
+
+    def _events(self, n, start=0):
+        organizer = User.objects.create_user(username=f'organizer{start}', password='x', is_seller=True)
+        for i in range(start, start + n):
+            event = Event.objects.create(
+                organizer=organizer, title=f'Listing {i}', description='-',
+                date=timezone.now() + timedelta(days=5), location='Nairobi',
+            )
+            TicketCategory.objects.create(event=event, name='Free', price=0, available_tickets=10)
+            TicketCategory.objects.create(event=event, name='VIP', price=Decimal('1500'), available_tickets=0)
+
+    def _render_list(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('event_list'), secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_event_list_query_count_is_constant(self):
+        self._events(5)
+        _, few = self._render_list()
+        self._events(45, start=5)
+        response, many = self._render_list()
+
+        self.assertEqual(len(response.context['upcoming_events']), 50)
+        self.assertEqual(few, many)
+
+    def test_listing_summary_matches_properties(self):
+        self._events(1)
+        TicketCategory.objects.filter(name='Free').update(available_tickets=0)
+        annotated = Event.objects.with_listing_summary().get()
+        plain = Event.objects.get()
+
+        for attr in ('starting_price', 'lowest_ticket_price', 'highest_ticket_price',
+                     'has_free_tickets', 'is_sold_out', 'has_available_categories'):
+            self.assertEqual(getattr(annotated, attr), getattr(plain, attr), attr)
+        self.assertTrue(annotated.is_sold_out)
+        self.assertEqual(annotated.starting_price, 0)
+
+
+class StockEditTests(TestCase):
+
+    def setUp(self):
+        organizer = User.objects.create_user(username='stock', password='x', is_seller=True)
+        event = Event.objects.create(
+            organizer=organizer, title='Stock', description='-',
+            date=timezone.now() + timedelta(days=3), location='Nairobi',
+        )
+        self.category = TicketCategory.objects.create(
+            event=event, name='Regular', price=Decimal('800'), available_tickets=100,
+        )
+
+    def _edit(self, category, available):
+        """Load the form, let 10 tickets sell, then submit `available`."""
+        loaded = TicketCategoryForm(instance=category)
+        self.assertTrue(take_stock(category.pk, 10))
+        data = {name: loaded[name].value() for name in loaded.fields}
+        data = {name: '' if value is None else value for name, value in data.items()}
+        data.update(available_tickets=available)
+        form = TicketCategoryForm(data, instance=TicketCategory.objects.get(pk=category.pk))
+        self.assertTrue(form.is_valid(), form.errors)
+        form.save()
+        if form.stock_delta():
+            adjust_stock(category.pk, form.stock_delta())
+
+    def test_form_save_keeps_sales_made_while_it_was_open(self):
+        self._edit(self.category, 120)
+        self.assertEqual(TicketCategory.objects.get(pk=self.category.pk).available_tickets, 110)
+
+    def test_sharded_stock_edit_is_respread(self):
+        enable_sharding(self.category, 4)
+        self._edit(TicketCategory.objects.get(pk=self.category.pk), 80)
+
+        category = TicketCategory.objects.with_live_stock().get(pk=self.category.pk)
+        self.assertEqual(category.live_available, 70)
+        self.assertEqual(category.shard_count, 4)
+        self.assertEqual(sorted(category.stock_shards.values_list('available', flat=True)), [17, 17, 18, 18])
+
+
+class InventoryReconciliationTests(TestCase):
+
+    def setUp(self):
+        organizer = User.objects.create_user(username='recon', password='x', is_seller=True)
+        self.event = Event.objects.create(
+            organizer=organizer, title='Recon', description='-',
+            date=timezone.now() + timedelta(days=3), location='Nairobi',
+        )
+        self.correct = self._category('Correct', initial=100, sold=10, available=90)
+        self.short = self._category('Short', initial=50, sold=5, available=30)
+        self.extra = self._category('Extra', initial=40, sold=0, available=40)
+        enable_sharding(self.extra, 4)
+        InventoryShard.objects.filter(category=self.extra, index=0).update(available=20)
+
+    def _category(self, name, initial, sold, available):
+        category = TicketCategory.objects.create(
+            event=self.event, name=name, price=Decimal('100'), available_tickets=initial,
+        )
+        Ticket.objects.bulk_create([
+            Ticket(event=self.event, ticket_category=category, buyer_name='Fan',
+                   buyer_email='fan@example.com', quantity=1, unit_price=100,
+                   total_amount=100, ticket_code=f'{name.upper()}{n:04d}', status='confirmed')
+            for n in range(sold)
+        ])
+        TicketCategory.objects.filter(pk=category.pk).update(available_tickets=available)
+        return category
+
+    def _stock(self):
+        return dict(TicketCategory.objects.with_live_stock().values_list('name', '_live_available'))
+
+    def test_report_only_changes_nothing(self):
+        report = reconcile_inventory()
+        self.assertEqual(report['drifted'], 2)
+        self.assertEqual(self._stock(), {'Correct': 90, 'Short': 30, 'Extra': 50})
+
+    def test_repair_restores_drifted_rows_only(self):
+        out = StringIO()
+        call_command('reconcile_inventory', '--repair', '--json', '-', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(self._stock(), {'Correct': 90, 'Short': 45, 'Extra': 40})
+        self.assertEqual(
+            {row['category_id'] for row in report['categories'] if row['repaired']},
+            {self.short.pk, self.extra.pk},
+        )
+
+        event = Event.objects.get(pk=self.event.pk)
+        self.assertEqual((event.total_tickets, event.available_tickets), (190, 175))
+        # Nothing left to repair
+        self.assertEqual(reconcile_inventory(repair=True)['drifted'], 0)
+
+
+class SalesCountersTests(TestCase):
+
+    def setUp(self):
+        organizer = User.objects.create_user(username='sales', password='x', is_seller=True)
+        self.event = Event.objects.create(
+            organizer=organizer, title='Sales', description='-',
+            date=timezone.now() + timedelta(days=3), location='Nairobi',
+        )
+        self.category = TicketCategory.objects.create(
+            event=self.event, name='Regular', price=Decimal('500'), available_tickets=100,
+        )
+        self._codes = iter(range(10_000))
+
+    def _issue(self, quantity, total, unit_price=None):
+        with mock.patch('events.issuance.allocate_ticket_codes',
+                        lambda n: [f'SALE{next(self._codes):05d}' for _ in range(n)]):
+            return issue_tickets(
+                self.event,
+                [{'category': self.category, 'quantity': quantity,
+                  'unit_price': unit_price or total / quantity, 'total': total}],
+                buyer_name='Fan', buyer_email='fan@example.com',
+            )
+
+    def _revenue(self):
+        category = TicketCategory.objects.get(pk=self.category.pk)
+        event = Event.objects.get(pk=self.event.pk)
+        rollup = SalesDaily.objects.filter(event=self.event).aggregate(total=Sum('revenue'))['total']
+        return category.revenue, event.revenue, rollup
+
+    def _counters(self, model, pk):
+        return model.objects.values_list('sold_count', 'confirmed_count', 'revenue').get(pk=pk)
+
+    def test_check_in_keeps_the_price_paid(self):
+        # Promo: 800 charged for 2, recorded against the 500 list price
+        ticket, = self._issue(2, Decimal('800'), unit_price=Decimal('500'))
+        self.assertEqual(self._revenue(), (Decimal('800'),) * 3)
+
+        ticket.mark_as_used()
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.total_amount, Decimal('800'))
+        self.assertEqual(self._revenue(), (Decimal('800'),) * 3)
+
+    def test_edit_saved_after_a_sale_keeps_the_counters(self):
+        # Loaded by the admin / edit_event form before the sale lands
+        stale_event = Event.objects.get(pk=self.event.pk)
+        stale_category = TicketCategory.objects.get(pk=self.category.pk)
+        self._issue(2, Decimal('800'))
+
+        stale_category.name = 'Regular (renamed)'
+        stale_category.save()
+        stale_event.title = 'Sales (renamed)'
+        stale_event.save()
+
+        expected = (2, 2, Decimal('800'))
+        self.assertEqual(self._counters(TicketCategory, self.category.pk), expected)
+        self.assertEqual(self._counters(Event, self.event.pk), expected)
+        self.assertEqual(TicketCategory.objects.get(pk=self.category.pk).name, 'Regular (renamed)')
+
+    def test_rebuild_fixes_drifted_counters_only(self):
+        vip = TicketCategory.objects.create(
+            event=self.event, name='VIP', price=Decimal('2000'), available_tickets=10,
+        )
+        self._issue(2, Decimal('800'))
+        with mock.patch('events.issuance.allocate_ticket_codes', lambda n: ['VIP00001']):
+            issue_tickets(self.event, [{'category': vip, 'quantity': 1}],
+                          buyer_name='Fan', buyer_email='fan@example.com')
+        TicketCategory.objects.filter(pk=self.category.pk).update(sold_count=9, revenue=0)
+        Event.objects.filter(pk=self.event.pk).update(confirmed_count=0)
+
+        out = StringIO()
+        call_command('verify_sales_counters', '--rebuild', '--json', '-', stdout=out)
+        report = json.loads(out.getvalue())
+
+        self.assertEqual(
+            {(row['model'], row['id']) for row in report['rows']},
+            {('category', self.category.pk), ('event', self.event.pk)},
+        )
+        self.assertEqual(self._counters(TicketCategory, self.category.pk), (2, 2, Decimal('800')))
+        self.assertEqual(self._counters(TicketCategory, vip.pk), (1, 1, Decimal('2000')))
+        self.assertEqual(self._counters(Event, self.event.pk), (3, 3, Decimal('2800')))
+        self.assertEqual(verify_sales_counters()['stale_categories'], 0)
+
+    def test_cancelling_twice_restocks_once(self):
+        ticket, = self._issue(2, Decimal('800'))
+        self.assertEqual(TicketCategory.objects.get(pk=self.category.pk).available_tickets, 98)
+
+        self.assertEqual(cancel_tickets([ticket.pk])['restocked'], 2)
+        self.assertEqual(cancel_tickets([ticket.pk]), {'cancelled': 0, 'restocked': 0, 'categories': 0})
+        ticket.cancel()
+
+        self.assertEqual(TicketCategory.objects.get(pk=self.category.pk).available_tickets, 100)
+        self.assertEqual(Event.objects.get(pk=self.event.pk).available_tickets, 100)
+
+    def test_cancellation_takes_out_only_its_ticket(self):
+        kept, = self._issue(1, Decimal('500'))
+        cancelled, = self._issue(2, Decimal('800'))
+        self.assertEqual(self._counters(TicketCategory, self.category.pk), (3, 3, Decimal('1300')))
+
+        cancel_tickets([cancelled.pk])
+        cancel_tickets([cancelled.pk])
+
+        expected = (1, 1, Decimal('500'))
+        self.assertEqual(self._counters(TicketCategory, self.category.pk), expected)
+        self.assertEqual(self._counters(Event, self.event.pk), expected)
+        rollup = SalesDaily.objects.filter(event=self.event).aggregate(
+            tickets=Sum('tickets'), quantity=Sum('quantity'), revenue=Sum('revenue'),
+        )
+        self.assertEqual(rollup, {'tickets': 1, 'quantity': 1, 'revenue': Decimal('500')})
+
+
+class PageCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        page_cache.reset_stats()
+        organizer = User.objects.create_user(username='pages', password='x', is_seller=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.events = [
+                Event.objects.create(
+                    organizer=organizer, title=f'Cached {i}', description='-',
+                    date=timezone.now() + timedelta(days=3), location='Nairobi',
+                )
+                for i in range(10)
+            ]
+            self.category = TicketCategory.objects.create(
+                event=self.events[0], name='Regular', price=Decimal('800'), available_tickets=40,
+            )
+
+    def _get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode(), len(queries)
+
+    def test_warm_pages_share_fragments(self):
+        detail = reverse('event_detail', args=[self.events[0].slug])
+        for url in (reverse('home'), reverse('event_list'), detail):
+            cold_html, cold = self._get(url)
+            warm_html, warm = self._get(url)
+            self.assertLess(warm, cold, url)
+            self.assertEqual(warm_html, cold_html, url)
+
+        stats = page_cache.stats()
+        self.assertEqual(stats['hits'], stats['misses'])
+
+    def test_writes_invalidate_only_their_event(self):
+        detail = reverse('event_detail', args=[self.events[0].slug])
+        self._get(reverse('event_list'))
+        self.assertIn('40 Available', self._get(detail)[0])
+
+        # Stock UPDATEs send no signals; inventory bumps the version itself
+        with self.captureOnCommitCallbacks(execute=True):
+            take_stock(self.category.pk, 5)
+        self.assertIn('35 Available', self._get(detail)[0])
+
+        page_cache.reset_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.events[1].title = 'Renamed'
+            self.events[1].save()
+        html, _ = self._get(reverse('event_list'))
+        self.assertIn('Renamed', html)
+        # Re-rendered: event 0 (stock taken) and event 1 (renamed); the other 8 hit
+        self.assertEqual(page_cache.stats()['misses'], 2)
+        self.assertEqual(page_cache.stats()['hits'], 8)
+
+
+    def test_bump_in_another_process_is_visible(self):
+        # What the reconciler or another web worker does — through the shared
+        # cache backend, not this process's memory
+        event = self.events[0]
+        backend = 'django.core.cache.backends.filebased.FileBasedCache'
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CACHES={'default': {'BACKEND': backend, 'LOCATION': location}}
+        ):
+            page_cache.ticket_table(event)
+            page_cache.ticket_table(event)
+            self.assertEqual(page_cache.stats()['hits'], 1)
+
+            subprocess.run(
+                [sys.executable, str(MANAGE_PY), 'shell', '-c',
+                 f'from events import page_cache; page_cache.bump_now([{event.pk}])'],
+                env={**os.environ, 'CACHE_BACKEND': backend, 'CACHE_LOCATION': location},
+                check=True, capture_output=True, timeout=60,
+            )
+
+            page_cache.ticket_table(event)
+            self.assertEqual(page_cache.stats()['misses'], 2)
+
+
+class WaitingRoomTests(TestCase):
+    """Admission runs on the clock and the session alone — no Redis, no worker."""
+
+    def setUp(self):
+        cache.clear()
+        organizer = User.objects.create_user(username='queue', password='x', is_seller=True)
+        self.event = Event.objects.create(
+            organizer=organizer, title='Drop', description='-',
+            date=timezone.now() + timedelta(days=3), location='Nairobi',
+        )
+        self.opens_at = timezone.now()
+        WaitingRoom.objects.create(
+            event=self.event, opens_at=self.opens_at, admit_per_second=1, admission_minutes=1,
+        )
+        self.t0 = self.opens_at.timestamp()
+
+    def _fan(self):
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda r: None).process_request(request)
+        request.session.save()
+        return request
+
+    def _status(self, fan, seconds):
+        with mock.patch('events.waiting_room.time.time', return_value=self.t0 + seconds):
+            return waiting_room.queue_status(fan, self.event.id)
+
+    def test_fans_are_admitted_in_join_order(self):
+        fans = [self._fan() for _ in range(3)]
+        self.assertEqual([waiting_room.join(fan, self.event.id) for fan in fans], [1, 2, 3])
+        # Rejoining keeps the place
+        self.assertEqual(waiting_room.join(fans[1], self.event.id), 2)
+
+        self.assertEqual([self._status(fan, 2.5)['admitted'] for fan in fans], [True, True, False])
+        self.assertEqual(self._status(fans[2], 2.5)['ahead'], 1)
+        self.assertTrue(self._status(fans[2], 3.5)['admitted'])
+
+    def test_expired_pass_is_not_granted_again(self):
+        fan = self._fan()
+        waiting_room.join(fan, self.event.id)
+        self.assertTrue(self._status(fan, 1)['admitted'])
+        with mock.patch('events.waiting_room.time.time', return_value=self.t0 + 30):
+            self.assertTrue(waiting_room.has_admission(fan, self.event.id))
+
+        # admission_minutes=1: the pass is gone after 60s and position 1 is spent
+        status = self._status(fan, 62)
+        self.assertFalse(status['admitted'])
+        self.assertTrue(status['expired'])
+        with mock.patch('events.waiting_room.time.time', return_value=self.t0 + 62):
+            self.assertFalse(waiting_room.has_admission(fan, self.event.id))
+            # Back of the queue
+            self.assertEqual(waiting_room.join(fan, self.event.id), 2)
+
+    def test_join_after_room_deleted(self):
+        waiting_room.get_room_config(self.event.id)
+        WaitingRoom.objects.filter(event=self.event).delete()
+        self.assertIsNone(waiting_room.join(self._fan(), self.event.id))
+        self.assertFalse(waiting_room.get_room_config(self.event.id)['active'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class IdempotencyTests(TestCase):
+    """A repeated POST under one key runs the view once."""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+        @idempotent('test')
+        def view(request):
+            self.calls += 1
+            self.release.wait(5)
+            return JsonResponse({'success': True, 'call': self.calls})
+        self.view = view
+
+    def _post(self, data=None, key='key-1'):
+        request = RequestFactory().post('/pay/', data or {'quantity': '2'}, HTTP_IDEMPOTENCY_KEY=key)
+        request.user = AnonymousUser()
+        return self.view(request)
+
+    def test_repeat_replays_the_stored_response(self):
+        first = self._post()
+        again = self._post()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual((again.status_code, again.content), (first.status_code, first.content))
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+        # Another key is another request
+        self._post(key='key-2')
+        self.assertEqual(self.calls, 2)
+
+    def test_duplicate_while_first_is_running_gets_409(self):
+        self.release.clear()
+        first = threading.Thread(target=self._post)
+        first.start()
+        while not self.calls:
+            time.sleep(0.01)
+
+        with mock.patch('events.idempotency.WAIT_SECONDS', 0.3):
+            duplicate = self._post()
+        self.release.set()
+        first.join()
+
+        self.assertEqual(duplicate.status_code, 409)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self._post()['Idempotent-Replayed'], 'true')
+
+    def test_same_key_with_another_payload_gets_422(self):
+        self._post({'quantity': '2'})
+        response = self._post({'quantity': '5'})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.calls, 1)
+
+
+class PlatformMetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.organizer = User.objects.create_user(username='metrics', password='x', is_seller=True)
+        self.event = Event.objects.create(
+            organizer=self.organizer, title='Metrics', description='-',
+            date=timezone.now() + timedelta(days=3), location='Nairobi',
+        )
+        self.category = TicketCategory.objects.create(
+            event=self.event, name='Regular', price=Decimal('100'), available_tickets=100,
+        )
+        self.codes = 0
+
+    def _sell(self, *emails, age=timedelta(hours=1)):
+        tickets = []
+        for email in emails:
+            self.codes += 1
+            tickets.append(Ticket(
+                event=self.event, ticket_category=self.category, buyer_name='Fan', buyer_email=email,
+                quantity=1, unit_price=100, total_amount=100, ticket_code=f'MET{self.codes:04d}',
+                status='confirmed',
+            ))
+        created = Ticket.objects.bulk_create(tickets)
+        Ticket.objects.filter(pk__in=[t.pk for t in created]).update(purchased_at=timezone.now() - age)
+
+    def _buyers(self, snapshot):
+        kpis = snapshot.data['kpis']
+        return snapshot.data['buyers']['total'], kpis['repeat_buyers']
+
+    def test_incremental_buyer_counts_match_a_full_recompute(self):
+        self._sell('a@example.com', 'a@example.com', 'b@example.com')
+        self.assertEqual(self._buyers(platform_metrics.get_snapshot()), (2, 1))
+
+        self._sell('b@example.com', 'c@example.com', 'd@example.com', 'd@example.com', 'a@example.com')
+        # Not settled yet: counted by the next run, not skipped
+        self._sell('e@example.com', age=timedelta(seconds=10))
+        incremental = platform_metrics.refresh_snapshot()
+        self.assertEqual(self._buyers(incremental), (4, 3))
+
+        with mock.patch.object(platform_metrics, 'BUYER_SETTLE_SECONDS', 0):
+            self.assertEqual(self._buyers(platform_metrics.refresh_snapshot()), (5, 3))
+            self.assertEqual(
+                platform_metrics.refresh_snapshot().data['buyers'],
+                platform_metrics.refresh_snapshot(full=True).data['buyers'],
+            )
+
+    def test_series_keeps_old_days_and_recomputes_recent_ones(self):
+        today = timezone.localdate()
+        for days_ago, tickets in ((10, 4), (1, 2), (0, 3)):
+            SalesDaily.objects.create(
+                date=today - timedelta(days=days_ago), organizer=self.organizer, event=self.event,
+                ticket_category=self.category, tickets=tickets, quantity=tickets, revenue=tickets * 100,
+            )
+        snapshot = platform_metrics.get_snapshot()
+        self.assertEqual([row['count'] for row in snapshot.data['series']['daily_sales']], [4, 2, 3])
+
+        # Old days come from the previous run; rows past the window drop out
+        series = snapshot.data['series']
+        series['daily_sales'] = [
+            {'purchased_at__date': (today - timedelta(days=40)).isoformat(), 'total_sales': 1.0, 'count': 1},
+            {'purchased_at__date': (today - timedelta(days=10)).isoformat(), 'total_sales': 9.0, 'count': 9},
+        ]
+        MetricsSnapshot.objects.filter(pk=snapshot.pk).update(
+            data=snapshot.data, computed_at=timezone.now() - timedelta(days=1),
+        )
+        SalesDaily.objects.filter(date=today).update(tickets=5)
+
+        daily = platform_metrics.refresh_snapshot().data['series']['daily_sales']
+        self.assertEqual([row['count'] for row in daily], [9, 2, 5])
+
+        full = platform_metrics.refresh_snapshot(full=True).data['series']['daily_sales']
+        self.assertEqual([row['count'] for row in full], [4, 2, 5])
+
+    def test_refresh_is_skipped_while_another_holds_the_lock(self):
+        first = platform_metrics.get_snapshot()
+        self.assertIsNone(cache.get(platform_metrics.REFRESH_LOCK_KEY))
+
+        cache.add(platform_metrics.REFRESH_LOCK_KEY, 1, 60)
+        self.assertIsNone(platform_metrics.refresh_snapshot())
+        self.assertEqual(MetricsSnapshot.objects.get().computed_at, first.computed_at)
+
+        staff = User.objects.create_user(username='staff', password='x', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.post(reverse('admin_dashboard_refresh'), secure=True, follow=True)
+        self.assertIn('not refreshed', ' '.join(str(m) for m in response.context['messages']))
+
+        # The first snapshot is computed without the lock and must not free another's
+        MetricsSnapshot.objects.all().delete()
+        self.assertIsNotNone(platform_metrics.get_snapshot())
+        self.assertEqual(cache.get(platform_metrics.REFRESH_LOCK_KEY), 1)
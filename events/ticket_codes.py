@@ -0,0 +1,225 @@
+"""
+ZOZAPRIME Ticket Codes
+======================
+Location: events/ticket_codes.py
+
+Human-typable ticket codes that cannot collide.
+
+  number  each code starts as a unique integer from TicketCodeSequence.
+          Processes reserve BLOCK_SIZE numbers at a time (one UPDATE per
+          block), then hand them out from memory under a lock.
+  shuffle a keyed 4-round Feistel permutation over 50 bits maps the
+          number to another number in the same range. A Feistel network
+          is a bijection, so distinct numbers give distinct codes — no
+          existence check, no retry loop — and neighbouring tickets do
+          not get guessable neighbouring codes.
+  encode  10 characters from ALPHABET (no 0/O/1/I), 5 bits each.
+
+Legacy codes were 8 hex characters, so the 10-character codes can never
+clash with them either.
+
+Block reservations run on their own short-lived connection and commit
+immediately: a reservation made inside a checkout transaction that later
+rolls back must stay reserved, or another process would be handed the
+same numbers.
+
+    python manage.py bench_ticket_codes   → codes/sec
+"""
+import hashlib
+import logging
+import secrets
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections
+
+from .models import TicketCodeSequence
+
+logger = logging.getLogger(__name__)
+
+ALPHABET = '23456789ABCDEFGHJKLMNPQRSTUVWXYZ'
+CODE_LENGTH = 10
+BLOCK_SIZE = getattr(settings, 'TICKET_CODE_BLOCK_SIZE', 1000)
+
+_HALF_BITS = CODE_LENGTH * 5 // 2
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_MASK64 = (1 << 64) - 1
+_MULTIPLIER = 0x9E3779B97F4A7C15
+ROUNDS = 4
+SPACE = 1 << (_HALF_BITS * 2)
+
+# Two characters per 10-bit chunk, so encoding is five list lookups
+_PAIRS = [ALPHABET[i >> 5] + ALPHABET[i & 31] for i in range(1024)]
+_VALUES = {char: value for value, char in enumerate(ALPHABET)}
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# PERMUTATION + ENCODING
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def round_keys(secret):
+    """Derive the Feistel round keys from a sequence's secret."""
+    return tuple(
+        int.from_bytes(
+            hashlib.blake2b(secret.encode(), digest_size=8, salt=bytes([i]) * 16).digest(),
+            'big',
+        )
+        for i in range(ROUNDS)
+    )
+
+
+def permute(number, keys):
+    """Map 0 <= number < SPACE to a unique, scrambled number in the same range."""
+    left, right = number >> _HALF_BITS, number & _HALF_MASK
+    for key in keys:
+        left, right = right, left ^ ((((right ^ key) * _MULTIPLIER) & _MASK64) >> 29 & _HALF_MASK)
+    return (left << _HALF_BITS) | right
+
+
+def unpermute(number, keys):
+    """Inverse of permute()."""
+    left, right = number >> _HALF_BITS, number & _HALF_MASK
+    for key in reversed(keys):
+        left, right = right ^ ((((left ^ key) * _MULTIPLIER) & _MASK64) >> 29 & _HALF_MASK), left
+    return (left << _HALF_BITS) | right
+
+
+def encode(number):
+    """50-bit number → 10-character code."""
+    return (
+        _PAIRS[number >> 40] + _PAIRS[(number >> 30) & 1023] + _PAIRS[(number >> 20) & 1023]
+        + _PAIRS[(number >> 10) & 1023] + _PAIRS[number & 1023]
+    )
+
+
+def decode(code):
+    """10-character code → 50-bit number. Raises ValueError if malformed."""
+    code = code.strip().upper()
+    if len(code) != CODE_LENGTH:
+        raise ValueError(f"Ticket codes are {CODE_LENGTH} characters")
+    number = 0
+    for char in code:
+        if char not in _VALUES:
+            raise ValueError(f"Invalid ticket code character: {char!r}")
+        number = (number << 5) | _VALUES[char]
+    return number
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ALLOCATOR
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _reserve_block(name, size):
+    """
+    Reserve `size` numbers from the named sequence on a dedicated,
+    autocommitted connection. Returns (first_number, secret).
+    """
+    table = TicketCodeSequence._meta.db_table
+    conn = connections.create_connection(DEFAULT_DB_ALIAS)
+    try:
+        quote = conn.ops.quote_name
+        for _ in range(2):
+            conn.set_autocommit(False)
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        f"UPDATE {quote(table)} SET {quote('next_value')} = {quote('next_value')} + %s "
+                        f"WHERE {quote('name')} = %s",
+                        [size, name],
+                    )
+                    if cursor.rowcount:
+                        cursor.execute(
+                            f"SELECT {quote('next_value')}, {quote('key')} FROM {quote(table)} "
+                            f"WHERE {quote('name')} = %s",
+                            [name],
+                        )
+                        end, secret = cursor.fetchone()
+                        conn.commit()
+                        return end - size, secret
+
+                    # First use of this sequence (normally created by migration)
+                    cursor.execute(
+                        f"INSERT INTO {quote(table)} ({quote('name')}, {quote('next_value')}, {quote('key')}) "
+                        f"VALUES (%s, %s, %s)",
+                        [name, 0, secrets.token_hex(32)],
+                    )
+                conn.commit()
+            except IntegrityError:
+                conn.rollback()  # another process created it first
+            except Exception:
+                conn.rollback()
+                raise
+        raise RuntimeError(f"Could not reserve ticket codes from sequence {name!r}")
+    finally:
+        conn.close()
+
+
+class TicketCodeAllocator:
+    """Hands out codes from in-memory blocks of a TicketCodeSequence."""
+
+    def __init__(self, name='ticket', block_size=BLOCK_SIZE):
+        self.name = name
+        self.block_size = block_size
+        self._keys = None
+        self._next = 0
+        self._end = 0
+        self._blocks = 0
+        self._issued = 0
+        self._lock = threading.Lock()
+
+    def allocate(self):
+        """One new ticket code."""
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count):
+        """`count` new ticket codes, for batch issuance."""
+        numbers = []
+        with self._lock:
+            while len(numbers) < count:
+                if self._next >= self._end:
+                    self._refill(max(self.block_size, count - len(numbers)))
+                take = min(count - len(numbers), self._end - self._next)
+                numbers.extend(range(self._next, self._next + take))
+                self._next += take
+            self._issued += count
+            keys = self._keys
+        return [encode(permute(number, keys)) for number in numbers]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'issued': self._issued,
+                'blocks_reserved': self._blocks,
+                'left_in_block': self._end - self._next,
+            }
+
+    def _refill(self, size):
+        start, secret = _reserve_block(self.name, size)
+        if start + size > SPACE:
+            raise RuntimeError(f"Ticket code sequence {self.name!r} is exhausted")
+        if self._keys is None:
+            self._keys = round_keys(secret)
+        self._next, self._end = start, start + size
+        self._blocks += 1
+        logger.info(f"[CODES] Reserved {self.name} block {start}–{start + size - 1}")
+
+
+_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_code_allocator():
+    """The process-wide ticket code allocator."""
+    global _allocator
+    with _allocator_lock:
+        if _allocator is None:
+            _allocator = TicketCodeAllocator()
+        return _allocator
+
+
+def allocate_ticket_code():
+    return get_code_allocator().allocate()
+
+
+def allocate_ticket_codes(count):
+    return get_code_allocator().allocate_many(count)
@@ -12,6 +12,8 @@ urlpatterns = [
     path('event/<slug:slug>/', views.event_detail, name='event_detail'),
     # UPDATED: Changed <int:pk> to <slug:slug>
     path('checkout/<slug:slug>/', views.checkout, name='checkout'),
+    path('waiting-room/<slug:slug>/', views.waiting_room, name='waiting_room'),
+    path('waiting-room/<int:event_id>/status/', views.waiting_room_status, name='waiting_room_status'),
     path('ticket/<int:ticket_id>/', views.ticket_confirmation, name='ticket_confirmation'),
     path('validate-promo/', views.validate_promo_code, name='validate_promo_code'),
     
@@ -61,6 +63,8 @@ urlpatterns = [
     # ─── UTILS & API ──────────────────────────────────────────────────────────
     path('privacy-policy/', views.privacy_policy, name='privacy_policy'),
     path('admin-dashboard/', user_passes_test(lambda u: u.is_staff)(views.admin_dashboard), name='admin_dashboard'),
+    path('admin-dashboard/refresh/', views.admin_dashboard_refresh, name='admin_dashboard_refresh'),
+    path('admin-dashboard/live/', views.admin_dashboard_live, name='admin_dashboard_live'),
     path('health/', views.health_check, name='health_check'),
     path('sw.js', service_worker, name='service_worker'),
 ]
\ No newline at end of file
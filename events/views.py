@@ -2,7 +2,8 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
-from django.db.models import Q, Count, Sum, Avg, Min, Max
+from django.db.models import Q, Count, Sum, Avg, Min, Max, F, Value
+from django.db.models.functions import Greatest
 from django.core.mail import send_mail, EmailMessage
 from django.conf import settings
 from django.contrib.auth import login, authenticate, logout
@@ -17,6 +18,14 @@ from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from .models import Category, Event, Ticket, TicketCategory, PromoCode
 from .forms import EventForm, TicketCategoryFormSet, TicketPurchaseForm
+from .idempotency import idempotent
+from .inventory import adjust_stock
+from .issuance import SoldOut, issue_tickets
+from . import page_cache
+from . import platform_metrics
+from .seller_dashboard import build_dashboard
+from . import waiting_room as waiting_room_service
+from .waiting_room import waiting_room_required
 from PIL import Image, ImageDraw, ImageFont
 from decimal import Decimal
 import io
@@ -33,6 +42,7 @@ from django.template.loader import render_to_string
 from django.views.decorators.cache import cache_control
 from django.views.decorators.http import require_GET
 from django.views.decorators.vary import vary_on_cookie
+from django.utils.http import url_has_allowed_host_and_scheme
 
 
 User = get_user_model()
@@ -148,13 +158,15 @@ def signup_seller(request):
 @vary_on_cookie
 def home(request):
     """Home page with upcoming events"""
-    events = Event.objects.filter(
+    # Only the ids are queried per visitor; the cards are shared fragments
+    # (events/page_cache.py), rendered from the annotated query on a miss
+    event_ids = Event.objects.filter(
         is_active=True, 
         date__gte=timezone.now()
-    ).prefetch_related('ticket_categories').order_by('date')[:6]
+    ).order_by('date').values_list('id', flat=True)[:6]
     
     return render(request, 'events/home.html', {
-        'events': events
+        'events': page_cache.event_cards(event_ids, 'home')
     })
 
 @vary_on_cookie
@@ -162,7 +174,8 @@ def event_list(request):
     """List all events with separate upcoming and past sections"""
     now = timezone.now()
     
-    # Base queryset for active events
+    # Base queryset for active events — only the ids are queried here; the
+    # cards themselves are shared fragments (events/page_cache.py)
     base_events = Event.objects.filter(is_active=True)
     categories = Category.objects.all()
 
@@ -183,8 +196,10 @@ def event_list(request):
     # ══════════════════════════════════════════════════════════
     # SPLIT LOGIC: Upcoming vs Past
     # ══════════════════════════════════════════════════════════
-    upcoming_events = base_events.filter(date__gte=now).prefetch_related('ticket_categories').order_by('date')
-    past_events = base_events.filter(date__lt=now).prefetch_related('ticket_categories').order_by('-date')[:6] # Limit past to last 6
+    upcoming_ids = base_events.filter(date__gte=now).order_by('date').values_list('id', flat=True)
+    past_ids = base_events.filter(date__lt=now).order_by('-date').values_list('id', flat=True)[:6] # Limit past to last 6
+    upcoming_events = page_cache.event_cards(upcoming_ids, 'upcoming', now)
+    past_events = page_cache.event_cards(past_ids, 'past', now)
 
     return render(request, 'events/event_list.html', {
         'upcoming_events': upcoming_events,
@@ -198,12 +213,14 @@ def event_list(request):
 def category_events(request, slug):
     """Events filtered by category"""
     category = get_object_or_404(Category, slug=slug)
-    events = Event.objects.filter(category=category)
+    events = Event.objects.filter(category=category).with_listing_summary().select_related('category')
     return render(request, 'events/category_events.html', {'category': category, 'events': events})
 
 def event_detail(request, slug):
     """Event detail page with Promo Link Catcher"""
-    event = get_object_or_404(Event, slug=slug)
+    event = get_object_or_404(
+        Event.objects.with_listing_summary().select_related('category', 'organizer'), slug=slug
+    )
     
     # ══════════════════════════════════════════════════════════
     # THE PROMO LINK CATCHER
@@ -214,15 +231,12 @@ def event_detail(request, slug):
         # We strip and uppercase to keep data clean
         request.session['promo_code'] = promo_from_url.upper().strip()
 
-    # Your existing logic for the first available ticket
-    selected_category = event.ticket_categories.filter(
-        available_tickets__gt=0
-    ).first()
-
+    now = timezone.now()
     context = {
         'event': event,
-        'now': timezone.now(),
-        'selected_category': selected_category,
+        'now': now,
+        # Shared across visitors, keyed by the event's version (events/page_cache.py)
+        'ticket_table': page_cache.ticket_table(event, now),
         # Pass the stored promo to the template so we can show "Promo Applied" UI
         'active_promo': request.session.get('promo_code'),
     }
@@ -289,6 +303,8 @@ def dashboard(request):
     """
     Enhanced Seller Dashboard - "My Shop" 
     NEW: Time period filters, charts, full event list with delete
+    Context is built by seller_dashboard.build_dashboard() in a fixed
+    number of queries, however many events the seller has.
     """
     # Block buyers from accessing seller dashboard
     if not request.user.is_seller:
@@ -296,288 +312,11 @@ def dashboard(request):
         return redirect('home')
     
     # Get time period from URL param (default: 30 days)
-    period = request.GET.get('period', '30d')
-    now = timezone.now()
-    
-    # Calculate date ranges based on selected period
-    if period == '7d':
-        start_date = now - timedelta(days=7)
-        prev_start = start_date - timedelta(days=7)
-    elif period == '90d':
-        start_date = now - timedelta(days=90)
-        prev_start = start_date - timedelta(days=90)
-    elif period == 'all':
-        start_date = None
-        prev_start = None
-    else:  # Default: 30d
-        period = '30d'
-        start_date = now - timedelta(days=30)
-        prev_start = start_date - timedelta(days=30)
-    
-    # Get all events for this seller
-    events = Event.objects.filter(organizer=request.user).prefetch_related('ticket_categories')
-    total_events = events.count()
-    
-    # ═══════════════════════════════════════════════════════════════
-    # REVENUE & SALES METRICS
-    # ═══════════════════════════════════════════════════════════════
-    
-    all_tickets = Ticket.objects.filter(event__organizer=request.user)
-    
-    # Total Revenue (all time)
-    total_revenue = all_tickets.aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-    
-    # Revenue this month
-    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    revenue_this_month = all_tickets.filter(
-        purchased_at__gte=month_start
-    ).aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-    
-    # Tickets sold (period-based)
-    if start_date:
-        period_tickets = all_tickets.filter(purchased_at__gte=start_date)
-    else:
-        period_tickets = all_tickets
-    
-    total_tickets_sold = period_tickets.count()
-    
-    # Tickets sold today
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    tickets_sold_today = all_tickets.filter(purchased_at__gte=today_start).count()
-    
-    # Average ticket price
-    avg_ticket_price = period_tickets.aggregate(avg=Avg('total_amount'))['avg'] or Decimal('0.00')
-    
-    # ═══════════════════════════════════════════════════════════════
-    # CONVERSION & ENGAGEMENT METRICS
-    # ═══════════════════════════════════════════════════════════════
-    
-    # Total capacity across all events
-    total_capacity = 0
-    for event in events:
-        if hasattr(event, 'ticket_categories'):
-            cap = event.ticket_categories.aggregate(total=Sum('initial_tickets'))['total']
-            if cap:
-                total_capacity += cap
-        elif hasattr(event, 'total_tickets') and event.total_tickets:
-            total_capacity += event.total_tickets
-    
-    # Occupancy rate (tickets sold / total capacity)
-    all_tickets_count = all_tickets.count()
-    occupancy_rate = (all_tickets_count / total_capacity * 100) if total_capacity > 0 else 0
-    
-    # Active events (future events with tickets available)
-    active_events_count = events.filter(
-        date__gte=now,
-        is_active=True,
-        available_tickets__gt=0
-    ).count()
-    
-    # Sold out events
-    sold_out_events = events.filter(available_tickets=0).count()
-    
-    # Conversion rate (same as occupancy rate in this context)
-    conversion_rate = occupancy_rate
-    
-    # ═══════════════════════════════════════════════════════════════
-    # REVENUE CHART DATA (Time-based)
-    # ═══════════════════════════════════════════════════════════════
-    
-    revenue_labels = []
-    revenue_data = []
-    
-    if period == '7d':
-        # Daily for last 7 days
-        for i in range(7):
-            date = now - timedelta(days=6-i)
-            day_start = date.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = date.replace(hour=23, minute=59, second=59, microsecond=999999)
-            
-            day_revenue = Ticket.objects.filter(
-                event__organizer=request.user,
-                purchased_at__gte=day_start,
-                purchased_at__lte=day_end
-            ).aggregate(total=Sum('total_amount'))['total'] or 0
-            
-            revenue_labels.append(date.strftime('%a'))
-            revenue_data.append(float(day_revenue))
-    
-    elif period == '30d':
-        # Daily for last 30 days
-        for i in range(30):
-            date = now - timedelta(days=29-i)
-            day_start = date.replace(hour=0, minute=0, second=0, microsecond=0)
-            day_end = date.replace(hour=23, minute=59, second=59, microsecond=999999)
-            
-            day_revenue = Ticket.objects.filter(
-                event__organizer=request.user,
-                purchased_at__gte=day_start,
-                purchased_at__lte=day_end
-            ).aggregate(total=Sum('total_amount'))['total'] or 0
-            
-            revenue_labels.append(date.strftime('%d'))
-            revenue_data.append(float(day_revenue))
-    
-    elif period == '90d':
-        # Weekly for last 90 days
-        for i in range(13):
-            week_start = now - timedelta(days=90 - (i*7))
-            week_end = week_start + timedelta(days=6)
-            
-            week_revenue = Ticket.objects.filter(
-                event__organizer=request.user,
-                purchased_at__gte=week_start,
-                purchased_at__lte=week_end
-            ).aggregate(total=Sum('total_amount'))['total'] or 0
-            
-            revenue_labels.append(week_start.strftime('%b %d'))
-            revenue_data.append(float(week_revenue))
-    
-    else:  # all time
-        # Monthly for last 6 months
-        for i in range(6):
-            month_date = now - timedelta(days=30*i)
-            month_start = month_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            
-            if i == 0:
-                month_end = now
-            else:
-                next_month = month_start + timedelta(days=32)
-                month_end = next_month.replace(day=1) - timedelta(seconds=1)
-            
-            month_revenue = Ticket.objects.filter(
-                event__organizer=request.user,
-                purchased_at__gte=month_start,
-                purchased_at__lte=month_end
-            ).aggregate(total=Sum('total_amount'))['total'] or 0
-            
-            revenue_labels.insert(0, month_start.strftime('%b'))
-            revenue_data.insert(0, float(month_revenue))
-    
-    # ═══════════════════════════════════════════════════════════════
-    # SALES BY CATEGORY CHART DATA
-    # ═══════════════════════════════════════════════════════════════
-    
-    category_labels = []
-    category_data = []
-    
-    # Get top 5 ticket categories by sales
-    category_stats = TicketCategory.objects.filter(
-        event__organizer=request.user
-    ).annotate(
-        sold=Count('tickets')
-    ).order_by('-sold')[:5]
-    
-    for cat in category_stats:
-        if cat.sold > 0:
-            category_labels.append(cat.name)
-            category_data.append(cat.sold)
-    
-    # If no categories, add default
-    if not category_labels:
-        category_labels = ['No Sales Yet']
-        category_data = [0]
+    context = build_dashboard(request.user, request.GET.get('period', '30d'))
     
-    # ═══════════════════════════════════════════════════════════════
-    # EVENTS LIST WITH METRICS (for event cards)
-    # ═══════════════════════════════════════════════════════════════
-    
-    events_list = []
-    for event in events.select_related().prefetch_related('ticket_categories'):
-        # Calculate event-specific metrics
-        event_tickets = Ticket.objects.filter(event=event)
-        tickets_count = event_tickets.count()
-        
-        event_revenue = event_tickets.aggregate(
-            total=Sum('total_amount')
-        )['total'] or Decimal('0.00')
-        
-        # Calculate capacity
-        if hasattr(event, 'ticket_categories'):
-            capacity = event.ticket_categories.aggregate(
-                total=Sum('initial_tickets')
-            )['total'] or 0
-        elif hasattr(event, 'total_tickets'):
-            capacity = event.total_tickets or 0
-        else:
-            capacity = 0
-        
-        events_list.append({
-            'slug': event.slug,
-            'title': event.title,
-            'image': event.image if hasattr(event, 'image') else None,
-            'date': event.date,
-            'tickets_count': tickets_count,
-            'capacity': capacity,
-            'revenue': event_revenue,
-        })
-    
-    # ═══════════════════════════════════════════════════════════════
-    # TOP PERFORMING EVENTS (for old dashboard compatibility)
-    # ═══════════════════════════════════════════════════════════════
-    
-    top_events = events.annotate(
-        revenue=Sum('tickets__total_amount'),
-        tickets_count=Count('tickets')
-    ).order_by('-revenue')[:5]
-    
-    # ═══════════════════════════════════════════════════════════════
-    # RECENT SALES (Last 10 tickets)
-    # ═══════════════════════════════════════════════════════════════
-    
-    recent_sales = all_tickets.select_related(
-        'event', 'ticket_category'
-    ).order_by('-purchased_at')[:10]
-    
-    # ═══════════════════════════════════════════════════════════════
-    # MERCHANDISE STATS
-    # ═══════════════════════════════════════════════════════════════
-    
-    try:
-        from seller_merchandise.models import SellerMerchandise
-        total_products = SellerMerchandise.objects.filter(seller=request.user).count()
-    except Exception:
-        total_products = 0
-    
-    # ═══════════════════════════════════════════════════════════════
-    # CONTEXT DATA
-    # ═══════════════════════════════════════════════════════════════
-    
-    context = {
-        # Period
-        'period': period,
-        
-        # Events
-        'events': events_list,  # NEW: Full list for cards
-        'total_events': total_events,
-        'active_events_count': active_events_count,
-        'sold_out_events': sold_out_events,
-        
-        # Revenue
-        'total_revenue': total_revenue,
-        'revenue_this_month': revenue_this_month,
-        'avg_ticket_price': avg_ticket_price,
-        
-        # Tickets
-        'total_tickets_sold': total_tickets_sold,
-        'tickets_sold_today': tickets_sold_today,
-        'total_capacity': total_capacity,
-        'occupancy_rate': round(occupancy_rate, 1),
-        'conversion_rate': round(conversion_rate, 1),
-        
-        # Performance (for old template compatibility)
-        'top_events': top_events,
-        'recent_sales': recent_sales,
-        
-        # Charts (NEW: JSON for Chart.js)
-        'revenue_labels': json.dumps(revenue_labels),
-        'revenue_data': json.dumps(revenue_data),
-        'category_labels': json.dumps(category_labels),
-        'category_data': json.dumps(category_data),
-        
-        # Merchandise
-        'total_products': total_products,
-    }
+    # Charts (JSON for Chart.js)
+    for key in ('revenue_labels', 'revenue_data', 'category_labels', 'category_data'):
+        context[key] = json.dumps(context[key])
     
     return render(request, 'events/dashboard.html', context)
 
@@ -694,6 +433,16 @@ def edit_event(request, slug):
                 # This will update the slug if the title changed
                 event = form.save(commit=False)
                 
+                # A stock edit is a capacity change against the stock the seller
+                # saw when the form loaded: applied as a move through the
+                # inventory module (sales since then are kept, shards re-spread),
+                # with initial_tickets moving by the same amount (keeps
+                # reconcile_inventory's expected stock in step)
+                stock_deltas = {
+                    f.instance.pk: f.stock_delta()
+                    for f in ticket_formset.forms if f.instance.pk and f not in ticket_formset.deleted_forms
+                }
+
                 categories = ticket_formset.save(commit=False)
                 for category in categories:
                     if category.is_free:
@@ -705,8 +454,16 @@ def edit_event(request, slug):
                 for obj in ticket_formset.deleted_objects:
                     obj.delete()
 
-                event.available_tickets = sum(
-                    tc.available_tickets for tc in event.ticket_categories.all()
+                for category_id, delta in stock_deltas.items():
+                    if delta:
+                        adjust_stock(category_id, delta)
+                        TicketCategory.objects.filter(pk=category_id).update(
+                            initial_tickets=Greatest(F('initial_tickets') + delta, Value(0))
+                        )
+
+                event.available_tickets = (
+                    event.ticket_categories.with_live_stock()
+                    .aggregate(total=Sum('_live_available'))['total'] or 0
                 )
                 event.save()
 
@@ -725,15 +482,55 @@ def edit_event(request, slug):
         'event': event
     })
 
+# ============================================================================
+# WAITING ROOM (HIGH-DEMAND DROPS)
+# ============================================================================
+
+def waiting_room(request, slug):
+    """Queue page shown while checkout is rate-limited for a busy event"""
+    event = get_object_or_404(Event, slug=slug)
+    config = waiting_room_service.get_room_config(event.id)
+
+    next_url = request.GET.get('next', '')
+    if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+        next_url = ''
+    next_url = next_url or event.get_absolute_url()
+
+    if not config['active'] or waiting_room_service.has_admission(request, event.id, config):
+        return redirect(next_url)
+
+    position = waiting_room_service.join(request, event.id)
+    if position is None:
+        return redirect(next_url)
+
+    return render(request, 'events/waiting_room.html', {
+        'event': event,
+        'position': position,
+        'next_url': next_url,
+    })
+
+
+@require_GET
+def waiting_room_status(request, event_id):
+    """
+    Lightweight queue poll — reads only the session and the cached room
+    config, never the Event / TicketCategory tables.
+    """
+    return JsonResponse(waiting_room_service.queue_status(request, event_id))
+
+
 # ============================================================================
 # CHECKOUT & PAYMENT PROCESSING (M-PESA ONLY)
 # ============================================================================
 
+@waiting_room_required()
+@idempotent('checkout')
 def checkout(request, slug):
     """
     Checkout page.
     - Uses 'slug' instead of 'pk' for cleaner, SEO-friendly URLs.
-    - Free/RSVP tickets: bypass M-Pesa entirely.
+    - Free/RSVP tickets: bypass M-Pesa entirely. The POST carries an
+      idempotency key, so a double submit replays the first redirect.
     - Bundle tickets: use effective_price, show people count.
     - Paid tickets: handles promo code re-verification on POST for security.
     """
@@ -760,10 +557,10 @@ def checkout(request, slug):
             if quantity < 1:
                 raise ValueError("Quantity must be at least 1")
 
-            category = TicketCategory.objects.get(
+            category = TicketCategory.objects.with_live_stock().get(
                 id=category_id,
                 event=event,
-                available_tickets__gte=quantity
+                _live_available__gte=quantity
             )
 
             # Always use effective_price (respects is_free flag)
@@ -950,7 +747,8 @@ def send_ticket_email(ticket):
 def handle_free_rsvp(request, event, ticket_selections):
     """
     Handles RSVP / free ticket confirmation.
-    Creates confirmed Ticket records immediately — no payment needed.
+    Issues confirmed tickets for every selection in one transaction —
+    no payment needed.
     """
     buyer_name = request.POST.get('buyer_name', '').strip()
     buyer_email = request.POST.get('buyer_email', '').strip()
@@ -959,38 +757,22 @@ def handle_free_rsvp(request, event, ticket_selections):
         messages.error(request, 'Please provide your name and email for the RSVP.')
         return redirect('event_detail', slug=event.slug)
 
-    created_tickets = []
-
     try:
-        for selection in ticket_selections:
-            category = selection['category']
-            quantity = selection['quantity']
-
-            # Re-check availability (race condition safety)
-            category.refresh_from_db()
-            if category.available_tickets < quantity:
-                messages.error(
-                    request,
-                    f'Sorry — only {category.available_tickets} spot(s) left for {category.name}.'
-                )
-                return redirect('event_detail', slug=event.slug)
-
-            ticket = Ticket.objects.create(
-                event=event,
-                ticket_category=category,
-                buyer_name=buyer_name,
-                buyer_email=buyer_email,
-                quantity=quantity,
-                unit_price=Decimal('0.00'),
-                total_amount=Decimal('0.00'),
-                status='confirmed',
-            )
-
-            # Decrement availability
-            category.available_tickets -= quantity
-            category.save(update_fields=['available_tickets'])
-            created_tickets.append(ticket)
+        created_tickets = issue_tickets(
+            event,
+            ticket_selections,
+            buyer_name=buyer_name,
+            buyer_email=buyer_email,
+            buyer=request.user if request.user.is_authenticated else None,
+        )
+    except SoldOut as e:
+        messages.error(
+            request,
+            f'Sorry — only {e.available} spot(s) left for {e.category.name}.'
+        )
+        return redirect('event_detail', slug=event.slug)
 
+    try:
         # TODO: send_ticket_email(created_tickets[0]) — once Zoho/Resend is live
 
         messages.success(request, "You're in! Check your email for your RSVP confirmation.")
@@ -1076,213 +858,69 @@ def subscription_settings(request):
 
 @staff_member_required
 def admin_dashboard(request):
-    """Admin dashboard with comprehensive analytics - WITH 5 NEW METRICS"""
+    """
+    Admin dashboard with comprehensive analytics - WITH 5 NEW METRICS
+    KPIs and charts come from the precomputed MetricsSnapshot
+    (events/platform_metrics.py); only the recent-activity lists and this
+    worker's M-Pesa stats are read live.
+    """
     if not request.user.is_staff:
         return redirect('home')
     
-    now = timezone.now()
-    thirty_days_ago = now - timedelta(days=30)
-    
-    # ═══════════════════════════════════════════════════════════════
-    # EXISTING METRICS
-    # ═══════════════════════════════════════════════════════════════
-    
-    # User statistics
-    total_users = User.objects.count()
-    new_users_week = User.objects.filter(
-        date_joined__gte=now - timedelta(days=7)
-    ).count()
-    active_users = User.objects.filter(is_active=True).count()
-    
-    # Ticket statistics
-    total_tickets = Ticket.objects.count()
-    tickets_today = Ticket.objects.filter(
-        purchased_at__date=now.date()
-    ).count()
-    total_revenue = Ticket.objects.aggregate(
-        total=Sum('total_amount')
-    )['total'] or Decimal('0.00')
-    
-    # Average ticket price
-    avg_ticket_price = Ticket.objects.aggregate(
-        avg=Avg('total_amount')
-    )['avg'] or Decimal('0.00')
-    
-    # Tickets this week
-    tickets_this_week = Ticket.objects.filter(
-        purchased_at__gte=now - timedelta(days=7)
-    ).count()
-    
-    # Event statistics
-    total_events = Event.objects.count()
-    upcoming_events = Event.objects.filter(date__gte=now).count()
-    
-    # M-Pesa stats
-    mpesa_success_rate = 0
-    mpesa_total_attempts = 0
-    try:
-        from payments.models import Transaction
-        mpesa_total_attempts = Transaction.objects.count()
-        mpesa_successful = Transaction.objects.filter(status='success').count()
-        if mpesa_total_attempts > 0:
-            mpesa_success_rate = round((mpesa_successful / mpesa_total_attempts) * 100)
-    except Exception:
-        pass
-    
-    # ═══════════════════════════════════════════════════════════════
-    # NEW METRIC 1: ACTIVE SELLERS
-    # ═══════════════════════════════════════════════════════════════
-    active_sellers = User.objects.filter(
-        is_seller=True,
-        events__isnull=False
-    ).distinct().count()
-    
-    # ═══════════════════════════════════════════════════════════════
-    # NEW METRIC 2: CONVERSION RATE (Visitors to Buyers)
-    # ═══════════════════════════════════════════════════════════════
-    try:
-        from analytics.models import Visit
-        total_visits = Visit.objects.filter(
-            timestamp__gte=thirty_days_ago
-        ).count()
-        unique_visitors = Visit.objects.filter(
-            timestamp__gte=thirty_days_ago
-        ).values('session_id').distinct().count()
-        
-        # Count unique buyers in last 30 days
-        buyers_30d = Ticket.objects.filter(
-            purchased_at__gte=thirty_days_ago
-        ).values('buyer_email').distinct().count()
-        
-        conversion_rate = (buyers_30d / unique_visitors * 100) if unique_visitors > 0 else 0
-    except Exception:
-        total_visits = 0
-        unique_visitors = 0
-        conversion_rate = 0
-    
-    # ═══════════════════════════════════════════════════════════════
-    # NEW METRIC 3: ACTIVE USERS (30 DAYS)
-    # ═══════════════════════════════════════════════════════════════
-    # Users who logged in or made a purchase in last 30 days
-    active_users_30d = User.objects.filter(
-        Q(last_login__gte=thirty_days_ago) |
-        Q(purchased_tickets__purchased_at__gte=thirty_days_ago)
-    ).distinct().count()
-    
-    active_users_percent = (active_users_30d / total_users * 100) if total_users > 0 else 0
-    
-    # ═══════════════════════════════════════════════════════════════
-    # NEW METRIC 4: REVENUE GROWTH (Month over Month)
-    # ═══════════════════════════════════════════════════════════════
-    current_month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    last_month_start = (current_month_start - timedelta(days=1)).replace(day=1)
-    
-    current_month_revenue = Ticket.objects.filter(
-        purchased_at__gte=current_month_start
-    ).aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-    
-    last_month_revenue = Ticket.objects.filter(
-        purchased_at__gte=last_month_start,
-        purchased_at__lt=current_month_start
-    ).aggregate(total=Sum('total_amount'))['total'] or Decimal('0.00')
-    
-    if last_month_revenue > 0:
-        revenue_growth = ((current_month_revenue - last_month_revenue) / last_month_revenue * 100)
-        revenue_growth = float(revenue_growth)
-    else:
-        revenue_growth = 0 if current_month_revenue == 0 else 100
-    
-    # ═══════════════════════════════════════════════════════════════
-    # NEW METRIC 5: REPEAT BUYERS
-    # ═══════════════════════════════════════════════════════════════
-    # Users who bought more than once
-    repeat_buyers = Ticket.objects.values('buyer_email').annotate(
-        purchase_count=Count('id')
-    ).filter(purchase_count__gt=1).count()
-    
-    total_buyers = Ticket.objects.values('buyer_email').distinct().count()
-    repeat_buyer_rate = (repeat_buyers / total_buyers * 100) if total_buyers > 0 else 0
-    
-    # ═══════════════════════════════════════════════════════════════
-    # CHARTS DATA
-    # ═══════════════════════════════════════════════════════════════
+    snapshot = platform_metrics.get_snapshot()
+    series = snapshot.data['series']
+    age_seconds = int((timezone.now() - snapshot.computed_at).total_seconds())
     
     # Recent activity
     recent_tickets = Ticket.objects.select_related(
         'event', 'ticket_category', 'buyer'
     ).order_by('-purchased_at')[:10]
-    
     recent_users = User.objects.order_by('-date_joined')[:10]
     
-    # User signup trend WITH BUYER/SELLER DISTINCTION
-    user_signup_trend = list(User.objects.filter(
-        date_joined__gte=thirty_days_ago
-    ).extra({
-        'signup_date': "date(date_joined)"
-    }).values('signup_date').annotate(
-        count=Count('id'),
-        buyers=Count('id', filter=Q(is_buyer=True)),
-        sellers=Count('id', filter=Q(is_seller=True))
-    ).order_by('signup_date'))
-    
-    # Daily sales
-    daily_sales = list(Ticket.objects.filter(
-        purchased_at__gte=thirty_days_ago
-    ).values('purchased_at__date').annotate(
-        total_sales=Sum('total_amount'),
-        count=Count('id')
-    ).order_by('purchased_at__date'))
-    
-    for sale in daily_sales:
-        if sale['purchased_at__date']:
-            sale['purchased_at__date'] = sale['purchased_at__date'].isoformat()
-    
-    # Tier breakdown
-    tier_breakdown = list(TicketCategory.objects.values('name').annotate(
-        sold=Count('tickets', filter=Q(tickets__status='confirmed')),
-    ).filter(sold__gt=0).order_by('-sold'))
-    
-    # ═══════════════════════════════════════════════════════════════
-    # CONTEXT
-    # ═══════════════════════════════════════════════════════════════
-    
     context = {
-        # Existing metrics
-        'total_users': total_users,
-        'new_users_week': new_users_week,
-        'active_users_count': active_users,
-        'total_tickets': total_tickets,
-        'tickets_today': tickets_today,
-        'total_revenue': total_revenue,
-        'total_events': total_events,
-        'upcoming_events': upcoming_events,
-        'mpesa_success_rate': mpesa_success_rate,
-        'mpesa_total_attempts': mpesa_total_attempts,
-        'avg_ticket_price': avg_ticket_price,
-        'tickets_this_week': tickets_this_week,
+        # KPIs (snapshot)
+        **snapshot.data['kpis'],
         
-        # NEW METRICS
-        'active_sellers': active_sellers,
-        'conversion_rate': round(conversion_rate, 1),
-        'total_visits': total_visits,
-        'unique_visitors': unique_visitors,
-        'active_users_30d': active_users_30d,
-        'active_users_percent': round(active_users_percent, 1),
-        'revenue_growth': round(revenue_growth, 1),
-        'repeat_buyers': repeat_buyers,
-        'repeat_buyer_rate': round(repeat_buyer_rate, 1),
+        # M-Pesa (this worker process)
+        **platform_metrics.mpesa_worker_stats(),
         
         # Charts
         'recent_tickets': recent_tickets,
         'recent_users': recent_users,
-        'user_signup_trend': json.dumps(user_signup_trend, cls=DjangoJSONEncoder),
-        'daily_sales': json.dumps(daily_sales, cls=DjangoJSONEncoder),
-        'tier_breakdown_json': json.dumps(tier_breakdown, cls=DjangoJSONEncoder),
+        'user_signup_trend': json.dumps(series['user_signup_trend'], cls=DjangoJSONEncoder),
+        'daily_sales': json.dumps(series['daily_sales'], cls=DjangoJSONEncoder),
+        'tier_breakdown_json': json.dumps(series['tier_breakdown'], cls=DjangoJSONEncoder),
+        
+        # Snapshot freshness
+        'snapshot_computed_at': snapshot.computed_at,
+        'snapshot_age_seconds': age_seconds,
+        'snapshot_is_stale': age_seconds > platform_metrics.STALE_SECONDS,
+        'snapshot_duration_ms': snapshot.duration_ms,
+        'live_refresh_seconds': platform_metrics.LIVE_REFRESH_SECONDS,
     }
     
     return render(request, 'admin/dashboard.html', context)
 
 
+@staff_member_required
+@require_POST
+def admin_dashboard_refresh(request):
+    """Recompute the metrics snapshot now instead of waiting for the schedule."""
+    snapshot = platform_metrics.refresh_snapshot()
+    if snapshot is None:
+        messages.warning(request, 'A refresh is already running, so the metrics were not refreshed. Reload in a moment.')
+    else:
+        messages.success(request, f'Metrics refreshed in {snapshot.duration_ms}ms.')
+    return redirect('admin_dashboard')
+
+
+@staff_member_required
+@require_GET
+def admin_dashboard_live(request):
+    """The dashboard's cheap counters, polled by the page between snapshots."""
+    return JsonResponse(platform_metrics.live_counters(), encoder=DjangoJSONEncoder)
+
+
 # ============================================================================
 # USER PROFILE MANAGEMENT
 # ============================================================================
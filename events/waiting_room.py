@@ -0,0 +1,257 @@
+"""
+ZOZAPRIME Waiting Room
+======================
+Location: events/waiting_room.py
+
+Virtual queue in front of checkout for high-demand event drops.
+
+FLOW:
+  1. Fan hits checkout → not admitted → redirected to the waiting room page
+  2. Waiting room page → join() hands out the next FIFO position as a
+     signed queue token (stored in the session)
+  3. Page polls /waiting-room/<event_id>/status/ → queue_status()
+     - reads only the session and the cached room config
+     - never touches the Event / TicketCategory tables
+  4. Once the fan's position is inside the admitted window, a signed
+     admission pass (valid `admission_minutes`) is stored in the session.
+     The pass names the position it was granted for; once it expires that
+     position is spent, and the fan rejoins at the back of the queue
+  5. checkout and initiate_mpesa_payment check the pass via
+     @waiting_room_required
+
+Admission is a pure function of the clock:
+    admitted_through = (now - opens_at) * admit_per_second
+so any number of web workers agree on who is in without a shared queue
+process or Redis. The only write per fan is the position counter bump.
+"""
+import logging
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.contrib import messages
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.http import JsonResponse
+from django.shortcuts import redirect
+from django.urls import reverse
+
+from .models import WaitingRoom
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SALT = 'events.waiting_room.queue'
+PASS_SALT = 'events.waiting_room.pass'
+CONFIG_CACHE_SECONDS = 30
+
+# Sentinel cached for events without a room, so the common case is one cache hit
+NO_ROOM = {'active': False}
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ROOM CONFIG
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def get_room_config(event_id):
+    """Cached snapshot of an event's room — never joins to Event."""
+    key = f"waiting_room:{event_id}"
+    config = cache.get(key)
+    if config is None:
+        room = WaitingRoom.objects.filter(event_id=event_id).first()
+        if room and room.is_active:
+            config = {
+                'active': True,
+                'room_id': room.pk,
+                'opens_at': room.opens_at.timestamp(),
+                'rate': room.admit_per_second,
+                'admission_seconds': room.admission_minutes * 60,
+            }
+        else:
+            config = NO_ROOM
+        cache.set(key, config, CONFIG_CACHE_SECONDS)
+    return config
+
+
+def admitted_through(config, now=None):
+    """Highest queue position that has been let through so far."""
+    now = now if now is not None else time.time()
+    elapsed = now - config['opens_at']
+    if elapsed < 0:
+        return 0
+    return int(elapsed * config['rate'])
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# QUEUE
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _session_key(request):
+    if not request.session.session_key:
+        request.session.save()
+    return request.session.session_key
+
+
+def join(request, event_id):
+    """
+    Put the fan in the queue (idempotent per session).
+    Returns the queue position, or None if the event has no room any more.
+    """
+    tokens = request.session.get('waiting_room_tokens', {})
+    existing = tokens.get(str(event_id))
+    if existing:
+        data = _load_queue_token(existing)
+        if data and data['e'] == event_id and not _spent(request, event_id, data['p']):
+            return data['p']
+
+    # The UPDATE holds the row lock until commit, so the read-back inside
+    # the same transaction is this fan's position and nobody else's.
+    with db_transaction.atomic():
+        WaitingRoom.objects.filter(event_id=event_id).update(
+            next_position=F('next_position') + 1
+        )
+        position = WaitingRoom.objects.filter(event_id=event_id).values_list(
+            'next_position', flat=True
+        ).first()
+
+    if position is None:
+        # Room deleted while its config was still cached
+        cache.delete(f"waiting_room:{event_id}")
+        return None
+
+    tokens[str(event_id)] = signing.dumps(
+        {'e': event_id, 'p': position, 's': _session_key(request)},
+        salt=QUEUE_SALT,
+    )
+    request.session['waiting_room_tokens'] = tokens
+    logger.info(f"[QUEUE] Event {event_id}: joined at position {position}")
+    return position
+
+
+def _load_queue_token(token):
+    try:
+        return signing.loads(token, salt=QUEUE_SALT)
+    except signing.BadSignature:
+        return None
+
+
+def queue_status(request, event_id):
+    """
+    Where the fan stands in the queue. Grants the admission pass once their
+    position comes up. Touches only the session and the cache.
+    """
+    config = get_room_config(event_id)
+    if not config['active']:
+        return {'admitted': True, 'position': 0, 'ahead': 0, 'eta_seconds': 0}
+
+    if has_admission(request, event_id, config):
+        return {'admitted': True, 'position': 0, 'ahead': 0, 'eta_seconds': 0}
+
+    token = request.session.get('waiting_room_tokens', {}).get(str(event_id))
+    data = _load_queue_token(token) if token else None
+    if not data or data['e'] != event_id or data['s'] != request.session.session_key:
+        return {'admitted': False, 'joined': False}
+
+    position = data['p']
+    if _spent(request, event_id, position):
+        # Admitted once and the pass ran out — back of the queue
+        request.session.get('waiting_room_tokens', {}).pop(str(event_id), None)
+        request.session.get('waiting_room_passes', {}).pop(str(event_id), None)
+        request.session.modified = True
+        return {'admitted': False, 'joined': False, 'expired': True}
+
+    now = time.time()
+    through = admitted_through(config, now)
+
+    if position <= through:
+        _grant_pass(request, event_id, position, config, now)
+        return {'admitted': True, 'position': position, 'ahead': 0, 'eta_seconds': 0}
+
+    ahead = position - through
+    opens_in = max(0, config['opens_at'] - now)
+    return {
+        'admitted': False,
+        'joined': True,
+        'position': position,
+        'ahead': ahead,
+        'eta_seconds': int(opens_in + ahead / max(config['rate'], 1)),
+    }
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# ADMISSION
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def _grant_pass(request, event_id, position, config, now):
+    passes = request.session.get('waiting_room_passes', {})
+    passes[str(event_id)] = signing.dumps(
+        {
+            'e': event_id,
+            's': request.session.session_key,
+            'p': position,
+            'x': now + config['admission_seconds'],
+        },
+        salt=PASS_SALT,
+    )
+    request.session['waiting_room_passes'] = passes
+
+
+def _load_pass(request, event_id):
+    """This session's pass for the event, expired or not."""
+    token = request.session.get('waiting_room_passes', {}).get(str(event_id))
+    if not token:
+        return None
+    try:
+        data = signing.loads(token, salt=PASS_SALT)
+    except signing.BadSignature:
+        return None
+    if data['e'] != event_id or data['s'] != request.session.session_key:
+        return None
+    return data
+
+
+def _spent(request, event_id, position):
+    """True if `position` was already admitted and its pass has run out."""
+    data = _load_pass(request, event_id)
+    return bool(data) and data.get('p') == position and data['x'] <= time.time()
+
+
+def has_admission(request, event_id, config=None):
+    """True if checkout is open to this session for the event."""
+    config = config or get_room_config(event_id)
+    if not config['active']:
+        return True
+
+    data = _load_pass(request, event_id)
+    return bool(data) and data['x'] > time.time()
+
+
+def waiting_room_required(json_response=False):
+    """
+    Gate a view that takes a `slug` kwarg behind the event's waiting room.
+    Non-admitted fans are sent to the queue (HTML) or get a 403 (JSON).
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, slug, *args, **kwargs):
+            from .models import Event
+
+            event_id = Event.objects.filter(slug=slug).values_list('id', flat=True).first()
+            if event_id is None or has_admission(request, event_id):
+                return view_func(request, slug, *args, **kwargs)
+
+            queue_url = reverse('waiting_room', kwargs={'slug': slug})
+            if json_response:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'This event is busy — please wait for your turn in the queue.',
+                    'waiting_room_url': queue_url,
+                }, status=403)
+
+            if request.GET.get('tickets'):
+                queue_url += '?' + urlencode({'next': request.get_full_path()})
+            messages.info(request, "High demand! You're in the queue for tickets.")
+            return redirect(queue_url)
+        return wrapper
+    return decorator
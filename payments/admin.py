@@ -1,5 +1,6 @@
 from django.contrib import admin
-from payments.models import Transaction
+from payments.callback_inbox import replay_callbacks
+from payments.models import Transaction, TicketReservation, CallbackInbox
 
 @admin.register(Transaction)
 class TransactionAdmin(admin.ModelAdmin):
@@ -8,4 +9,28 @@ class TransactionAdmin(admin.ModelAdmin):
     search_fields = ('phone_number', 'buyer_name', 'buyer_email')
     list_filter = ('status', 'event')
 
+
+@admin.register(TicketReservation)
+class TicketReservationAdmin(admin.ModelAdmin):
+    ordering = ("-created_at",)
+    list_display = ('transaction', 'ticket_category', 'quantity', 'status', 'created_at', 'expires_at', 'released_at')
+    search_fields = ('transaction__transaction_id',)
+    list_filter = ('status',)
+    raw_id_fields = ('transaction', 'ticket_category')
+
+
+@admin.register(CallbackInbox)
+class CallbackInboxAdmin(admin.ModelAdmin):
+    ordering = ("-received_at",)
+    list_display = ('id', 'checkout_request_id', 'status', 'attempts', 'received_at', 'processed_at')
+    search_fields = ('checkout_request_id',)
+    list_filter = ('status',)
+    readonly_fields = ('received_at', 'claimed_at', 'processed_at', 'next_attempt_at')
+    actions = ('replay',)
+
+    @admin.action(description='Replay selected callbacks')
+    def replay(self, request, queryset):
+        count = replay_callbacks(queryset)
+        self.message_user(request, f'Re-queued {count} callback(s) for the inbox worker.')
+
 # Register your models here.
@@ -0,0 +1,169 @@
+"""
+ZOZAPRIME Callback Inbox
+========================
+Location: payments/callback_inbox.py
+
+Durable inbox between Safaricom and ticket fulfilment.
+
+FLOW:
+  1. mpesa_callback → store_callback()   one INSERT, 200 back to Safaricom
+  2. process_callback_inbox worker → drain_inbox()
+     - claims rows with a conditional UPDATE (pending → processing), so
+       several workers can drain the same inbox without double work
+     - runs MpesaService.process_callback() — ticket, rendering, email
+  3. replay_callbacks() puts stored rows back to pending for recovery or
+     load testing
+
+Idempotent per CheckoutRequestID: Safaricom re-sends callbacks it thinks
+we missed, so a second row for an already-processed checkout is marked
+'duplicate' instead of being run again. Replaying a row re-runs that same
+row; process_callback itself refuses to fulfil a transaction twice, but
+issues the ticket for a successful payment that does not have one yet.
+
+Fulfilment errors propagate out of process_callback here, so a crashed
+row goes back to pending and is retried up to MAX_ATTEMPTS times. Each
+retry waits longer (RETRY_BACKOFF_SECONDS, doubling per attempt, capped at
+RETRY_BACKOFF_MAX_SECONDS) so a looping worker cannot burn every attempt
+during one short outage.
+"""
+import json
+import logging
+from datetime import timedelta
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import CallbackInbox
+
+logger = logging.getLogger(__name__)
+
+# A row stuck in 'processing' this long belongs to a worker that died
+STALE_CLAIM_MINUTES = 5
+# Give up on a row after this many crashed attempts
+MAX_ATTEMPTS = 5
+# Wait before retrying a crashed row: 30s, 60s, 120s, ... up to 15 minutes
+RETRY_BACKOFF_SECONDS = 30
+RETRY_BACKOFF_MAX_SECONDS = 15 * 60
+
+
+def store_callback(raw_body):
+    """Persist a raw callback body. Returns the CallbackInbox row."""
+    checkout_request_id = ''
+    try:
+        data = json.loads(raw_body)
+        checkout_request_id = (
+            data.get('Body', {}).get('stkCallback', {}).get('CheckoutRequestID') or ''
+        )
+    except (ValueError, AttributeError):
+        # Kept anyway — the body is evidence; the worker marks it failed
+        pass
+
+    return CallbackInbox.objects.create(
+        checkout_request_id=checkout_request_id,
+        raw_body=raw_body,
+    )
+
+
+def drain_inbox(batch_size=100, mpesa=None):
+    """
+    Process up to `batch_size` pending callbacks that are due, oldest first.
+    Returns a dict of counts by outcome.
+    """
+    from .services import MpesaService
+
+    _reclaim_stale()
+    mpesa = mpesa or MpesaService()
+    counts = {'processed': 0, 'duplicate': 0, 'failed': 0, 'retry': 0}
+
+    due = Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=timezone.now())
+    pending_ids = list(
+        CallbackInbox.objects.filter(due, status='pending')
+        .order_by('received_at')
+        .values_list('id', flat=True)[:batch_size]
+    )
+
+    for entry_id in pending_ids:
+        claimed = CallbackInbox.objects.filter(due, id=entry_id, status='pending').update(
+            status='processing',
+            claimed_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if not claimed:
+            continue  # another worker got it
+
+        entry = CallbackInbox.objects.get(id=entry_id)
+        outcome = process_entry(entry, mpesa)
+        counts[outcome] += 1
+
+    return counts
+
+
+def process_entry(entry, mpesa):
+    """Run one claimed inbox row. Returns the outcome name."""
+    try:
+        callback_data = json.loads(entry.raw_body)
+    except ValueError as e:
+        _finish(entry, 'failed', f"Invalid JSON: {e}")
+        return 'failed'
+
+    if entry.checkout_request_id and CallbackInbox.objects.filter(
+        checkout_request_id=entry.checkout_request_id,
+        status='processed',
+    ).exclude(id=entry.id).exists():
+        _finish(entry, 'duplicate')
+        logger.info(f"[INBOX] Duplicate callback for {entry.checkout_request_id}")
+        return 'duplicate'
+
+    try:
+        mpesa.process_callback(callback_data, raise_errors=True)
+    except Exception as e:
+        logger.error(f"[INBOX] Entry {entry.id} crashed: {e}", exc_info=True)
+        if entry.attempts >= MAX_ATTEMPTS:
+            _finish(entry, 'failed', str(e))
+            return 'failed'
+        CallbackInbox.objects.filter(id=entry.id).update(
+            status='pending',
+            last_error=str(e),
+            next_attempt_at=timezone.now() + retry_delay(entry.attempts),
+        )
+        return 'retry'
+
+    _finish(entry, 'processed')
+    return 'processed'
+
+
+def replay_callbacks(queryset):
+    """Put stored callbacks back in the queue. Returns how many were re-queued."""
+    count = queryset.exclude(status='processing').update(
+        status='pending',
+        claimed_at=None,
+        processed_at=None,
+        next_attempt_at=None,
+        last_error='',
+    )
+    logger.info(f"[INBOX] Re-queued {count} callback(s)")
+    return count
+
+
+def retry_delay(attempts):
+    """How long a row that has crashed `attempts` times waits before the next claim."""
+    seconds = RETRY_BACKOFF_SECONDS * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(seconds, RETRY_BACKOFF_MAX_SECONDS))
+
+
+def _finish(entry, status, error=''):
+    CallbackInbox.objects.filter(id=entry.id).update(
+        status=status,
+        last_error=error,
+        processed_at=timezone.now(),
+    )
+
+
+def _reclaim_stale():
+    cutoff = timezone.now() - timedelta(minutes=STALE_CLAIM_MINUTES)
+    reclaimed = CallbackInbox.objects.filter(
+        status='processing',
+        claimed_at__lt=cutoff,
+    ).update(status='pending')
+    if reclaimed:
+        logger.warning(f"[INBOX] Reclaimed {reclaimed} stale callback(s)")
@@ -0,0 +1,157 @@
+"""
+ZOZAPRIME Daraja Circuit Breaker
+================================
+Location: payments/circuit_breaker.py
+
+One breaker per Daraja endpoint per process, driven by DarajaClient.
+
+STATES:
+  closed     normal; every call is recorded in a rolling window
+  open       error rate (or share of slow calls) crossed the threshold —
+             calls fail fast with CircuitOpenError for COOLDOWN seconds
+             instead of tying up a web worker for the full timeout
+  half_open  cooldown over; ONE probe call is let through at a time.
+             Success closes the breaker, failure re-opens it.
+
+ADAPTIVE TIMEOUT:
+  read_timeout() = p99 of recent successful calls x TIMEOUT_MULTIPLIER,
+  clamped to [MPESA_MIN_READ_TIMEOUT, MPESA_READ_TIMEOUT]. With too few
+  samples it falls back to MPESA_READ_TIMEOUT. DarajaClient applies it to
+  idempotent calls only — a timed-out STK push may still have been
+  delivered, so it is never cut short.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+import requests
+from django.conf import settings
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+WINDOW_SECONDS = getattr(settings, 'MPESA_BREAKER_WINDOW', 60)
+MIN_CALLS = getattr(settings, 'MPESA_BREAKER_MIN_CALLS', 10)
+ERROR_RATE_THRESHOLD = getattr(settings, 'MPESA_BREAKER_ERROR_RATE', 0.5)
+COOLDOWN_SECONDS = getattr(settings, 'MPESA_BREAKER_COOLDOWN', 30)
+SLOW_CALL_SECONDS = getattr(settings, 'MPESA_SLOW_CALL_SECONDS', 10)
+MIN_READ_TIMEOUT = getattr(settings, 'MPESA_MIN_READ_TIMEOUT', 5)
+TIMEOUT_MULTIPLIER = 3
+MIN_TIMEOUT_SAMPLES = 20
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of calling Daraja while an endpoint's breaker is open."""
+
+    def __init__(self, endpoint, retry_in):
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+        super().__init__(f"Circuit open for {endpoint}, retry in {retry_in}s")
+
+
+class CircuitBreaker:
+    """Rolling-window error/latency breaker for one Daraja endpoint."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.state = CLOSED
+        self._calls = deque()  # (finished_at, ok, latency_seconds)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._trips = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    # ── Gate ──────────────────────────────────────────────────────────────
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go out now."""
+        with self._lock:
+            now = time.time()
+            if self.state == OPEN:
+                retry_in = COOLDOWN_SECONDS - (now - self._opened_at)
+                if retry_in > 0:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.endpoint, int(retry_in) + 1)
+                self.state = HALF_OPEN
+
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.endpoint, 1)
+                self._probe_in_flight = True
+
+    def is_open(self):
+        """True while calls would be refused (peek — does not claim the probe)."""
+        with self._lock:
+            if self.state == OPEN:
+                return time.time() - self._opened_at < COOLDOWN_SECONDS
+            return self.state == HALF_OPEN and self._probe_in_flight
+
+    # ── Outcomes ──────────────────────────────────────────────────────────
+
+    def record(self, ok, latency):
+        """Record a finished call. Slow calls count as failures."""
+        ok = ok and latency < SLOW_CALL_SECONDS
+        with self._lock:
+            now = time.time()
+            self._calls.append((now, ok, latency))
+            self._trim(now)
+
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                if ok:
+                    self.state = CLOSED
+                    self._calls.clear()
+                    logger.info(f"[DARAJA] Circuit closed for {self.endpoint}")
+                else:
+                    self._open(now)
+                return
+
+            if self.state == CLOSED and not ok:
+                total = len(self._calls)
+                failures = sum(1 for _, success, _ in self._calls if not success)
+                if total >= MIN_CALLS and failures / total >= ERROR_RATE_THRESHOLD:
+                    self._open(now)
+
+    def read_timeout(self, ceiling):
+        """Read timeout derived from recent latency, never above `ceiling`."""
+        with self._lock:
+            latencies = sorted(latency for _, ok, latency in self._calls if ok)
+        if len(latencies) < MIN_TIMEOUT_SAMPLES:
+            return ceiling
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return max(MIN_READ_TIMEOUT, min(ceiling, p99 * TIMEOUT_MULTIPLIER))
+
+    def snapshot(self, ceiling):
+        with self._lock:
+            self._trim(time.time())
+            total = len(self._calls)
+            failures = sum(1 for _, ok, _ in self._calls if not ok)
+            state = self.state
+            trips, rejected = self._trips, self._rejected
+        return {
+            'state': state,
+            'calls': total,
+            'error_rate': round(failures / total * 100, 1) if total else 0.0,
+            'trips': trips,
+            'rejected': rejected,
+            'read_timeout': round(self.read_timeout(ceiling), 1),
+        }
+
+    # ── Internals ─────────────────────────────────────────────────────────
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self._trips += 1
+        logger.warning(f"[DARAJA] Circuit OPEN for {self.endpoint} — failing fast for {COOLDOWN_SECONDS}s")
+
+    def _trim(self, now):
+        cutoff = now - WINDOW_SECONDS
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
@@ -0,0 +1,215 @@
+"""
+ZOZAPRIME Daraja HTTP Client
+============================
+Location: payments/daraja.py
+
+One pooled, keep-alive HTTP client per Daraja base URL per process.
+
+  - Shared connection pool: STK pushes and queries reuse warm TCP/TLS
+    connections to api.safaricom.co.ke instead of a fresh handshake each
+  - Separate connect / read timeouts (MPESA_CONNECT_TIMEOUT,
+    MPESA_READ_TIMEOUT) instead of a flat timeout=30
+  - Bounded retries with capped full-jitter backoff, ONLY for idempotent calls
+    (token fetch, status query). STK pushes are never retried — a retry
+    would send the fan a second PIN prompt.
+  - Per-endpoint latency histograms, exposed through stats()
+  - Per-endpoint circuit breaker (payments/circuit_breaker.py): fails fast
+    with CircuitOpenError while Safaricom is degraded, and shortens the
+    read timeout of idempotent calls to what the endpoint has actually
+    been taking (STK pushes always wait the full MPESA_READ_TIMEOUT)
+
+USED BY:
+  payments/services.py → MpesaService (token, STK push, STK query)
+"""
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in milliseconds
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# Status codes worth retrying on an idempotent call
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram — cheap to update, good enough for p50/p95/p99."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms, error=False):
+        self.buckets[bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if error:
+            self.errors += 1
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile."""
+        if not self.count:
+            return 0
+        target = self.count * pct / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else int(self.max_ms)
+        return int(self.max_ms)
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avg_ms': round(self.total_ms / self.count, 1) if self.count else 0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': round(self.max_ms, 1),
+            'buckets': dict(zip([*map(str, LATENCY_BUCKETS_MS), 'inf'], self.buckets)),
+        }
+
+
+class DarajaClient:
+    """Pooled keep-alive client for the Safaricom Daraja API."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = getattr(settings, 'MPESA_CONNECT_TIMEOUT', 5)
+        self.read_timeout = getattr(settings, 'MPESA_READ_TIMEOUT', 30)
+        self.max_retries = getattr(settings, 'MPESA_MAX_RETRIES', 2)
+        self.backoff_base = getattr(settings, 'MPESA_RETRY_BACKOFF', 0.25)
+        self.backoff_max = getattr(settings, 'MPESA_RETRY_BACKOFF_MAX', 2.0)
+
+        pool_size = getattr(settings, 'MPESA_POOL_SIZE', 20)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._histograms = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    # ── Public API ────────────────────────────────────────────────────────
+
+    def get(self, path, endpoint, idempotent=True, **kwargs):
+        return self.request('GET', path, endpoint, idempotent=idempotent, **kwargs)
+
+    def post(self, path, endpoint, idempotent=False, **kwargs):
+        return self.request('POST', path, endpoint, idempotent=idempotent, **kwargs)
+
+    def request(self, method, path, endpoint, idempotent=False, **kwargs):
+        """
+        Send a request, retrying idempotent calls on connection errors,
+        timeouts and 429/5xx. Raises requests exceptions like requests does,
+        or CircuitOpenError without sending anything while the breaker is open.
+        """
+        breaker = self.breaker(endpoint)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        url = f'{self.base_url}{path}'
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            breaker.before_call()
+            # Only repeatable calls get the adaptive read timeout: an STK push
+            # cut off early may still reach the fan's phone, and without its
+            # CheckoutRequestID the callback can never be matched
+            read_timeout = breaker.read_timeout(self.read_timeout) if idempotent else self.read_timeout
+            kwargs['timeout'] = (self.connect_timeout, read_timeout)
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._observe(endpoint, started, error=True)
+                if last_attempt:
+                    raise
+                logger.warning(f"[DARAJA] {endpoint} attempt {attempt + 1} failed: {e}")
+                self._sleep_before_retry(attempt)
+                continue
+            except Exception:
+                self._observe(endpoint, started, error=True)
+                raise
+
+            failed = response.status_code >= 500 or response.status_code == 429
+            self._observe(endpoint, started, error=failed)
+            if failed and not last_attempt and response.status_code in RETRYABLE_STATUS:
+                logger.warning(f"[DARAJA] {endpoint} attempt {attempt + 1} got {response.status_code}")
+                self._sleep_before_retry(attempt)
+                continue
+            return response
+
+    def breaker(self, endpoint):
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(endpoint)
+            return breaker
+
+    def is_available(self, endpoint):
+        """False while the endpoint's breaker is refusing calls."""
+        return not self.breaker(endpoint).is_open()
+
+    def stats(self):
+        with self._lock:
+            return {name: h.snapshot() for name, h in self._histograms.items()}
+
+    def breaker_stats(self):
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {b.endpoint: b.snapshot(self.read_timeout) for b in breakers}
+
+    # ── Internals ─────────────────────────────────────────────────────────
+
+    def _observe(self, endpoint, started, error=False):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.breaker(endpoint).record(not error, elapsed_ms / 1000)
+        with self._lock:
+            histogram = self._histograms.get(endpoint)
+            if histogram is None:
+                histogram = self._histograms[endpoint] = LatencyHistogram()
+            histogram.observe(elapsed_ms, error=error)
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: spreads retries out so a blip doesn't become a stampede.
+        # Capped, so a high MPESA_MAX_RETRIES cannot park a worker for long.
+        time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt))))
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_daraja_client(base_url):
+    """Process-wide client (and connection pool) for a Daraja base URL."""
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = DarajaClient(base_url)
+        return client
+
+
+def all_client_stats():
+    with _clients_lock:
+        return {base_url: client.stats() for base_url, client in _clients.items()}
+
+
+def all_breaker_stats():
+    with _clients_lock:
+        clients = dict(_clients)
+    return {base_url: client.breaker_stats() for base_url, client in clients.items()}
@@ -0,0 +1,122 @@
+"""
+ZOZAPRIME STK Dispatcher
+========================
+Location: payments/dispatcher.py
+
+Background sending of STK pushes, so initiate_mpesa_payment does not hold
+a web worker for the token + STK round trip to Safaricom.
+
+FLOW (MPESA_ASYNC_INITIATION = True):
+  1. initiate_stk_push(background=True) creates the Transaction as
+     'queued' with its hold, and returns the transaction_id at once
+  2. enqueue_stk_push() hands it to a bounded thread pool after commit
+  3. dispatch() claims it (queued → pending, conditional UPDATE) and calls
+     MpesaService.send_stk_push(), which writes checkout_request_id back —
+     or fails the transaction and releases its hold
+  4. The checkout page's status channel reports 'failed' with the reason
+
+dispatch_stale() (run by reconcile_stk_payments) picks up queued rows a
+restarted process never sent, and fails the ones too old to be worth a
+prompt — the fan has long since given up.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction as db_transaction
+from django.utils import timezone
+
+from .models import Transaction
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = getattr(settings, 'MPESA_DISPATCH_WORKERS', 8)
+# Queued this long without being sent → assume the process that queued it died
+STALE_AFTER_SECONDS = 15
+# Queued this long → too late to prompt the fan, fail it instead
+GIVE_UP_AFTER_SECONDS = 120
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='stk-dispatch')
+        return _executor
+
+
+def enqueue_stk_push(transaction_id, callback_url):
+    """Send the push in the background once the transaction is committed."""
+    db_transaction.on_commit(
+        lambda: _get_executor().submit(dispatch, transaction_id, callback_url)
+    )
+
+
+def dispatch(transaction_id, callback_url=None):
+    """Claim a queued transaction and send its STK push. Safe to call twice."""
+    from .services import MpesaService
+
+    try:
+        claimed = Transaction.objects.filter(
+            transaction_id=transaction_id,
+            status='queued',
+        ).update(status='pending')
+        if not claimed:
+            return None
+
+        txn = Transaction.objects.select_related('event', 'ticket_category').get(
+            transaction_id=transaction_id
+        )
+        result = MpesaService().send_stk_push(txn, callback_url or settings.MPESA_CALLBACK_URL)
+
+        # Failures are already on the transaction (description) and published
+        if not result.get('success'):
+            logger.warning(f"[DISPATCH] {transaction_id} failed: {result.get('error')}")
+        return result
+
+    except Exception as e:
+        logger.error(f"[DISPATCH] {transaction_id} crashed: {e}", exc_info=True)
+        return None
+    finally:
+        close_old_connections()
+        if threading.current_thread().name.startswith('stk-dispatch'):
+            connection.close()
+
+
+def dispatch_stale(now=None):
+    """Send queued pushes nobody sent; fail the ones that are too old. Returns (sent, failed)."""
+    from .reservations import release_hold
+    from .status_channel import publish as publish_status
+
+    now = now or timezone.now()
+    queued = Transaction.objects.filter(status='queued')
+
+    expired_ids = list(
+        queued.filter(timestamp__lt=now - timedelta(seconds=GIVE_UP_AFTER_SECONDS))
+        .values_list('transaction_id', flat=True)
+    )
+    failed = 0
+    for transaction_id in expired_ids:
+        updated = Transaction.objects.filter(transaction_id=transaction_id, status='queued').update(
+            status='failed',
+            description='The M-Pesa prompt could not be sent in time. Please try again.',
+        )
+        if updated:
+            release_hold(Transaction(transaction_id=transaction_id))
+            publish_status(transaction_id, 'failed')
+            failed += 1
+
+    stale_ids = list(
+        queued.filter(timestamp__lt=now - timedelta(seconds=STALE_AFTER_SECONDS))
+        .values_list('transaction_id', flat=True)
+    )
+    sent = sum(1 for transaction_id in stale_ids if dispatch(transaction_id))
+
+    if sent or failed:
+        logger.info(f"[DISPATCH] Stale queue: sent {sent}, failed {failed}")
+    return sent, failed
@@ -0,0 +1,363 @@
+"""
+Flash-sale load test for the whole purchase pipeline.
+
+    python manage.py loadtest_flash_sale --allow-writes --buyers 2000 --concurrency 64 --stock 500
+
+Seeds a throwaway event with `--stock` tickets, starts the Daraja simulator
+(payments/simulator.py) in-process, and sends `--buyers` simulated fans
+through the real views, concurrently:
+
+  checkout      GET  /checkout/<slug>/?tickets=<category>:<qty>
+  initiate      POST /payments/initiate-mpesa-payment/<slug>/
+  callback      POST /payments/mpesa-callback/      (simulator's outcome)
+  fulfilment    callback ack → status visible on check-payment-status
+                (the inbox worker runs in background threads)
+  confirmation  GET  /payments/ticket-confirmation/<transaction_id>/
+
+Reports throughput, p50/p95/p99 latency and DB queries per stage, and the
+oversell count (tickets issued beyond the seeded stock). Ticket emails are
+stubbed out unless --send-email is given. Use PostgreSQL for numbers that
+mean anything — SQLite serialises every writer.
+
+It writes real rows (event, transactions, tickets, inbox entries)
+into whatever DATABASES points at, so it refuses to run without
+--allow-writes. Point DATABASE_URL at a disposable database first.
+
+With MPESA_ASYNC_INITIATION on, the initiate response carries no
+CheckoutRequestID yet; each buyer waits for the dispatcher to record it on
+the transaction before delivering the callback.
+"""
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, close_old_connections
+from django.db.models import Sum
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from events.models import Event, TicketCategory, Ticket, User
+from payments.callback_inbox import drain_inbox
+from payments.models import Transaction, TicketReservation
+from payments.simulator import DarajaSimulator
+
+STAGES = ('checkout', 'initiate', 'callback', 'fulfilment', 'confirmation')
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class StageRecorder:
+    """Thread-safe latency, error and query-count collection per stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {stage: [] for stage in STAGES}
+        self.queries = {stage: 0 for stage in STAGES}
+        self.errors = {stage: 0 for stage in STAGES}
+
+    def run(self, stage, func):
+        """Time func() and count the queries it runs on this thread's connection."""
+        count = [0]
+
+        def counter(execute, sql, params, many, context):
+            count[0] += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(counter):
+                result = func()
+        except Exception:
+            with self._lock:
+                self.errors[stage] += 1
+            raise
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.latency[stage].append(elapsed)
+                self.queries[stage] += count[0]
+        return result
+
+
+class Command(BaseCommand):
+    help = 'Drive simulated buyers through checkout → STK push → callback → confirmation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--stock', type=int, default=200)
+        parser.add_argument('--quantity', type=int, default=1, help='Tickets per buyer')
+        parser.add_argument('--mix', default='0=80,1=5,1032=10,2001=5',
+                            help='Simulated result-code weights')
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help='Seconds the simulated Daraja API takes per call')
+        parser.add_argument('--inbox-workers', type=int, default=2)
+        parser.add_argument('--fulfilment-timeout', type=float, default=30.0)
+        parser.add_argument('--send-email', action='store_true')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded event afterwards')
+        parser.add_argument('--json', metavar='PATH', help='Also write the report as JSON')
+        parser.add_argument('--allow-writes', action='store_true',
+                            help='Confirm the configured database may be written to')
+
+    def handle(self, *args, **options):
+        if not options['allow_writes']:
+            raise CommandError(
+                f"This seeds an event and buys tickets in {connection.vendor} database "
+                f"'{connection.settings_dict['NAME']}'. Point DATABASE_URL at a disposable "
+                f"database and re-run with --allow-writes."
+            )
+
+        mix = {int(c): float(w) for c, w in (p.split('=') for p in options['mix'].split(','))}
+        event, category = self._seed(options['stock'])
+        recorder = StageRecorder()
+
+        simulator = DarajaSimulator(
+            result_mix=mix,
+            latency=(options['latency'], options['latency']),
+            callback_loss=1.0,  # the harness delivers callbacks itself, so it can time them
+        ).start()
+
+        fake_mpesa = override_settings(
+            MPESA_BASE_URL=simulator.url,
+            MPESA_CONSUMER_KEY='loadtest',
+            MPESA_CONSUMER_SECRET='loadtest',
+            MPESA_SHORTCODE='174379',
+            MPESA_PASSKEY='loadtest',
+        )
+        email_patch = mock.patch('events.ticket_service.send_ticket_email')
+
+        stop_workers = threading.Event()
+        workers = [
+            threading.Thread(target=self._inbox_worker, args=(stop_workers,), daemon=True)
+            for _ in range(options['inbox_workers'])
+        ]
+
+        self.stdout.write(
+            f"Backend: {connection.vendor} | buyers={options['buyers']} "
+            f"concurrency={options['concurrency']} stock={options['stock']}"
+        )
+
+        outcomes = {}
+        fake_mpesa.enable()
+        if not options['send_email']:
+            email_patch.start()
+        try:
+            for worker in workers:
+                worker.start()
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                results = pool.map(
+                    lambda n: self._buyer(n, event, category, simulator, recorder, options),
+                    range(options['buyers']),
+                )
+                for outcome in results:
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            elapsed = time.perf_counter() - started
+        finally:
+            stop_workers.set()
+            for worker in workers:
+                worker.join()
+            if not options['send_email']:
+                email_patch.stop()
+            fake_mpesa.disable()
+            simulator.stop()
+
+        report = self._report(event, category, recorder, outcomes, elapsed, options)
+        self._print(report)
+
+        if options['json']:
+            with open(options['json'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+
+        if not options['keep']:
+            event.delete()
+
+    # ── Setup ─────────────────────────────────────────────────────────────
+
+    def _seed(self, stock):
+        organizer, _ = User.objects.get_or_create(
+            username='loadtest_organizer', defaults={'is_seller': True}
+        )
+        event = Event.objects.create(
+            organizer=organizer,
+            title=f"Flash sale load test {uuid.uuid4().hex[:8]}",
+            description='Load test event',
+            date=timezone.now() + timedelta(days=30),
+            location='Load test',
+            is_active=False,
+        )
+        category = TicketCategory.objects.create(
+            event=event,
+            name='Early Bird',
+            price=1000,
+            available_tickets=stock,
+        )
+        return event, category
+
+    def _inbox_worker(self, stop):
+        try:
+            while not stop.is_set():
+                if not sum(drain_inbox(batch_size=50).values()):
+                    time.sleep(0.05)
+        finally:
+            connection.close()
+
+    # ── One buyer ─────────────────────────────────────────────────────────
+
+    def _buyer(self, n, event, category, simulator, recorder, options):
+        client = Client(HTTP_HOST='localhost')
+        quantity = options['quantity']
+        try:
+            response = recorder.run('checkout', lambda: client.get(
+                f'/checkout/{event.slug}/',
+                {'tickets': f'{category.id}:{quantity}'},
+                secure=True,
+            ))
+            if response.status_code != 200:
+                return 'sold_out_at_checkout'
+
+            data = recorder.run('initiate', lambda: client.post(
+                f'/payments/initiate-mpesa-payment/{event.slug}/',
+                {
+                    'buyer_name': f'Load Buyer {n}',
+                    'buyer_email': f'buyer{n}@loadtest.invalid',
+                    'buyer_phone': f'07{n % 100000000:08d}',
+                    'category_id': category.id,
+                    'quantity': quantity,
+                },
+                secure=True,
+            )).json()
+            if not data.get('success'):
+                return 'rejected_at_initiate'
+
+            push = self._await_push(simulator, data, options['fulfilment_timeout'])
+            if push is None:
+                return 'not_dispatched'
+            recorder.run('callback', lambda: client.post(
+                '/payments/mpesa-callback/',
+                json.dumps(simulator.callback_body(push)),
+                content_type='application/json',
+                secure=True,
+            ))
+
+            status = recorder.run('fulfilment', lambda: self._await_status(
+                client, data['transaction_id'], options['fulfilment_timeout']
+            ))
+            if status != 'success':
+                return f'payment_{status}'
+
+            response = recorder.run('confirmation', lambda: client.get(
+                f"/payments/ticket-confirmation/{data['transaction_id']}/",
+                secure=True,
+            ))
+            return 'purchased' if response.status_code == 200 else 'confirmation_failed'
+        except Exception:
+            return 'error'
+        finally:
+            close_old_connections()
+            connection.close()
+
+    def _await_push(self, simulator, data, timeout):
+        """The simulator's push for this purchase, once it has been sent."""
+        checkout_request_id = data.get('checkout_request_id')
+        deadline = time.monotonic() + timeout
+        # Async initiation: the dispatcher records the id after the response
+        while not checkout_request_id and time.monotonic() < deadline:
+            row = Transaction.objects.filter(transaction_id=data['transaction_id']).values(
+                'status', 'checkout_request_id'
+            ).first()
+            if not row or row['status'] in ('failed', 'cancelled'):
+                return None  # the dispatcher gave up on the push
+            checkout_request_id = row['checkout_request_id']
+            if not checkout_request_id:
+                time.sleep(0.05)
+        return simulator.pushes.get(checkout_request_id)
+
+    def _await_status(self, client, transaction_id, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = client.get(
+                f'/payments/check-payment-status/{transaction_id}/', secure=True
+            ).json().get('status')
+            if status in ('success', 'failed', 'cancelled'):
+                return status
+            time.sleep(0.05)
+        return 'timeout'
+
+    # ── Report ────────────────────────────────────────────────────────────
+
+    def _report(self, event, category, recorder, outcomes, elapsed, options):
+        issued = Ticket.objects.filter(ticket_category=category).aggregate(
+            total=Sum('quantity')
+        )['total'] or 0
+        held = TicketReservation.objects.filter(
+            ticket_category=category, status='held'
+        ).aggregate(total=Sum('quantity'))['total'] or 0
+        live = TicketCategory.objects.with_live_stock().get(pk=category.pk).live_available
+
+        stages = {}
+        for stage in STAGES:
+            values = recorder.latency[stage]
+            stages[stage] = {
+                'count': len(values),
+                'errors': recorder.errors[stage],
+                'p50_ms': round(_percentile(values, 50), 1),
+                'p95_ms': round(_percentile(values, 95), 1),
+                'p99_ms': round(_percentile(values, 99), 1),
+                'queries_per_call': round(recorder.queries[stage] / len(values), 1) if values else 0,
+            }
+
+        return {
+            'backend': connection.vendor,
+            'buyers': options['buyers'],
+            'concurrency': options['concurrency'],
+            'stock': options['stock'],
+            'elapsed_s': round(elapsed, 2),
+            'buyers_per_s': round(options['buyers'] / elapsed, 1) if elapsed else 0,
+            'purchases_per_s': round(outcomes.get('purchased', 0) / elapsed, 1) if elapsed else 0,
+            'outcomes': outcomes,
+            'stages': stages,
+            'tickets_issued': issued,
+            'still_held': held,
+            'left_in_stock': live,
+            'oversold': max(0, issued - options['stock']),
+            'unaccounted': options['stock'] - issued - held - live,
+            'transactions': Transaction.objects.filter(event=event).count(),
+        }
+
+    def _print(self, report):
+        self.stdout.write('')
+        self.stdout.write(
+            f"{report['buyers']} buyers in {report['elapsed_s']}s  →  "
+            f"{report['buyers_per_s']} buyers/s, {report['purchases_per_s']} purchases/s"
+        )
+        self.stdout.write(f"Outcomes: {report['outcomes']}")
+        self.stdout.write('')
+        self.stdout.write(f"{'stage':<14}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}")
+        for stage, row in report['stages'].items():
+            self.stdout.write(
+                f"{stage:<14}{row['count']:>7}{row['errors']:>8}{row['p50_ms']:>10}"
+                f"{row['p95_ms']:>10}{row['p99_ms']:>10}{row['queries_per_call']:>9}"
+            )
+        self.stdout.write('')
+        line = (
+            f"Stock {report['stock']}: issued {report['tickets_issued']}, "
+            f"held {report['still_held']}, left {report['left_in_stock']}, "
+            f"unaccounted {report['unaccounted']}"
+        )
+        if report['oversold']:
+            self.stdout.write(self.style.ERROR(f"OVERSOLD by {report['oversold']} — {line}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"No oversell — {line}"))
@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from payments.callback_inbox import drain_inbox, replay_callbacks
+from payments.models import CallbackInbox
+
+
+class Command(BaseCommand):
+    help = 'Fulfil M-Pesa callbacks stored in the callback inbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep draining until interrupted')
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait when the inbox is empty (with --loop)')
+        parser.add_argument('--replay', nargs='*', type=int, metavar='ID',
+                            help='Re-queue stored callbacks by id before draining')
+        parser.add_argument('--replay-failed', action='store_true',
+                            help='Re-queue every failed callback before draining')
+        parser.add_argument('--replay-since', metavar='DATETIME',
+                            help='Re-queue every callback received since an ISO datetime')
+
+    def handle(self, *args, **options):
+        self._replay(options)
+
+        batch_size = options['batch_size']
+        totals = {'processed': 0, 'duplicate': 0, 'failed': 0, 'retry': 0}
+
+        try:
+            while True:
+                counts = drain_inbox(batch_size=batch_size)
+                for key, value in counts.items():
+                    totals[key] += value
+
+                drained = sum(counts.values())
+                if drained:
+                    self.stdout.write(f'Batch: {counts}')
+                if drained < batch_size:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {totals['processed']}, duplicate {totals['duplicate']}, "
+            f"failed {totals['failed']}, retried {totals['retry']}"
+        ))
+
+    def _replay(self, options):
+        if options['replay']:
+            count = replay_callbacks(CallbackInbox.objects.filter(id__in=options['replay']))
+            self.stdout.write(f'Re-queued {count} callback(s) by id')
+
+        if options['replay_failed']:
+            count = replay_callbacks(CallbackInbox.objects.filter(status='failed'))
+            self.stdout.write(f'Re-queued {count} failed callback(s)')
+
+        if options['replay_since']:
+            since = parse_datetime(options['replay_since'])
+            if since is None:
+                self.stderr.write(f"Could not parse --replay-since {options['replay_since']!r}")
+                return
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            count = replay_callbacks(CallbackInbox.objects.filter(received_at__gte=since))
+            self.stdout.write(f'Re-queued {count} callback(s) since {since}')
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from payments.dispatcher import dispatch_stale
+from payments.reconciliation import reconcile_pending, QUERY_RATE
+from payments.reservations import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Query Safaricom for pending STK pushes whose callback has not arrived; release lapsed holds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--rate', type=float, default=QUERY_RATE,
+                            help='Maximum Safaricom status queries per second')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep reconciling until interrupted')
+        parser.add_argument('--sleep', type=float, default=2.0,
+                            help='Seconds to wait when nothing is due (with --loop)')
+
+    def handle(self, *args, **options):
+        totals = {'success': 0, 'cancelled': 0, 'failed': 0, 'pending': 0}
+
+        try:
+            while True:
+                # Queued STK pushes a restarted web process never sent
+                dispatch_stale()
+                # Stock pinned by prompts the fan never answered
+                release_expired_holds()
+
+                counts = reconcile_pending(
+                    batch_size=options['batch_size'],
+                    rate=options['rate'],
+                )
+                for key, value in counts.items():
+                    totals[key] += value
+
+                checked = sum(counts.values())
+                if checked:
+                    self.stdout.write(f'Batch: {counts}')
+                if checked < options['batch_size']:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Success {totals['success']}, cancelled {totals['cancelled']}, "
+            f"failed {totals['failed']}, still pending {totals['pending']}"
+        ))
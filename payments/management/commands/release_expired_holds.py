@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from payments.reservations import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Return stock held by STK push reservations that have passed their TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        while True:
+            released = release_expired_holds(batch_size=batch_size)
+            total += released
+            if released < batch_size:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Released {total} expired hold(s)'))
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.simulator import DarajaSimulator, DEFAULT_RESULT_MIX
+
+
+def _range(value):
+    low, _, high = value.partition('-')
+    return float(low), float(high or low)
+
+
+def _mix(value):
+    mix = {}
+    for part in value.split(','):
+        code, _, weight = part.partition('=')
+        mix[int(code)] = float(weight)
+    return mix
+
+
+class Command(BaseCommand):
+    help = 'Run a local Daraja (M-Pesa) stand-in for offline end-to-end load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--mix', default=','.join(f'{k}={v}' for k, v in DEFAULT_RESULT_MIX.items()),
+                            help='Result-code weights, e.g. 0=70,1=5,1032=20,2001=5')
+        parser.add_argument('--callback-delay', default='2-8',
+                            help='Seconds before the callback fires, e.g. 2-8')
+        parser.add_argument('--latency', default='0.05-0.3',
+                            help='Seconds added to every API call, e.g. 0.05-0.3')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Share of API calls answered with 503 (0-1)')
+        parser.add_argument('--callback-loss', type=float, default=0.0,
+                            help='Share of pushes that never call back (0-1)')
+        parser.add_argument('--callback-url',
+                            help="Send callbacks here instead of the push's CallBackURL "
+                                 "(e.g. http://127.0.0.1:8000/payments/mpesa-callback/)")
+        parser.add_argument('--push-ttl', type=float, default=300.0,
+                            help='Seconds a resolved push can still be queried before it is forgotten')
+
+    def handle(self, *args, **options):
+        try:
+            simulator = DarajaSimulator(
+                host=options['host'],
+                port=options['port'],
+                result_mix=_mix(options['mix']),
+                callback_delay=_range(options['callback_delay']),
+                latency=_range(options['latency']),
+                error_rate=options['error_rate'],
+                callback_loss=options['callback_loss'],
+                callback_url=options['callback_url'],
+                push_ttl=options['push_ttl'],
+            )
+        except ValueError as e:
+            raise CommandError(f'Bad option: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'Daraja simulator listening on {simulator.url}'))
+        self.stdout.write(f'  Point the app at it:  MPESA_BASE_URL={simulator.url}')
+        self.stdout.write(f'  Stats:                {simulator.url}/simulator/stats')
+        self.stdout.write(f'  Change behaviour:     POST {simulator.url}/simulator/config')
+
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.stop()
+            self.stdout.write(str(simulator.stats_snapshot()))
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0015_event_slug'),
+        ('payments', '0005_transaction_checkout_request_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('status', models.CharField(choices=[('held', 'Held'), ('confirmed', 'Confirmed'), ('released', 'Released'), ('expired', 'Expired')], default='held', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('released_at', models.DateTimeField(blank=True, null=True)),
+                ('ticket_category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='events.ticketcategory')),
+                ('transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reservation', to='payments.transaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='payments_ti_status_c43938_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 04:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_callbackinbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='status_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -6,6 +6,7 @@ import uuid
 
 class Transaction(models.Model):
     STATUS_CHOICES = (
+        ('queued', 'Queued'),  # STK push waiting for the background dispatcher
         ('pending', 'Pending'),
         ('success', 'Success'),
         ('failed', 'Failed'),
@@ -30,6 +31,8 @@ class Transaction(models.Model):
     
     # M-Pesa specific fields
     checkout_request_id = models.CharField(max_length=100, blank=True, null=True)
+    # Last time the reconciliation worker asked Safaricom about this push
+    status_checked_at = models.DateTimeField(blank=True, null=True)
     # merchant_request_id = models.CharField(max_length=100, blank=True, null=True)
     
     # Event and ticket related fields
@@ -48,3 +51,73 @@ class Transaction(models.Model):
     def __str__(self):
         return f"{self.transaction_id} - {self.buyer_name} - {self.amount} - {self.status}"
 # Create your models here.
+
+
+class TicketReservation(models.Model):
+    """
+    Time-boxed hold on ticket stock while the fan completes the STK prompt.
+
+    Stock is taken from the category when the hold is created, so nothing
+    is locked while the fan enters their PIN. The hold is confirmed into a
+    Ticket on payment success, or released (stock returned) on failure,
+    cancellation or expiry.
+    """
+    STATUS_CHOICES = (
+        ('held', 'Held'),
+        ('confirmed', 'Confirmed'),
+        ('released', 'Released'),
+        ('expired', 'Expired'),
+    )
+
+    transaction = models.OneToOneField(Transaction, on_delete=models.CASCADE, related_name='reservation')
+    ticket_category = models.ForeignKey(TicketCategory, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField(default=1)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='held')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    released_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_id} - {self.quantity} x {self.ticket_category_id} - {self.status}"
+
+
+class CallbackInbox(models.Model):
+    """
+    Raw M-Pesa callback bodies, stored as they arrive.
+
+    mpesa_callback writes here and acknowledges Safaricom immediately;
+    the process_callback_inbox worker does the fulfilment (ticket,
+    rendering, email) out of the request path.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('duplicate', 'Duplicate'),
+        ('failed', 'Failed'),
+    )
+
+    checkout_request_id = models.CharField(max_length=100, blank=True, db_index=True)
+    raw_body = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    # A crashed row is not claimed again before this (exponential backoff)
+    next_attempt_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name_plural = 'Callback inbox'
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.checkout_request_id or '?'} - {self.status} ({self.received_at:%Y-%m-%d %H:%M:%S})"
@@ -0,0 +1,140 @@
+"""
+ZOZAPRIME STK Reconciliation
+============================
+Location: payments/reconciliation.py
+
+Resolves pending STK pushes whose callback never arrived by asking
+Safaricom directly — from ONE background worker at a controlled rate,
+instead of from every open checkout tab.
+
+FLOW (reconcile_stk_payments command):
+  1. Pick pending transactions older than STK_QUERY_DELAY_SECONDS
+     (before that the fan hasn't even seen the prompt, and Safaricom's
+     ambiguous ResultCode 1 looks like a failure)
+  2. Claim each with a conditional UPDATE on status_checked_at, so
+     parallel workers never query the same push at once and each push
+     is queried at most every RECHECK_SECONDS
+  3. query_stk_status() — ResultCode 1 rules live there
+  4. apply_query_result() — success → ticket, cancelled/failed → hold released
+
+check_payment_status just reads the row this worker (or the callback)
+updated; publish_status() wakes any long-poll / SSE waiters.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Transaction
+from .reservations import release_hold
+from .status_channel import publish as publish_status
+
+logger = logging.getLogger(__name__)
+
+# Don't query Safaricom until the fan has had time to see the prompt
+STK_QUERY_DELAY_SECONDS = 15
+# Minimum gap between two queries for the same push
+RECHECK_SECONDS = 20
+# Stop chasing pushes older than this — Safaricom forgets them anyway
+MAX_AGE_MINUTES = 60
+# Upstream queries per second across this worker
+QUERY_RATE = getattr(settings, 'MPESA_STATUS_QUERY_RATE', 5)
+
+
+def due_transactions(now=None, limit=50):
+    """Pending STK pushes that are old enough, young enough and not recently checked."""
+    now = now or timezone.now()
+    return (
+        Transaction.objects.filter(
+            status='pending',
+            checkout_request_id__isnull=False,
+            timestamp__lte=now - timedelta(seconds=STK_QUERY_DELAY_SECONDS),
+            timestamp__gte=now - timedelta(minutes=MAX_AGE_MINUTES),
+        )
+        .exclude(checkout_request_id='')
+        .filter(_not_recently_checked(now))
+        .order_by('timestamp')[:limit]
+    )
+
+
+def reconcile_pending(batch_size=50, rate=QUERY_RATE, mpesa=None):
+    """
+    Query Safaricom for one batch of due transactions, at most `rate` per
+    second. Returns a dict of counts by resulting status.
+    """
+    from .services import MpesaService
+
+    mpesa = mpesa or MpesaService()
+    counts = {'success': 0, 'cancelled': 0, 'failed': 0, 'pending': 0}
+    interval = 1.0 / rate if rate else 0
+
+    for txn in list(due_transactions(limit=batch_size)):
+        if not _claim(txn):
+            continue  # another worker has it, or it resolved meanwhile
+
+        started = time.monotonic()
+        result = mpesa.query_stk_status(txn.checkout_request_id)
+        status = apply_query_result(txn, result, mpesa)
+        counts[status] += 1
+
+        spare = interval - (time.monotonic() - started)
+        if spare > 0:
+            time.sleep(spare)
+
+    return counts
+
+
+def apply_query_result(txn, result, mpesa):
+    """
+    Write a query_stk_status() result back to the transaction.
+    Only a still-pending row is changed, so a callback that landed
+    meanwhile always wins. Returns the transaction's resulting status.
+    """
+    status = result['status']
+    if status == 'pending':
+        return 'pending'
+
+    fields = {'status': status}
+    if status != 'success':
+        fields['description'] = result.get('description') or (
+            'Cancelled by user' if status == 'cancelled' else 'Payment failed'
+        )
+
+    updated = Transaction.objects.filter(
+        transaction_id=txn.transaction_id,
+        status='pending',
+    ).update(**fields)
+
+    if not updated:
+        txn.refresh_from_db(fields=['status'])
+        return txn.status if txn.status in ('success', 'cancelled', 'failed') else 'pending'
+
+    for field, value in fields.items():
+        setattr(txn, field, value)
+    logger.info(f"[RECONCILE] {txn.transaction_id}: {status}")
+    print(f"[RECONCILE] {txn.transaction_id} → {status}")
+
+    if status == 'success':
+        mpesa._create_ticket_from_txn(txn)  # publishes once the ticket exists
+    else:
+        release_hold(txn)
+        publish_status(txn.transaction_id, status)
+    return status
+
+
+def _not_recently_checked(now):
+    return Q(status_checked_at__isnull=True) | Q(
+        status_checked_at__lte=now - timedelta(seconds=RECHECK_SECONDS)
+    )
+
+
+def _claim(txn):
+    now = timezone.now()
+    return Transaction.objects.filter(
+        _not_recently_checked(now),
+        transaction_id=txn.transaction_id,
+        status='pending',
+    ).update(status_checked_at=now)
@@ -0,0 +1,151 @@
+"""
+ZOZAPRIME Ticket Reservations
+=============================
+Location: payments/reservations.py
+
+Time-boxed stock holds for the STK push flow.
+
+FLOW:
+  initiate_stk_push  → create_hold()   stock taken with one conditional UPDATE
+  callback success   → confirm_hold()  hold becomes the issued ticket's stock
+  callback failed    → release_hold()  stock returned
+  hold past TTL      → release_expired_holds()  stock returned — every
+                       reconcile_stk_payments --loop pass, and on demand
+                       when a buyer finds the category short (reclaim_for)
+
+Every status flip is a conditional UPDATE on the reservation row
+(WHERE status='held'), so a hold is restocked or confirmed exactly once
+even when the callback, the status poll and the expiry sweep race.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from events.inventory import take_stock, return_stock
+from events.models import TicketCategory
+from .models import TicketReservation
+
+logger = logging.getLogger(__name__)
+
+# How long a fan may take to complete the STK prompt before the hold lapses
+HOLD_TTL_SECONDS = getattr(settings, 'TICKET_HOLD_TTL_SECONDS', 300)
+
+
+def create_hold(txn):
+    """
+    Reserve stock for a pending transaction.
+    Returns the TicketReservation, or None if not enough tickets are left.
+    """
+    if not take_stock(txn.ticket_category_id, txn.quantity):
+        # Sold out on the fast path — lapsed holds may still be sitting
+        # on stock, so sweep this category once and retry.
+        if not release_expired_holds(category_id=txn.ticket_category_id):
+            return None
+        if not take_stock(txn.ticket_category_id, txn.quantity):
+            return None
+
+    reservation = TicketReservation.objects.create(
+        transaction=txn,
+        ticket_category_id=txn.ticket_category_id,
+        quantity=txn.quantity,
+        expires_at=timezone.now() + timedelta(seconds=HOLD_TTL_SECONDS),
+    )
+    logger.info(f"[HOLD] {txn.transaction_id}: holding {txn.quantity} until {reservation.expires_at}")
+    return reservation
+
+
+def release_hold(txn, status='released'):
+    """Return held stock for a failed or cancelled transaction. Safe to call twice."""
+    reservation = TicketReservation.objects.filter(transaction_id=txn.transaction_id).first()
+    if not reservation:
+        return False
+
+    with db_transaction.atomic():
+        flipped = TicketReservation.objects.filter(
+            pk=reservation.pk,
+            status='held',
+        ).update(status=status, released_at=timezone.now())
+
+        if flipped:
+            return_stock(reservation.ticket_category_id, reservation.quantity)
+
+    if flipped:
+        logger.info(f"[HOLD] {txn.transaction_id}: {status}, {reservation.quantity} returned")
+    return bool(flipped)
+
+
+def confirm_hold(txn):
+    """
+    Convert a hold into sold stock when payment succeeds.
+
+    Returns True when the ticket is covered by stock. If the hold already
+    lapsed, stock is taken again; if that fails too the fan has paid for a
+    ticket we no longer have, so it is logged as an oversell and the ticket
+    is still issued.
+    """
+    reservation = TicketReservation.objects.filter(transaction_id=txn.transaction_id).first()
+
+    if reservation:
+        flipped = TicketReservation.objects.filter(
+            pk=reservation.pk,
+            status='held',
+        ).update(status='confirmed')
+        if flipped or TicketReservation.objects.filter(pk=reservation.pk, status='confirmed').exists():
+            return True
+
+    # No live hold (legacy transaction, or the hold expired mid-payment)
+    covered = take_stock(txn.ticket_category_id, txn.quantity)
+    if not covered:
+        logger.error(
+            f"[HOLD] OVERSELL {txn.transaction_id}: paid for {txn.quantity} "
+            f"of category {txn.ticket_category_id} with no stock left"
+        )
+
+    if reservation:
+        TicketReservation.objects.filter(pk=reservation.pk).update(status='confirmed')
+
+    return covered
+
+
+def reclaim_for(category, quantity):
+    """
+    `category` (loaded with_live_stock) for an availability check. If it
+    cannot cover `quantity`, its lapsed holds are returned first and the
+    live stock re-read — otherwise a category sold out by abandoned STK
+    prompts would turn every buyer away before create_hold() could sweep.
+    """
+    if category.live_available >= quantity:
+        return category
+    if not release_expired_holds(category_id=category.pk):
+        return category
+    return TicketCategory.objects.with_live_stock().get(pk=category.pk)
+
+
+def release_expired_holds(category_id=None, now=None, batch_size=500):
+    """
+    Return stock held by reservations past their TTL.
+    Returns the number of holds released.
+    """
+    now = now or timezone.now()
+    expired = TicketReservation.objects.filter(status='held', expires_at__lte=now)
+    if category_id is not None:
+        expired = expired.filter(ticket_category_id=category_id)
+
+    released = 0
+    for reservation in expired.only('pk', 'ticket_category_id', 'quantity')[:batch_size]:
+        with db_transaction.atomic():
+            flipped = TicketReservation.objects.filter(
+                pk=reservation.pk,
+                status='held',
+            ).update(status='expired', released_at=now)
+
+            if flipped:
+                return_stock(reservation.ticket_category_id, reservation.quantity)
+                released += 1
+
+    if released:
+        logger.info(f"[HOLD] Released {released} expired hold(s)")
+    return released
@@ -7,16 +7,27 @@ import base64
 import logging
 import requests
 from datetime import datetime
+from decimal import Decimal
 
 from django.conf import settings
 from django.db import transaction as db_transaction
 from django.utils import timezone
 
 from .models import Transaction
+from .reservations import create_hold, release_hold, confirm_hold, reclaim_for
+from .circuit_breaker import CircuitOpenError
+from .daraja import get_daraja_client
+from .dispatcher import enqueue_stk_push
+from .status_channel import publish as publish_status
+from .stk_query import get_query_coalescer
+from .token_cache import get_token_manager
+from events.issuance import issue_tickets
 from events.models import Ticket, Event, TicketCategory
 
 logger = logging.getLogger(__name__)
 
+MPESA_SLOW_MESSAGE = 'M-Pesa is slow right now. Please retry in a moment.'
+
 
 class MpesaService:
     """M-Pesa payment service — STK push, callbacks, and status queries."""
@@ -27,29 +38,71 @@ class MpesaService:
         self.consumer_secret = settings.MPESA_CONSUMER_SECRET
         self.shortcode = settings.MPESA_SHORTCODE
         self.passkey = settings.MPESA_PASSKEY
+        self.client = get_daraja_client(self.base_url)
+        self.tokens = get_token_manager(
+            self.base_url, self.consumer_key, self._fetch_access_token
+        )
 
     # ═══════════════════════════════════════════════════════════════════════
     # AUTH
+    #
+    # Tokens are cached process-wide (payments/token_cache.py) and shared
+    # through Django's cache, so this is normally a dictionary lookup.
     # ═══════════════════════════════════════════════════════════════════════
 
     def generate_access_token(self):
-        """Generate OAuth access token from Safaricom API."""
+        """Return a valid OAuth access token (cached until shortly before expiry)."""
+        return self.tokens.get_token()
+
+    def _fetch_access_token(self):
+        """Fetch a new OAuth access token from Safaricom. Returns (token, ttl_seconds)."""
         try:
-            url = f'{self.base_url}/oauth/v1/generate?grant_type=client_credentials'
-            response = requests.get(
-                url,
+            response = self.client.get(
+                '/oauth/v1/generate',
+                endpoint='oauth',
+                params={'grant_type': 'client_credentials'},
                 auth=(self.consumer_key, self.consumer_secret),
-                timeout=30
             )
             response.raise_for_status()
-            token = response.json().get('access_token')
+            data = response.json()
+            token = data.get('access_token')
             if not token:
                 raise Exception("No access_token in Safaricom response")
-            return token
+            try:
+                ttl = int(data.get('expires_in') or 0)
+            except (TypeError, ValueError):
+                ttl = 0
+            return token, ttl
+        except CircuitOpenError:
+            raise
         except requests.exceptions.RequestException as e:
             logger.error(f"[AUTH] Token generation failed: {str(e)}")
             raise Exception("Failed to connect to M-Pesa. Please try again.")
 
+    def _authorized_post(self, path, payload, endpoint, idempotent=False):
+        """
+        POST to a Daraja endpoint with the cached token.
+        A 401 means the token was revoked early — drop it and retry once.
+        """
+        for attempt in range(2):
+            access_token = self.generate_access_token()
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+                'Content-Type': 'application/json'
+            }
+            response = self.client.post(
+                path,
+                endpoint=endpoint,
+                idempotent=idempotent,
+                json=payload,
+                headers=headers,
+            )
+            if response.status_code == 401 and attempt == 0:
+                logger.warning(f"[AUTH] 401 from {path}, refreshing token")
+                self.tokens.invalidate(access_token)
+                continue
+            return response
+
     def generate_password(self):
         """Generate Base64-encoded password and timestamp for STK push."""
         timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
@@ -62,42 +115,100 @@ class MpesaService:
     # ═══════════════════════════════════════════════════════════════════════
 
     def initiate_stk_push(self, phone, user, amount, event_id, ticket_category_id,
-                          buyer_name, buyer_email, buyer_phone, quantity, callback_url):
-        """Initiate M-Pesa STK Push payment."""
+                          buyer_name, buyer_email, buyer_phone, quantity, callback_url,
+                          background=False):
+        """
+        Initiate M-Pesa STK Push payment.
+
+        background=True only creates the transaction and its hold, queues
+        the push for the dispatcher pool (payments/dispatcher.py) and returns
+        straight away; the fan's status poll picks up the outcome.
+        """
+        transaction = None
         try:
             event = Event.objects.get(id=event_id)
-            category = TicketCategory.objects.get(id=ticket_category_id)
+            # Live stock: a sharded category's column is only a snapshot
+            category = reclaim_for(
+                TicketCategory.objects.with_live_stock().get(id=ticket_category_id), quantity
+            )
 
-            if category.available_tickets < quantity:
+            if category.live_available < quantity:
                 return {
                     'success': False,
-                    'error': f'Only {category.available_tickets} tickets available'
+                    'error': f'Only {category.live_available} tickets available'
                 }
 
-            transaction = Transaction.objects.create(
-                phone_number=phone,
-                amount=amount,
-                user=user if user and user.is_authenticated else None,
-                event=event,
-                ticket_category=category,
-                buyer_name=buyer_name,
-                buyer_email=buyer_email,
-                buyer_phone=buyer_phone,
-                quantity=quantity,
-                payment_method='mpesa',
-                status='pending'
-            )
+            # Safaricom degraded — say so now instead of holding stock and
+            # a web worker for a push that will time out anyway. The OAuth
+            # breaker only matters if a token has to be fetched.
+            oauth_ok = self.tokens.has_token() or self.client.is_available('oauth')
+            if not (oauth_ok and self.client.is_available('stk_push')):
+                return {'success': False, 'error': MPESA_SLOW_MESSAGE}
+
+            # Create the transaction and reserve its stock together, so a
+            # pending payment always has tickets set aside for it.
+            with db_transaction.atomic():
+                transaction = Transaction.objects.create(
+                    phone_number=phone,
+                    amount=amount,
+                    user=user if user and user.is_authenticated else None,
+                    event=event,
+                    ticket_category=category,
+                    buyer_name=buyer_name,
+                    buyer_email=buyer_email,
+                    buyer_phone=buyer_phone,
+                    quantity=quantity,
+                    payment_method='mpesa',
+                    status='queued' if background else 'pending'
+                )
+
+                if not create_hold(transaction):
+                    db_transaction.set_rollback(True)
+                    transaction = None
+
+            if transaction is None:
+                category = TicketCategory.objects.with_live_stock().get(id=ticket_category_id)
+                return {
+                    'success': False,
+                    'error': f'Only {category.live_available} tickets available'
+                }
 
             logger.info(f"[STK] Created transaction: {transaction.transaction_id}")
             print(f"[STK] Created: {transaction.transaction_id}")
 
-            access_token = self.generate_access_token()
-            password, timestamp = self.generate_password()
+            if background:
+                enqueue_stk_push(transaction.transaction_id, callback_url)
+                return {
+                    'success': True,
+                    'transaction_id': transaction.transaction_id,
+                    'checkout_request_id': None,
+                    'customer_message': 'Sending the M-Pesa prompt to your phone...',
+                }
 
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
+        except Event.DoesNotExist:
+            return {'success': False, 'error': 'Event not found'}
+        except TicketCategory.DoesNotExist:
+            return {'success': False, 'error': 'Ticket category not found'}
+        except Exception as e:
+            logger.error(f"[STK] Error: {str(e)}", exc_info=True)
+            self._abandon_transaction(transaction, 'STK push error')
+            return {'success': False, 'error': 'An error occurred. Please try again.'}
+
+        return self.send_stk_push(transaction, callback_url)
+
+    def send_stk_push(self, transaction, callback_url):
+        """
+        Send the STK push for a transaction that already holds its stock.
+        Writes checkout_request_id back on success; fails the transaction
+        and releases its hold otherwise.
+        """
+        try:
+            event = transaction.event
+            category = transaction.ticket_category
+            phone = transaction.phone_number
+            amount = transaction.amount
+
+            password, timestamp = self.generate_password()
 
             # ┌─────────────────────────────────────────────────────────┐
             # │ PRODUCTION TOGGLE                                       │
@@ -123,11 +234,9 @@ class MpesaService:
             logger.info(f"[STK] Sending: phone={phone}, amount={stk_amount}")
             print(f"[STK] Phone: {phone}, Amount: {stk_amount}")
 
-            response = requests.post(
-                f'{self.base_url}/mpesa/stkpush/v1/processrequest',
-                json=payload,
-                headers=headers,
-                timeout=30
+            # Not idempotent — a retried push would prompt the fan twice
+            response = self._authorized_post(
+                '/mpesa/stkpush/v1/processrequest', payload, endpoint='stk_push'
             )
 
             data = response.json()
@@ -154,6 +263,8 @@ class MpesaService:
                 transaction.status = 'failed'
                 transaction.description = data.get('ResponseDescription', 'STK push failed')
                 transaction.save(update_fields=['status', 'description'])
+                release_hold(transaction)
+                publish_status(transaction.transaction_id, 'failed')
 
                 print(f"[STK] ❌ Failed: {data.get('ResponseDescription')}")
 
@@ -165,25 +276,50 @@ class MpesaService:
                     )
                 }
 
-        except Event.DoesNotExist:
-            return {'success': False, 'error': 'Event not found'}
-        except TicketCategory.DoesNotExist:
-            return {'success': False, 'error': 'Ticket category not found'}
+        except CircuitOpenError:
+            self._abandon_transaction(transaction, MPESA_SLOW_MESSAGE)
+            return {'success': False, 'error': MPESA_SLOW_MESSAGE}
         except requests.exceptions.Timeout:
+            self._abandon_transaction(transaction, 'M-Pesa did not respond in time. Please try again.')
             return {'success': False, 'error': 'Request timeout. Please try again.'}
         except requests.exceptions.RequestException as e:
             logger.error(f"[STK] Request error: {str(e)}")
+            self._abandon_transaction(transaction, 'Could not reach M-Pesa. Please try again.')
             return {'success': False, 'error': 'Connection error. Please try again.'}
         except Exception as e:
             logger.error(f"[STK] Error: {str(e)}", exc_info=True)
+            self._abandon_transaction(transaction, 'STK push error')
             return {'success': False, 'error': 'An error occurred. Please try again.'}
 
+    def _abandon_transaction(self, transaction, reason):
+        """
+        Fail a transaction whose STK push never got a CheckoutRequestID.
+        Without one, no callback can ever be matched to it, so its hold is
+        released immediately instead of waiting for the TTL.
+        """
+        if transaction is None or transaction.checkout_request_id:
+            return
+        try:
+            transaction.status = 'failed'
+            transaction.description = reason
+            transaction.save(update_fields=['status', 'description'])
+            release_hold(transaction)
+            publish_status(transaction.transaction_id, 'failed')
+        except Exception as e:
+            logger.error(f"[STK] Could not release hold for {transaction.transaction_id}: {e}")
+
     # ═══════════════════════════════════════════════════════════════════════
     # CALLBACK PROCESSING
     # ═══════════════════════════════════════════════════════════════════════
 
-    def process_callback(self, callback_data):
-        """Process M-Pesa STK push callback from Safaricom."""
+    def process_callback(self, callback_data, raise_errors=False):
+        """
+        Process M-Pesa STK push callback from Safaricom.
+
+        With raise_errors set (the callback inbox), a crash — including a
+        failed ticket creation — propagates so the row can be retried;
+        otherwise it is logged and False is returned.
+        """
         try:
             stk_callback = callback_data.get('Body', {}).get('stkCallback', {})
             result_code = stk_callback.get('ResultCode')
@@ -201,9 +337,11 @@ class MpesaService:
                 logger.error(f"[CALLBACK] No transaction for {checkout_request_id}")
                 return False
 
-            # Prevent double-processing
+            # Prevent double-processing — but finish a fulfilment that crashed
+            # after the payment was recorded (no-op when the ticket exists)
             if transaction.status == 'success':
                 logger.info(f"[CALLBACK] Already succeeded: {transaction.transaction_id}")
+                self._create_ticket_from_txn(transaction, raise_errors=raise_errors)
                 return True
 
             if result_code == 0:
@@ -227,7 +365,7 @@ class MpesaService:
                 logger.info(f"[CALLBACK] ✅ Receipt: {receipt_number}, Paid: {paid_amount}")
                 print(f"[CALLBACK] ✅ Receipt: {receipt_number}")
 
-                self._create_ticket_from_txn(transaction)
+                self._create_ticket_from_txn(transaction, raise_errors=raise_errors)
                 return True
 
             elif result_code == 1032:
@@ -248,11 +386,15 @@ class MpesaService:
                 transaction.save()
                 print(f"[CALLBACK] Unknown code {result_code}")
 
+            release_hold(transaction)
+            publish_status(transaction.transaction_id, transaction.status)
             return False
 
         except Exception as e:
             logger.error(f"[CALLBACK] Error: {str(e)}", exc_info=True)
             print(f"[CALLBACK] ❌ Error: {str(e)}")
+            if raise_errors:
+                raise
             return False
 
     # ═══════════════════════════════════════════════════════════════════════
@@ -272,16 +414,17 @@ class MpesaService:
         """
         Query Safaricom for STK push status.
         Used when callback hasn't arrived yet.
+
+        Concurrent and repeated queries for the same push share one
+        upstream call (payments/stk_query.py).
         """
+        return get_query_coalescer().query(checkout_request_id, self._query_stk_status_upstream)
+
+    def _query_stk_status_upstream(self, checkout_request_id):
+        """One real STK status query to Safaricom, normalised to a status dict."""
         try:
-            access_token = self.generate_access_token()
             password, timestamp = self.generate_password()
 
-            headers = {
-                'Authorization': f'Bearer {access_token}',
-                'Content-Type': 'application/json'
-            }
-
             payload = {
                 "BusinessShortCode": self.shortcode,
                 "Password": password,
@@ -292,11 +435,8 @@ class MpesaService:
             logger.info(f"[QUERY] Querying {checkout_request_id}")
             print(f"[QUERY] Querying {checkout_request_id}")
 
-            response = requests.post(
-                f'{self.base_url}/mpesa/stkpushquery/v1/query',
-                json=payload,
-                headers=headers,
-                timeout=30
+            response = self._authorized_post(
+                '/mpesa/stkpushquery/v1/query', payload, endpoint='stk_query', idempotent=True
             )
 
             data = response.json()
@@ -397,15 +537,18 @@ class MpesaService:
     # ═══════════════════════════════════════════════════════════════════════
     # TICKET CREATION
     #
-    # DUPLICATE FIX: Checks by transaction_code (unique per payment),
+    # DUPLICATE FIX: Checks by the transaction link (one per payment),
     # NOT by buyer email+phone (which blocked repeat purchases).
     # ═══════════════════════════════════════════════════════════════════════
 
-    def _create_ticket_from_txn(self, txn):
-        """Create ticket from successful transaction. Prevents duplicates."""
+    def _create_ticket_from_txn(self, txn, raise_errors=False):
+        """
+        Create ticket from successful transaction. Prevents duplicates.
+        Returns None on failure, or re-raises with raise_errors set.
+        """
         tx_code = txn.receipt_number or f"TXN_{txn.transaction_id}"
 
-        existing = Ticket.objects.filter(transaction_code=tx_code).first()
+        existing = Ticket.objects.filter(transaction=txn).first()
         if existing:
             logger.info(f"[TICKET] Already exists: {existing.id} for {tx_code}")
             print(f"[TICKET] Already exists: {existing.id}")
@@ -413,28 +556,42 @@ class MpesaService:
 
         try:
             with db_transaction.atomic():
-                ticket = Ticket.objects.create(
-                    event=txn.event,
-                    ticket_category=txn.ticket_category,
+                # The callback, the inbox worker and the confirmation page can
+                # all get here at once — serialise on the transaction row
+                Transaction.objects.select_for_update().filter(pk=txn.pk).first()
+                existing = Ticket.objects.filter(transaction=txn).first()
+                if existing:
+                    return existing
+
+                # Stock was reserved at STK push time — convert the hold
+                # rather than decrementing (and locking) the category here.
+                tickets = issue_tickets(
+                    txn.event,
+                    [{
+                        'category': txn.ticket_category,
+                        'quantity': txn.quantity,
+                        # What the fan actually paid per unit, promo included
+                        'unit_price': (txn.amount / txn.quantity).quantize(Decimal('0.01')),
+                        'total': txn.amount,
+                    }],
                     buyer_name=txn.buyer_name,
                     buyer_email=txn.buyer_email,
                     buyer_phone=txn.buyer_phone,
-                    quantity=txn.quantity,
-                    unit_price=txn.ticket_category.price,
-                    total_amount=txn.amount,
+                    buyer=txn.user,
+                    transaction=txn,
                     transaction_code=tx_code,
-                    status='confirmed',
+                    take_stock=False,
                 )
+                confirm_hold(txn)
 
-                category = TicketCategory.objects.select_for_update().get(
-                    id=txn.ticket_category_id
-                )
-                category.available_tickets = max(0, category.available_tickets - txn.quantity)
-                category.save(update_fields=['available_tickets'])
+            ticket = tickets[0]
 
             logger.info(f"[TICKET] ✅ Created: {ticket.id}, code={ticket.ticket_code}")
             print(f"[TICKET] ✅ Created {ticket.id}")
 
+            # Tell the waiting checkout page now, not after the email goes out
+            publish_status(txn.transaction_id, 'success')
+
             # Send email with QR (non-blocking)
             try:
                 from events.ticket_service import send_ticket_email
@@ -448,17 +605,23 @@ class MpesaService:
         except Exception as e:
             logger.error(f"[TICKET] Creation failed: {e}", exc_info=True)
             print(f"[TICKET] ❌ Failed: {e}")
+            if raise_errors:
+                raise
             return None
 
     def check_transaction_status(self, transaction_id):
-        """Check transaction status from DB only."""
-        try:
-            txn = Transaction.objects.get(transaction_id=transaction_id)
-            return {
-                'status': txn.status,
-                'receipt_number': txn.receipt_number,
-                'transaction_id': txn.transaction_id,
-                'amount': float(txn.amount),
-            }
-        except Transaction.DoesNotExist:
-            return None
\ No newline at end of file
+        """Check transaction status (and its ticket, if issued) from DB only."""
+        row = (
+            Transaction.objects.filter(transaction_id=transaction_id)
+            .values('status', 'receipt_number', 'transaction_id', 'amount', 'tickets__ticket_code')
+            .first()
+        )
+        if not row:
+            return None
+        return {
+            'status': row['status'],
+            'receipt_number': row['receipt_number'],
+            'transaction_id': row['transaction_id'],
+            'amount': float(row['amount']),
+            'ticket_code': row['tickets__ticket_code'],
+        }
\ No newline at end of file
@@ -0,0 +1,342 @@
+"""
+ZOZAPRIME Daraja Simulator
+==========================
+Location: payments/simulator.py
+
+A self-contained stand-in for the Safaricom Daraja API, so the whole
+purchase pipeline can be load-tested offline.
+
+ENDPOINTS (same shapes as Daraja):
+  GET  /oauth/v1/generate                 → access token
+  POST /mpesa/stkpush/v1/processrequest   → accepts the push, schedules a callback
+  POST /mpesa/stkpushquery/v1/query       → ResultCode 1 while the "fan" is
+                                            still on the prompt, then the outcome
+CONTROL:
+  GET  /simulator/stats                   → request / callback counters
+  POST /simulator/config                  → change latency, errors or the
+                                            result mix while it runs
+
+Each push is given an outcome from the result-code mix (0 paid, 1
+insufficient balance, 1032 cancelled, 2001 wrong PIN) and a callback delay;
+the callback is POSTed to the push's CallBackURL (or callback_url, if set).
+A push can also be told to never call back (callback_loss) so the
+reconciliation worker gets exercised. Pushes are forgotten push_ttl
+seconds after they resolve, delivered or not, so a long soak run does not
+grow without bound; a later query gets Daraja's "being processed" error.
+
+RUN:
+  python manage.py run_daraja_simulator --port 8765 \
+      --callback-url http://127.0.0.1:8000/payments/mpesa-callback/
+  DEBUG=True MPESA_BASE_URL=http://127.0.0.1:8765 python manage.py runserver
+  (DEBUG keeps SECURE_SSL_REDIRECT off, so the plain-HTTP callback lands)
+
+IN TESTS:
+  with DarajaSimulator(callback_url=...) as sim:
+      settings.MPESA_BASE_URL = sim.url
+"""
+import heapq
+import json
+import logging
+import random
+import string
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+
+logger = logging.getLogger(__name__)
+
+RESULT_DESCRIPTIONS = {
+    0: 'The service request is processed successfully.',
+    1: 'The balance is insufficient for the transaction.',
+    1032: 'Request cancelled by user',
+    2001: 'The initiator information is invalid.',
+}
+
+DEFAULT_RESULT_MIX = {0: 70, 1: 5, 1032: 20, 2001: 5}
+
+
+class SimulatorConfig:
+    """Knobs for the simulator. All can be changed while it runs."""
+
+    FIELDS = (
+        'result_mix', 'callback_delay', 'latency', 'error_rate',
+        'callback_loss', 'callback_url', 'push_ttl',
+    )
+
+    def __init__(self, result_mix=None, callback_delay=(2.0, 8.0), latency=(0.05, 0.3),
+                 error_rate=0.0, callback_loss=0.0, callback_url=None, push_ttl=300.0):
+        self.result_mix = dict(result_mix or DEFAULT_RESULT_MIX)
+        self.callback_delay = tuple(callback_delay)  # seconds (min, max)
+        self.latency = tuple(latency)                # seconds (min, max) per API call
+        self.error_rate = error_rate                 # share of API calls answered 503
+        self.callback_loss = callback_loss           # share of pushes that never call back
+        self.callback_url = callback_url             # overrides the push's CallBackURL
+        self.push_ttl = push_ttl                     # seconds a resolved push stays queryable
+
+    def update(self, data):
+        for field in self.FIELDS:
+            if field not in data:
+                continue
+            value = data[field]
+            if field == 'result_mix':
+                value = {int(code): weight for code, weight in value.items()}
+            elif field in ('callback_delay', 'latency'):
+                value = tuple(float(v) for v in value)
+            elif field in ('error_rate', 'callback_loss', 'push_ttl'):
+                value = float(value)
+            setattr(self, field, value)
+
+    def as_dict(self):
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data['result_mix'] = {str(k): v for k, v in self.result_mix.items()}
+        return data
+
+    def pick_result(self):
+        codes = list(self.result_mix)
+        return random.choices(codes, weights=[self.result_mix[c] for c in codes])[0]
+
+
+class DarajaSimulator:
+    """Threaded HTTP server speaking enough Daraja for the purchase pipeline."""
+
+    def __init__(self, host='127.0.0.1', port=0, **config):
+        self.config = SimulatorConfig(**config)
+        self.pushes = {}
+        self._expiry = []  # heap of (forget_at, checkout_request_id)
+        self.stats = {
+            'token_requests': 0,
+            'stk_pushes': 0,
+            'stk_queries': 0,
+            'injected_errors': 0,
+            'callbacks_sent': 0,
+            'callbacks_failed': 0,
+            'callbacks_dropped': 0,
+            'results': {},
+        }
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._serving = False
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    # ── Lifecycle ─────────────────────────────────────────────────────────
+
+    def start(self):
+        """Serve in a background thread (test fixture use)."""
+        self._serving = True
+        threading.Thread(
+            target=self._server.serve_forever, name='daraja-simulator', daemon=True
+        ).start()
+        return self
+
+    def serve_forever(self):
+        self._serving = True
+        self._server.serve_forever()
+
+    def stop(self):
+        if self._serving:
+            self._server.shutdown()
+            self._serving = False
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ── Daraja behaviour ──────────────────────────────────────────────────
+
+    def generate_token(self):
+        self._count('token_requests')
+        return 200, {'access_token': uuid.uuid4().hex, 'expires_in': '3599'}
+
+    def stk_push(self, payload):
+        self._count('stk_pushes')
+        missing = [k for k in ('BusinessShortCode', 'Amount', 'PhoneNumber', 'CallBackURL') if not payload.get(k)]
+        if missing:
+            return 400, {
+                'requestId': uuid.uuid4().hex,
+                'errorCode': '400.002.02',
+                'errorMessage': f"Bad Request - Invalid {missing[0]}",
+            }
+
+        checkout_request_id = f"ws_CO_{datetime.now():%d%m%Y%H%M%S}{random.randint(100000, 999999)}"
+        merchant_request_id = f"{random.randint(10000, 99999)}-{random.randint(1000000, 9999999)}-1"
+        result_code = self.config.pick_result()
+        delay = random.uniform(*self.config.callback_delay)
+
+        push = {
+            'merchant_request_id': merchant_request_id,
+            'checkout_request_id': checkout_request_id,
+            'result_code': result_code,
+            'resolves_at': time.time() + delay,
+            'amount': payload.get('Amount'),
+            'phone': payload.get('PhoneNumber'),
+            'callback_url': self.config.callback_url or payload.get('CallBackURL'),
+        }
+        with self._lock:
+            self._prune(time.time())
+            self.pushes[checkout_request_id] = push
+            heapq.heappush(self._expiry, (push['resolves_at'] + self.config.push_ttl, checkout_request_id))
+
+        if random.random() < self.config.callback_loss:
+            self._count('callbacks_dropped')
+        else:
+            timer = threading.Timer(delay, self._send_callback, args=(push,))
+            timer.daemon = True
+            timer.start()
+
+        return 200, {
+            'MerchantRequestID': merchant_request_id,
+            'CheckoutRequestID': checkout_request_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing',
+        }
+
+    def stk_query(self, payload):
+        self._count('stk_queries')
+        with self._lock:
+            self._prune(time.time())
+            push = self.pushes.get(payload.get('CheckoutRequestID'))
+        if not push:
+            return 500, {
+                'requestId': uuid.uuid4().hex,
+                'errorCode': '500.001.1001',
+                'errorMessage': 'The transaction is being processed',
+            }
+
+        base = {
+            'ResponseCode': '0',
+            'ResponseDescription': 'The service request has been accepted successsfully',
+            'MerchantRequestID': push['merchant_request_id'],
+            'CheckoutRequestID': push['checkout_request_id'],
+        }
+        if time.time() < push['resolves_at']:
+            # Fan still on the PIN prompt — Daraja's ambiguous "processed" answer
+            return 200, {**base, 'ResultCode': '1', 'ResultDesc': 'The service request is processed successfully.'}
+
+        code = push['result_code']
+        return 200, {**base, 'ResultCode': str(code), 'ResultDesc': RESULT_DESCRIPTIONS[code]}
+
+    def callback_body(self, push):
+        """The stkCallback JSON Safaricom would POST for a push."""
+        code = push['result_code']
+        callback = {
+            'MerchantRequestID': push['merchant_request_id'],
+            'CheckoutRequestID': push['checkout_request_id'],
+            'ResultCode': code,
+            'ResultDesc': RESULT_DESCRIPTIONS[code],
+        }
+        if code == 0:
+            receipt = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+            callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'Amount', 'Value': float(push['amount'] or 0)},
+                {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+                {'Name': 'TransactionDate', 'Value': int(datetime.now().strftime('%Y%m%d%H%M%S'))},
+                {'Name': 'PhoneNumber', 'Value': int(push['phone'] or 0)},
+            ]}
+        return {'Body': {'stkCallback': callback}}
+
+    def _send_callback(self, push):
+        code = push['result_code']
+        body = json.dumps(self.callback_body(push)).encode()
+        request = Request(push['callback_url'], data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urlopen(request, timeout=10) as response:
+                response.read()
+            self._count('callbacks_sent')
+            with self._lock:
+                results = self.stats['results']
+                results[str(code)] = results.get(str(code), 0) + 1
+        except Exception as e:
+            self._count('callbacks_failed')
+            logger.warning(f"[SIMULATOR] Callback to {push['callback_url']} failed: {e}")
+
+    def _prune(self, now):
+        # Caller holds self._lock
+        while self._expiry and self._expiry[0][0] <= now:
+            _, checkout_request_id = heapq.heappop(self._expiry)
+            self.pushes.pop(checkout_request_id, None)
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def stats_snapshot(self):
+        with self._lock:
+            self._prune(time.time())
+            return {**self.stats, 'results': dict(self.stats['results']), 'open_pushes': len(self.pushes)}
+
+    # ── HTTP plumbing ─────────────────────────────────────────────────────
+
+    def _handler_class(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/simulator/stats':
+                    return self._reply(200, simulator.stats_snapshot())
+                if path == '/simulator/config':
+                    return self._reply(200, simulator.config.as_dict())
+                if path == '/oauth/v1/generate':
+                    if not self.headers.get('Authorization', '').startswith('Basic '):
+                        return self._reply(400, {'errorCode': '400.008.01', 'errorMessage': 'Invalid Authentication passed'})
+                    return self._api(simulator.generate_token)
+                self._reply(404, {'errorMessage': 'Not found'})
+
+            def do_POST(self):
+                path = self.path.split('?', 1)[0]
+                try:
+                    payload = json.loads(self._body() or b'{}')
+                except ValueError:
+                    return self._reply(400, {'errorMessage': 'Invalid JSON'})
+
+                if path == '/simulator/config':
+                    simulator.config.update(payload)
+                    return self._reply(200, simulator.config.as_dict())
+                if path == '/mpesa/stkpush/v1/processrequest':
+                    return self._api(simulator.stk_push, payload)
+                if path == '/mpesa/stkpushquery/v1/query':
+                    return self._api(simulator.stk_query, payload)
+                self._reply(404, {'errorMessage': 'Not found'})
+
+            def _api(self, handler, *args):
+                time.sleep(random.uniform(*simulator.config.latency))
+                if random.random() < simulator.config.error_rate:
+                    simulator._count('injected_errors')
+                    return self._reply(503, {
+                        'requestId': uuid.uuid4().hex,
+                        'errorCode': '503.001.01',
+                        'errorMessage': 'Service Unavailable - System is busy',
+                    })
+                status, data = handler(*args)
+                self._reply(status, data)
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def _reply(self, status, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"[SIMULATOR] {self.address_string()} {format % args}")
+
+        return Handler
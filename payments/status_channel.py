@@ -0,0 +1,94 @@
+"""
+ZOZAPRIME Payment Status Channel
+================================
+Location: payments/status_channel.py
+
+Push-style payment status for the checkout page.
+
+  publish()          called on every status transition (callback, inbox
+                     worker, reconciliation worker) — one cache write
+  wait_for_change()  async; holds until the status differs from what the
+                     browser already knows, or the timeout expires
+
+Waiters watch the cache key, so a transition written by any process —
+the inbox worker and the reconciler publish from their own — is seen
+within WAKE_INTERVAL_SECONDS. That needs the shared CACHES backend from
+settings (Redis, or the database cache table); a per-process LocMem cache
+would only ever wake on the DB_RECHECK_SECONDS re-read of the Transaction
+row, which stays as the safety net for transitions made outside publish().
+
+The views are async and only stream under ASGI — the Procfile serves the
+web process with uvicorn workers. Under WSGI a streamed response is read
+to the end before it is sent and each waiter pins a worker.
+
+SERVED BY:
+  payments/views.py → wait_payment_status (long-poll), payment_status_stream (SSE)
+"""
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+
+from .models import Transaction
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ('success', 'failed', 'cancelled')
+CACHE_SECONDS = 600
+WAKE_INTERVAL_SECONDS = 0.5
+DB_RECHECK_SECONDS = 10
+
+
+def _key(transaction_id):
+    return f"payment_status:{transaction_id}"
+
+
+def publish(transaction_id, status):
+    """Record a status transition so waiting browsers wake up."""
+    cache.set(_key(transaction_id), status, CACHE_SECONDS)
+    logger.info(f"[STATUS] {transaction_id} → {status} published")
+
+
+def snapshot(transaction_id):
+    """Current status payload straight from the DB, or None if unknown."""
+    txn = Transaction.objects.filter(transaction_id=transaction_id).only(
+        'transaction_id', 'status', 'receipt_number', 'amount', 'description'
+    ).first()
+    if not txn:
+        return None
+    payload = {
+        'success': True,
+        # 'queued' is an internal dispatch state — to the fan it is pending
+        'status': 'pending' if txn.status == 'queued' else txn.status,
+        'transaction_id': txn.transaction_id,
+        'receipt_number': txn.receipt_number,
+        'amount': float(txn.amount),
+    }
+    if txn.status == 'failed' and txn.description:
+        payload['message'] = txn.description
+    return payload
+
+
+async def wait_for_change(transaction_id, known_status, timeout):
+    """
+    Wait until the transaction's status differs from `known_status`.
+    Returns the fresh payload, or None on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    next_db_check = time.monotonic()
+
+    while True:
+        now = time.monotonic()
+        published = await cache.aget(_key(transaction_id))
+
+        if (published and published != known_status) or now >= next_db_check:
+            payload = await sync_to_async(snapshot)(transaction_id)
+            if payload and payload['status'] != known_status:
+                return payload
+            next_db_check = now + DB_RECHECK_SECONDS
+
+        if now >= deadline:
+            return None
+        await asyncio.sleep(min(WAKE_INTERVAL_SECONDS, max(deadline - now, 0)))
@@ -0,0 +1,102 @@
+"""
+ZOZAPRIME STK Status Query Coalescing
+=====================================
+Location: payments/stk_query.py
+
+Several tabs, the confirmation page, retries and the reconciliation worker
+can all ask Safaricom about the same CheckoutRequestID within a second.
+StkQueryCoalescer sits in front of MpesaService's upstream query:
+
+  - CACHED:    a recent answer is in Django's cache → returned, no call
+  - JOINED:    the same query is already in flight in this process →
+               wait for it and share its answer
+  - UPSTREAM:  otherwise, one call to Safaricom
+
+Final answers (success / failed / cancelled) are cached for
+TERMINAL_CACHE_SECONDS. Non-final answers — ResultCode 1 'pending' and
+timeouts — are negatively cached for MPESA_STATUS_NEGATIVE_CACHE_SECONDS,
+so the ambiguous code is not re-asked every poll.
+
+stats() counts calls vs upstream calls; the difference is what was saved.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_CACHE_SECONDS = 300
+NEGATIVE_CACHE_SECONDS = getattr(settings, 'MPESA_STATUS_NEGATIVE_CACHE_SECONDS', 10)
+# How long a joined caller waits for the leader before querying itself
+JOIN_TIMEOUT_SECONDS = 35
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class StkQueryCoalescer:
+    """Single-flight + short-lived cache for STK status queries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._stats = {'calls': 0, 'cache_hits': 0, 'joined': 0, 'upstream': 0}
+
+    def query(self, checkout_request_id, fetch):
+        """Return fetch(checkout_request_id), sharing and caching the answer."""
+        self._count('calls')
+        key = f"stk_query:{checkout_request_id}"
+
+        cached = cache.get(key)
+        if cached is not None:
+            self._count('cache_hits')
+            return cached
+
+        with self._lock:
+            flight = self._in_flight.get(checkout_request_id)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[checkout_request_id] = _InFlight()
+
+        if not leader:
+            self._count('joined')
+            if flight.done.wait(JOIN_TIMEOUT_SECONDS) and flight.result is not None:
+                return flight.result
+            # Leader hung or crashed — fall through and ask ourselves
+            self._count('upstream')
+            return fetch(checkout_request_id)
+
+        try:
+            self._count('upstream')
+            result = fetch(checkout_request_id)
+            flight.result = result
+            ttl = NEGATIVE_CACHE_SECONDS if result.get('status') == 'pending' else TERMINAL_CACHE_SECONDS
+            cache.set(key, result, ttl)
+            return result
+        finally:
+            with self._lock:
+                self._in_flight.pop(checkout_request_id, None)
+            flight.done.set()
+
+    def stats(self):
+        data = dict(self._stats)
+        data['saved'] = data['calls'] - data['upstream']
+        data['saved_rate'] = round(data['saved'] / data['calls'] * 100, 1) if data['calls'] else 0.0
+        return data
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+
+_coalescer = StkQueryCoalescer()
+
+
+def get_query_coalescer():
+    """The process-wide coalescer."""
+    return _coalescer
@@ -1,3 +1,638 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from itertools import count
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from events.models import Event, Ticket, TicketCategory, User
+
+from .callback_inbox import RETRY_BACKOFF_MAX_SECONDS, drain_inbox, retry_delay, store_callback
+from .daraja import DarajaClient
+from .dispatcher import GIVE_UP_AFTER_SECONDS, STALE_AFTER_SECONDS, dispatch, dispatch_stale
+from .models import CallbackInbox, TicketReservation, Transaction
+from .reconciliation import (
+    MAX_AGE_MINUTES, RECHECK_SECONDS, STK_QUERY_DELAY_SECONDS, apply_query_result, reconcile_pending,
+)
+from .services import MPESA_SLOW_MESSAGE, MpesaService
+from .simulator import DarajaSimulator
+from .status_channel import DB_RECHECK_SECONDS, publish as publish_status
+from .stk_query import NEGATIVE_CACHE_SECONDS, StkQueryCoalescer
+from .token_cache import REFRESH_AHEAD_SECONDS, AccessTokenManager
+from .views import wait_payment_status
+
+_codes = count(1)
+
+
+def _fake_codes(n):
+    return [f'TEST{next(_codes):06d}' for _ in range(n)]
+
+
+@mock.patch('events.issuance.allocate_ticket_codes', _fake_codes)
+@mock.patch('events.ticket_service.send_ticket_email', lambda ticket: None)
+class CallbackInboxTests(TestCase):
+
+    def setUp(self):
+        seller = User.objects.create_user(username='seller', password='x', is_seller=True)
+        self.event = Event.objects.create(
+            organizer=seller, title='Inbox', description='-',
+            date=timezone.now() + timedelta(days=10), location='Nairobi',
+            available_tickets=10,
+        )
+        self.category = TicketCategory.objects.create(
+            event=self.event, name='Regular', price=Decimal('500'), available_tickets=10,
+        )
+        self.txn = Transaction.objects.create(
+            amount=Decimal('500'), event=self.event, ticket_category=self.category,
+            buyer_name='Fan', buyer_email='fan@example.com', buyer_phone='254700000000',
+            checkout_request_id='ws_CO_1',
+        )
+
+    def _callback(self):
+        return json.dumps({'Body': {'stkCallback': {
+            'CheckoutRequestID': 'ws_CO_1',
+            'ResultCode': 0,
+            'ResultDesc': 'The service request is processed successfully.',
+            'CallbackMetadata': {'Item': [
+                {'Name': 'Amount', 'Value': 500},
+                {'Name': 'MpesaReceiptNumber', 'Value': 'RCP123'},
+            ]},
+        }}})
+
+    def test_failed_fulfilment_is_retried_until_the_ticket_exists(self):
+        entry = store_callback(self._callback())
+
+        with mock.patch('payments.services.issue_tickets', side_effect=RuntimeError('db hiccup')):
+            self.assertEqual(drain_inbox()['retry'], 1)
+
+        entry.refresh_from_db()
+        self.txn.refresh_from_db()
+        self.assertEqual(entry.status, 'pending')
+        self.assertIn('db hiccup', entry.last_error)
+        # The payment is recorded even though the ticket is not
+        self.assertEqual(self.txn.status, 'success')
+        self.assertFalse(Ticket.objects.filter(transaction=self.txn).exists())
+
+        # Not due yet: a looping worker must not burn the attempts at once
+        self.assertEqual(drain_inbox(), {'processed': 0, 'duplicate': 0, 'failed': 0, 'retry': 0})
+
+        CallbackInbox.objects.filter(pk=entry.pk).update(next_attempt_at=timezone.now())
+        self.assertEqual(drain_inbox()['processed'], 1)
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'processed')
+        self.assertEqual(Ticket.objects.filter(transaction=self.txn).count(), 1)
+
+    def test_retry_waits_grow_with_each_crash(self):
+        entry = store_callback(self._callback())
+
+        waits = []
+        with mock.patch('payments.services.issue_tickets', side_effect=RuntimeError('db hiccup')):
+            for _ in range(3):
+                before = timezone.now()
+                self.assertEqual(drain_inbox()['retry'], 1)
+                entry.refresh_from_db()
+                waits.append(round((entry.next_attempt_at - before).total_seconds()))
+                CallbackInbox.objects.filter(pk=entry.pk).update(next_attempt_at=None)
+
+        self.assertEqual(waits, [30, 60, 120])
+        self.assertEqual(retry_delay(20), timedelta(seconds=RETRY_BACKOFF_MAX_SECONDS))
+
+    def test_gives_up_after_max_attempts(self):
+        entry = store_callback(self._callback())
+        CallbackInbox.objects.filter(pk=entry.pk).update(attempts=4)
+
+        with mock.patch('payments.services.issue_tickets', side_effect=RuntimeError('still down')):
+            self.assertEqual(drain_inbox()['failed'], 1)
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'failed')
+        self.assertEqual(entry.attempts, 5)
+
+
+class DarajaRetryTests(TestCase):
+
+    def setUp(self):
+        self.client = DarajaClient('https://daraja.invalid')
+        self.client.max_retries = 2
+        sleep = mock.patch('payments.daraja.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def _send(self, outcomes, endpoint='stk_query', idempotent=True):
+        with mock.patch.object(self.client.session, 'request', side_effect=outcomes) as request:
+            try:
+                response = self.client.post('/path', endpoint, idempotent=idempotent)
+            except requests.exceptions.RequestException as e:
+                response = e
+        return response, request.call_count
+
+    def test_idempotent_calls_retry_connect_errors_and_5xx(self):
+        response, calls = self._send([
+            requests.exceptions.ConnectionError('reset'),
+            mock.Mock(status_code=503),
+            mock.Mock(status_code=200),
+        ])
+        self.assertEqual((response.status_code, calls), (200, 3))
+
+    def test_4xx_is_not_retried(self):
+        response, calls = self._send([mock.Mock(status_code=400), mock.Mock(status_code=200)])
+        self.assertEqual((response.status_code, calls), (400, 1))
+
+    def test_stk_push_is_never_retried(self):
+        error, calls = self._send(
+            [requests.exceptions.ReadTimeout('slow'), mock.Mock(status_code=200)],
+            endpoint='stk_push', idempotent=False,
+        )
+        self.assertIsInstance(error, requests.exceptions.ReadTimeout)
+        self.assertEqual(calls, 1)
+
+        response, calls = self._send([mock.Mock(status_code=503), mock.Mock(status_code=200)],
+                                     endpoint='stk_push', idempotent=False)
+        self.assertEqual((response.status_code, calls), (503, 1))
+
+    def test_backoff_is_capped(self):
+        self.client.max_retries = 8
+        with mock.patch('payments.daraja.random.uniform', side_effect=lambda low, high: high):
+            self._send([mock.Mock(status_code=503)] * 9)
+        waits = [c.args[0] for c in self.sleep.call_args_list]
+        self.assertEqual(len(waits), 8)
+        self.assertEqual(waits[:3], [0.25, 0.5, 1.0])
+        self.assertEqual(max(waits), self.client.backoff_max)
+
+
+class DarajaTimeoutTests(TestCase):
+
+    def test_adaptive_timeout_never_shortens_stk_pushes(self):
+        client = DarajaClient('https://daraja.invalid')
+        for endpoint in ('stk_push', 'stk_query'):
+            for _ in range(50):
+                client.breaker(endpoint).record(True, 0.05)
+
+        timeouts = {}
+        response = mock.Mock(status_code=200)
+        with mock.patch.object(client.session, 'request', return_value=response) as request:
+            client.post('/mpesa/stkpush/v1/processrequest', 'stk_push')
+            timeouts['stk_push'] = request.call_args.kwargs['timeout'][1]
+            client.post('/mpesa/stkpushquery/v1/query', 'stk_query', idempotent=True)
+            timeouts['stk_query'] = request.call_args.kwargs['timeout'][1]
+
+        self.assertEqual(timeouts['stk_push'], client.read_timeout)
+        self.assertLess(timeouts['stk_query'], client.read_timeout)
+
+
+class ExpiredHoldTests(TestCase):
+
+    def setUp(self):
+        seller = User.objects.create_user(username='seller', password='x', is_seller=True)
+        self.event = Event.objects.create(
+            organizer=seller, title='Drop', description='-',
+            date=timezone.now() + timedelta(days=10), location='Nairobi',
+        )
+        self.category = TicketCategory.objects.create(
+            event=self.event, name='Regular', price=Decimal('500'), available_tickets=1,
+        )
+
+    def _buy(self, n):
+        return MpesaService().initiate_stk_push(
+            phone='254700000000', user=None, amount=Decimal('500'),
+            event_id=self.event.id, ticket_category_id=self.category.id,
+            buyer_name=f'Fan {n}', buyer_email=f'fan{n}@example.com', buyer_phone='0700000000',
+            quantity=1, callback_url='https://example.com/cb', background=True,
+        )
+
+    @mock.patch('payments.services.enqueue_stk_push')
+    def test_lapsed_hold_at_zero_stock_goes_to_the_next_buyer(self, enqueue):
+        self.assertTrue(self._buy(1)['success'])
+        self.assertEqual(self._buy(2)['error'], 'Only 0 tickets available')
+
+        TicketReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        result = self._buy(3)
+
+        self.assertTrue(result['success'])
+        self.assertEqual(
+            list(TicketReservation.objects.order_by('id').values_list('status', flat=True)),
+            ['expired', 'held'],
+        )
+        self.assertEqual(TicketCategory.objects.get(pk=self.category.pk).available_tickets, 0)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AccessTokenTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.fetches = []
+
+    def _fetch(self, delay=0):
+        def fetch():
+            time.sleep(delay)
+            self.fetches.append(1)
+            return f'token-{len(self.fetches)}', 3599
+        return fetch
+
+    def test_concurrent_misses_share_one_fetch(self):
+        manager = AccessTokenManager(self._fetch(delay=0.2), 'test:token')
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(manager.get_token())) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.fetches), 1)
+        self.assertEqual(set(tokens), {'token-1'})
+
+    def test_refresh_ahead_serves_the_old_token_meanwhile(self):
+        manager = AccessTokenManager(self._fetch(), 'test:token')
+        manager.get_token()
+        manager._expires_at = time.time() + REFRESH_AHEAD_SECONDS - 10
+
+        self.assertEqual(manager.get_token(), 'token-1')
+        deadline = time.monotonic() + 5
+        while manager.stats()['background_refreshes'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(manager.get_token(), 'token-2')
+        self.assertEqual(len(self.fetches), 2)
+
+    def test_401_invalidates_the_token_and_retries_once(self):
+        service = MpesaService()
+        service.tokens = AccessTokenManager(self._fetch(), 'test:token')
+        service.client = mock.Mock()
+        service.client.post.side_effect = [mock.Mock(status_code=401), mock.Mock(status_code=200)]
+
+        response = service._authorized_post('/mpesa/stkpush/v1/processrequest', {}, 'stk_push')
+
+        self.assertEqual(response.status_code, 200)
+        sent = [c.kwargs['headers']['Authorization'] for c in service.client.post.call_args_list]
+        self.assertEqual(sent, ['Bearer token-1', 'Bearer token-2'])
+
+        # A second 401 is returned, not retried forever
+        service.client.post.side_effect = [mock.Mock(status_code=401), mock.Mock(status_code=401)]
+        self.assertEqual(service._authorized_post('/x', {}, 'stk_push').status_code, 401)
+        self.assertEqual(service.client.post.call_count, 4)
+
+    def test_open_oauth_breaker_does_not_block_a_cached_token(self):
+        seller = User.objects.create_user(username='seller', password='x', is_seller=True)
+        event = Event.objects.create(
+            organizer=seller, title='Drop', description='-',
+            date=timezone.now() + timedelta(days=10), location='Nairobi',
+        )
+        category = TicketCategory.objects.create(
+            event=event, name='Regular', price=Decimal('500'), available_tickets=10,
+        )
+        service = MpesaService()
+        service.client = DarajaClient('https://daraja.invalid')
+        for _ in range(20):
+            service.client.breaker('oauth').record(False, 1)
+        service.tokens = AccessTokenManager(self._fetch(), 'test:token')
+
+        def buy():
+            with mock.patch('payments.services.enqueue_stk_push'):
+                return service.initiate_stk_push(
+                    phone='254700000000', user=None, amount=Decimal('500'),
+                    event_id=event.id, ticket_category_id=category.id,
+                    buyer_name='Fan', buyer_email='fan@example.com', buyer_phone='0700000000',
+                    quantity=1, callback_url='https://example.com/cb', background=True,
+                )
+
+        self.assertEqual(buy()['error'], MPESA_SLOW_MESSAGE)
+        service.tokens.get_token()
+        self.assertTrue(buy()['success'])
+
+
+class ReconciliationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(username='seller', password='x', is_seller=True)
+        self.event = Event.objects.create(
+            organizer=seller, title='Reconcile', description='-',
+            date=timezone.now() + timedelta(days=10), location='Nairobi',
+        )
+        self.category = TicketCategory.objects.create(
+            event=self.event, name='Regular', price=Decimal('500'), available_tickets=10,
+        )
+        self.mpesa = MpesaService()
+        sleep = mock.patch('payments.reconciliation.time.sleep')
+        self.sleep = sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def _pending(self, checkout_request_id, age=timedelta(seconds=30)):
+        txn = Transaction.objects.create(
+            amount=Decimal('500'), event=self.event, ticket_category=self.category,
+            buyer_name='Fan', buyer_email='fan@example.com', buyer_phone='254700000000',
+            checkout_request_id=checkout_request_id,
+        )
+        Transaction.objects.filter(pk=txn.pk).update(timestamp=timezone.now() - age)
+        return txn
+
+    def test_result_codes_map_to_transaction_status(self):
+        cases = [
+            (0, 'The service request is processed successfully.', 'success'),
+            (1032, 'Request cancelled by user', 'cancelled'),
+            (1, 'The service request is processed successfully.', 'pending'),
+            (1, 'The balance is insufficient for the transaction', 'failed'),
+            (2001, 'The initiator information is invalid.', 'failed'),
+            (1037, 'DS timeout user cannot be reached', 'failed'),
+        ]
+        for n, (code, desc, expected) in enumerate(cases):
+            with self.subTest(code=code, desc=desc):
+                txn = self._pending(f'ws_CO_{n}')
+                response = mock.Mock(status_code=200)
+                response.json.return_value = {'ResultCode': str(code), 'ResultDesc': desc}
+                with mock.patch.object(self.mpesa, '_authorized_post', return_value=response), \
+                        mock.patch.object(self.mpesa, '_create_ticket_from_txn') as create_ticket, \
+                        mock.patch('payments.reconciliation.release_hold') as release:
+                    counts = reconcile_pending(rate=0, mpesa=self.mpesa)
+
+                self.assertEqual(counts[expected], 1)
+                txn.refresh_from_db()
+                self.assertEqual(txn.status, expected)
+                self.assertEqual(create_ticket.called, expected == 'success')
+                self.assertEqual(release.called, expected in ('cancelled', 'failed'))
+                Transaction.objects.filter(pk=txn.pk).update(status='cancelled')
+
+    def test_a_callback_that_landed_first_wins(self):
+        txn = self._pending('ws_CO_1')
+        Transaction.objects.filter(pk=txn.pk).update(status='success')
+
+        status = apply_query_result(txn, {'status': 'failed'}, self.mpesa)
+
+        self.assertEqual(status, 'success')
+        txn.refresh_from_db()
+        self.assertEqual(txn.status, 'success')
+
+    def test_only_pushes_inside_the_query_window_are_queried(self):
+        self._pending('ws_CO_fresh', age=timedelta(seconds=STK_QUERY_DELAY_SECONDS - 5))
+        self._pending('ws_CO_stale', age=timedelta(minutes=MAX_AGE_MINUTES + 1))
+        self._pending('ws_CO_due')
+
+        with mock.patch.object(self.mpesa, 'query_stk_status', return_value={'status': 'pending'}) as query:
+            reconcile_pending(rate=0, mpesa=self.mpesa)
+
+        self.assertEqual([c.args[0] for c in query.call_args_list], ['ws_CO_due'])
+
+    def test_a_push_is_not_requeried_within_the_recheck_gap(self):
+        txn = self._pending('ws_CO_1')
+
+        with mock.patch.object(self.mpesa, 'query_stk_status', return_value={'status': 'pending'}) as query:
+            reconcile_pending(rate=0, mpesa=self.mpesa)
+            reconcile_pending(rate=0, mpesa=self.mpesa)
+            self.assertEqual(query.call_count, 1)
+
+            Transaction.objects.filter(pk=txn.pk).update(
+                status_checked_at=timezone.now() - timedelta(seconds=RECHECK_SECONDS + 1)
+            )
+            reconcile_pending(rate=0, mpesa=self.mpesa)
+            self.assertEqual(query.call_count, 2)
+
+    def test_queries_are_paced_to_the_rate(self):
+        for n in range(3):
+            self._pending(f'ws_CO_{n}')
+
+        with mock.patch.object(self.mpesa, 'query_stk_status', return_value={'status': 'pending'}):
+            reconcile_pending(rate=5, mpesa=self.mpesa)
+
+        waits = [c.args[0] for c in self.sleep.call_args_list]
+        self.assertEqual(len(waits), 3)
+        for wait in waits:
+            self.assertGreater(wait, 0.15)
+            self.assertLessEqual(wait, 0.2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PaymentStatusPushTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(username='seller', password='x', is_seller=True)
+        event = Event.objects.create(
+            organizer=seller, title='Status', description='-',
+            date=timezone.now() + timedelta(days=10), location='Nairobi',
+        )
+        category = TicketCategory.objects.create(
+            event=event, name='Regular', price=Decimal('500'), available_tickets=10,
+        )
+        self.txn = Transaction.objects.create(
+            amount=Decimal('500'), event=event, ticket_category=category,
+            buyer_name='Fan', buyer_email='fan@example.com', buyer_phone='254700000000',
+            checkout_request_id='ws_CO_1',
+        )
+        self.wait_url = reverse('payments:wait_payment_status', args=[self.txn.transaction_id])
+        self.stream_url = reverse('payments:payment_status_stream', args=[self.txn.transaction_id])
+
+    async def _resolve_soon(self, status, delay=0.2):
+        await asyncio.sleep(delay)
+        await Transaction.objects.filter(pk=self.txn.pk).aupdate(status=status)
+        publish_status(self.txn.transaction_id, status)
+
+    async def test_long_poll_wakes_on_publish(self):
+        # Called directly: through the client, sync middleware runs the view
+        # on its own event loop and the publish could not interleave
+        request = AsyncRequestFactory().get(self.wait_url, {'timeout': 10})
+        started = time.monotonic()
+        response, _ = await asyncio.gather(
+            wait_payment_status(request, self.txn.transaction_id),
+            self._resolve_soon('success'),
+        )
+
+        self.assertEqual(json.loads(response.content)['status'], 'success')
+        # Woken by the publish, not by the DB re-check or the timeout
+        self.assertLess(time.monotonic() - started, DB_RECHECK_SECONDS / 2)
+
+    async def test_long_poll_times_out_with_the_current_status(self):
+        started = time.monotonic()
+        response = await self.async_client.get(self.wait_url, {'timeout': 0.3}, secure=True)
+
+        payload = json.loads(response.content)
+        self.assertEqual(payload['status'], 'pending')
+        self.assertEqual(payload['transaction_id'], self.txn.transaction_id)
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+    async def test_stream_ends_on_a_final_status(self):
+        async def read_stream():
+            response = await self.async_client.get(self.stream_url, secure=True)
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            return [chunk async for chunk in response.streaming_content]
+
+        chunks, _ = await asyncio.wait_for(
+            asyncio.gather(read_stream(), self._resolve_soon('cancelled')),
+            timeout=DB_RECHECK_SECONDS,
+        )
+
+        events = [
+            json.loads(line[len('data: '):])['status']
+            for chunk in chunks
+            for line in (chunk.decode() if isinstance(chunk, bytes) else chunk).splitlines()
+            if line.startswith('data: ')
+        ]
+        self.assertEqual(events, ['pending', 'cancelled'])
+
+
+class DarajaSimulatorTests(TestCase):
+
+    def setUp(self):
+        self.sim = DarajaSimulator(callback_delay=(1.0, 1.0), callback_loss=1.0, push_ttl=60)
+        self.addCleanup(self.sim.stop)
+
+    def _push(self):
+        status, data = self.sim.stk_push({
+            'BusinessShortCode': '174379', 'Amount': 500, 'PhoneNumber': '254700000000',
+            'CallBackURL': 'https://example.com/cb',
+        })
+        self.assertEqual(status, 200)
+        return data['CheckoutRequestID']
+
+    def test_resolved_pushes_are_forgotten_after_the_ttl(self):
+        now = time.time()
+        with mock.patch('payments.simulator.time.time', return_value=now):
+            first = self._push()
+        with mock.patch('payments.simulator.time.time', return_value=now + 30):
+            second = self._push()
+
+        with mock.patch('payments.simulator.time.time', return_value=now + 62):
+            self.assertEqual(self.sim.stk_query({'CheckoutRequestID': first})[0], 500)
+            self.assertEqual(self.sim.stk_query({'CheckoutRequestID': second})[0], 200)
+            self.assertEqual(self.sim.stats_snapshot()['open_pushes'], 1)
+
+
+@mock.patch('payments.dispatcher.close_old_connections', lambda: None)
+@mock.patch('payments.services.enqueue_stk_push')
+class DispatcherTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(username='seller', password='x', is_seller=True)
+        self.event = Event.objects.create(
+            organizer=seller, title='Dispatch', description='-',
+            date=timezone.now() + timedelta(days=10), location='Nairobi',
+        )
+        self.category = TicketCategory.objects.create(
+            event=self.event, name='Regular', price=Decimal('500'), available_tickets=5,
+        )
+
+    def _queue(self, age=timedelta(0)):
+        result = MpesaService().initiate_stk_push(
+            phone='254700000000', user=None, amount=Decimal('500'),
+            event_id=self.event.id, ticket_category_id=self.category.id,
+            buyer_name='Fan', buyer_email='fan@example.com', buyer_phone='0700000000',
+            quantity=1, callback_url='https://example.com/cb', background=True,
+        )
+        Transaction.objects.filter(pk=result['transaction_id']).update(timestamp=timezone.now() - age)
+        return result['transaction_id']
+
+    def test_a_queued_push_is_sent_once(self, enqueue):
+        transaction_id = self._queue(age=timedelta(seconds=STALE_AFTER_SECONDS + 1))
+
+        with mock.patch.object(MpesaService, 'send_stk_push', return_value={'success': True}) as send:
+            dispatch(transaction_id)
+            dispatch(transaction_id)
+            self.assertEqual(dispatch_stale(), (0, 0))
+
+        self.assertEqual(send.call_count, 1)
+        self.assertEqual(Transaction.objects.get(pk=transaction_id).status, 'pending')
+
+    def test_stale_queued_rows_are_dispatched(self, enqueue):
+        fresh = self._queue()
+        stale = self._queue(age=timedelta(seconds=STALE_AFTER_SECONDS + 1))
+
+        with mock.patch.object(MpesaService, 'send_stk_push', return_value={'success': True}) as send:
+            self.assertEqual(dispatch_stale(), (1, 0))
+
+        self.assertEqual([c.args[0].transaction_id for c in send.call_args_list], [stale])
+        self.assertEqual(Transaction.objects.get(pk=fresh).status, 'queued')
+
+    def test_rows_queued_too_long_are_failed_and_release_their_hold(self, enqueue):
+        transaction_id = self._queue(age=timedelta(seconds=GIVE_UP_AFTER_SECONDS + 1))
+
+        with mock.patch.object(MpesaService, 'send_stk_push') as send:
+            self.assertEqual(dispatch_stale(), (0, 1))
+
+        send.assert_not_called()
+        txn = Transaction.objects.get(pk=transaction_id)
+        self.assertEqual(txn.status, 'failed')
+        self.assertIn('could not be sent in time', txn.description)
+        self.assertEqual(TicketReservation.objects.get(transaction_id=transaction_id).status, 'released')
+        self.assertEqual(TicketCategory.objects.get(pk=self.category.pk).available_tickets, 5)
+
+    def test_a_rejected_push_fails_without_a_second_prompt(self, enqueue):
+        transaction_id = self._queue()
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'ResponseCode': '1', 'ResponseDescription': 'Rejected'}
+
+        with mock.patch.object(MpesaService, '_authorized_post', return_value=response) as post:
+            dispatch(transaction_id)
+            dispatch(transaction_id)
+
+        post.assert_called_once()
+        txn = Transaction.objects.get(pk=transaction_id)
+        self.assertEqual((txn.status, txn.description), ('failed', 'Rejected'))
+        self.assertEqual(TicketReservation.objects.get(transaction_id=transaction_id).status, 'released')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class StkQueryCoalescerTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.coalescer = StkQueryCoalescer()
+
+    def test_concurrent_callers_share_one_upstream_query(self):
+        release = threading.Event()
+
+        def fetch(checkout_request_id):
+            release.wait(5)
+            return {'status': 'success'}
+
+        fetch = mock.Mock(side_effect=fetch)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.coalescer.query('ws_CO_1', fetch)))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while self.coalescer.stats()['joined'] < 9 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(results, [{'status': 'success'}] * 10)
+        self.assertEqual(self.coalescer.stats()['saved'], 9)
+
+    def test_a_cached_answer_skips_the_upstream_call(self):
+        fetch = mock.Mock(return_value={'status': 'cancelled'})
+
+        self.coalescer.query('ws_CO_1', fetch)
+        self.assertEqual(self.coalescer.query('ws_CO_1', fetch), {'status': 'cancelled'})
+
+        fetch.assert_called_once()
+        self.assertEqual(self.coalescer.stats()['cache_hits'], 1)
+
+    def test_pending_answers_expire_after_the_negative_ttl(self):
+        fetch = mock.Mock(side_effect=lambda cid: {'status': 'pending' if cid == 'ws_CO_1' else 'success'})
+        now = time.time()
+        with mock.patch('time.time', return_value=now):
+            self.coalescer.query('ws_CO_1', fetch)
+            self.coalescer.query('ws_CO_2', fetch)
+
+        with mock.patch('time.time', return_value=now + NEGATIVE_CACHE_SECONDS - 1):
+            self.coalescer.query('ws_CO_1', fetch)
+        self.assertEqual(fetch.call_count, 2)
+
+        with mock.patch('time.time', return_value=now + NEGATIVE_CACHE_SECONDS + 1):
+            self.coalescer.query('ws_CO_1', fetch)
+            self.coalescer.query('ws_CO_2', fetch)
+        # Only the pending answer was asked again; the final one is still cached
+        self.assertEqual([c.args[0] for c in fetch.call_args_list], ['ws_CO_1', 'ws_CO_2', 'ws_CO_1'])
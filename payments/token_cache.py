@@ -0,0 +1,174 @@
+"""
+ZOZAPRIME Daraja Access Token Cache
+===================================
+Location: payments/token_cache.py
+
+Safaricom OAuth tokens live ~1 hour, but MpesaService used to fetch a new
+one before every STK push and every status query. AccessTokenManager keeps
+one token per (base_url, consumer_key) for the whole process:
+
+  - HIT:     token cached and not near expiry → returned with no I/O
+  - SHARED:  another worker already fetched one → adopted from Django cache
+  - MISS:    fetched under a lock, so 50 concurrent checkouts = 1 fetch
+  - AHEAD:   inside the refresh window → served from cache while a single
+             background thread fetches the replacement
+  - 401:     invalidate(token) drops it; the caller retries with a fresh one
+
+stats() exposes hit / miss / refresh counters for the admin dashboard.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Safaricom says 3599s; never trust a token closer than this to its expiry
+EXPIRY_MARGIN_SECONDS = 60
+# Start a background refresh this long before expiry
+REFRESH_AHEAD_SECONDS = 300
+# Used if the response carries no expires_in
+DEFAULT_TTL_SECONDS = 3599
+
+
+class AccessTokenManager:
+    """Process-shared, single-flight OAuth token cache with refresh-ahead."""
+
+    def __init__(self, fetch, cache_key):
+        self._fetch = fetch
+        self._cache_key = cache_key
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self._refreshing = False
+        self._stats = {
+            'hits': 0,
+            'shared_hits': 0,
+            'misses': 0,
+            'background_refreshes': 0,
+            'invalidations': 0,
+            'fetch_failures': 0,
+        }
+
+    # ── Public API ────────────────────────────────────────────────────────
+
+    def get_token(self):
+        now = time.time()
+
+        if self._is_fresh(now):
+            self._count('hits')
+            if now >= self._expires_at - REFRESH_AHEAD_SECONDS:
+                self._refresh_in_background()
+            return self._token
+
+        if self._adopt_shared(now):
+            self._count('shared_hits')
+            return self._token
+
+        with self._lock:
+            # Another thread may have fetched while we waited on the lock
+            now = time.time()
+            if self._is_fresh(now) or self._adopt_shared(now):
+                self._count('hits')
+                return self._token
+
+            self._count('misses')
+            return self._fetch_and_store()
+
+    def has_token(self):
+        """True if get_token() can answer without calling Safaricom."""
+        now = time.time()
+        return self._is_fresh(now) or self._adopt_shared(now)
+
+    def invalidate(self, token=None):
+        """Drop the cached token (e.g. after a 401). No-op if already replaced."""
+        with self._lock:
+            if token is not None and token != self._token:
+                return
+            self._token = None
+            self._expires_at = 0.0
+            cache.delete(self._cache_key)
+            self._stats['invalidations'] += 1
+        logger.info("[AUTH] Access token invalidated")
+
+    def stats(self):
+        data = dict(self._stats)
+        lookups = data['hits'] + data['shared_hits'] + data['misses']
+        data['hit_rate'] = round((lookups - data['misses']) / lookups * 100, 1) if lookups else 0.0
+        data['expires_in'] = max(0, int(self._expires_at - time.time()))
+        return data
+
+    # ── Internals ─────────────────────────────────────────────────────────
+
+    def _is_fresh(self, now):
+        return self._token is not None and now < self._expires_at - EXPIRY_MARGIN_SECONDS
+
+    def _adopt_shared(self, now):
+        shared = cache.get(self._cache_key)
+        if shared and now < shared['expires_at'] - EXPIRY_MARGIN_SECONDS:
+            self._token = shared['token']
+            self._expires_at = shared['expires_at']
+            return True
+        return False
+
+    def _fetch_and_store(self):
+        try:
+            token, ttl = self._fetch()
+        except Exception:
+            self._stats['fetch_failures'] += 1
+            raise
+
+        self._token = token
+        self._expires_at = time.time() + (ttl or DEFAULT_TTL_SECONDS)
+        cache.set(
+            self._cache_key,
+            {'token': token, 'expires_at': self._expires_at},
+            timeout=int(ttl or DEFAULT_TTL_SECONDS),
+        )
+        logger.info(f"[AUTH] New access token, valid {int(ttl or DEFAULT_TTL_SECONDS)}s")
+        return token
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                with self._lock:
+                    self._fetch_and_store()
+                    self._stats['background_refreshes'] += 1
+            except Exception as e:
+                logger.error(f"[AUTH] Background token refresh failed: {e}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='daraja-token-refresh', daemon=True).start()
+
+    def _count(self, key):
+        # Plain int += under the GIL is good enough for metrics
+        self._stats[key] += 1
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(base_url, consumer_key, fetch):
+    """One manager per Daraja app (base URL + consumer key) per process."""
+    key = (base_url, consumer_key)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            digest = hashlib.sha256(f"{base_url}|{consumer_key}".encode()).hexdigest()[:16]
+            manager = AccessTokenManager(fetch, cache_key=f"daraja_token:{digest}")
+            _managers[key] = manager
+        return manager
+
+
+def all_token_stats():
+    with _managers_lock:
+        return {base_url: manager.stats() for (base_url, _), manager in _managers.items()}
@@ -14,6 +14,8 @@ urlpatterns = [
     
     # Payment Status
     path('check-payment-status/<str:transaction_id>/', views.check_payment_status, name='check_payment_status'),
+    path('payment-status/<str:transaction_id>/wait/', views.wait_payment_status, name='wait_payment_status'),
+    path('payment-status/<str:transaction_id>/stream/', views.payment_status_stream, name='payment_status_stream'),
 
     # Confirmation
     path('ticket-confirmation/<str:transaction_id>/', views.ticket_confirmation, name='ticket_confirmation'),
@@ -3,13 +3,16 @@ ZOZAPRIME Payment Views
 ========================
 Location: payments/views.py (REPLACE existing file)
 """
+import asyncio
 import json
 import logging
 
+from asgiref.sync import sync_to_async
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.conf import settings
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.db import transaction as db_transaction
@@ -17,7 +20,10 @@ from django.utils import timezone
 from datetime import timedelta
 
 from events.models import Event, TicketCategory, Ticket
+from . import status_channel
+from .callback_inbox import store_callback
 from .models import Transaction
+from .reservations import reclaim_for
 from .services import MpesaService
 
 logger = logging.getLogger(__name__)
@@ -28,7 +34,11 @@ logger = logging.getLogger(__name__)
 # ═══════════════════════════════════════════════════════════════════════════════
 from decimal import Decimal
 from events.models import PromoCode  # Ensure this import is correct
+from events.idempotency import idempotent
+from events.waiting_room import waiting_room_required
 
+@waiting_room_required(json_response=True)
+@idempotent('initiate_mpesa_payment')
 def initiate_mpesa_payment(request, slug):
     """
     Initiate M-Pesa STK Push payment with Promo Code support.
@@ -60,7 +70,7 @@ def initiate_mpesa_payment(request, slug):
                 'error': 'Invalid phone number. Use format: 0712345678'
             })
 
-        category = get_object_or_404(TicketCategory, id=category_id, event=event)
+        category = get_object_or_404(TicketCategory.objects.with_live_stock(), id=category_id, event=event)
 
         if category.is_free:
             return JsonResponse({
@@ -68,10 +78,11 @@ def initiate_mpesa_payment(request, slug):
                 'error': 'This is a free ticket. Please use the RSVP flow.'
             }, status=400)
 
-        if category.available_tickets < quantity:
+        category = reclaim_for(category, quantity)
+        if category.live_available < quantity:
             return JsonResponse({
                 'success': False,
-                'error': f'Only {category.available_tickets} tickets available'
+                'error': f'Only {category.live_available} tickets available'
             })
 
         # Base calculation
@@ -116,7 +127,8 @@ def initiate_mpesa_payment(request, slug):
             buyer_email=buyer_email,
             buyer_phone=phone,
             quantity=quantity,
-            callback_url=callback_url
+            callback_url=callback_url,
+            background=settings.MPESA_ASYNC_INITIATION,
         )
 
         if response.get('success'):
@@ -148,30 +160,28 @@ def mpesa_callback(request):
     """
     Handle M-Pesa callback from Safaricom.
     ALWAYS returns 200 — errors cause retries and duplicate tickets.
-    
+
+    The body is stored in the callback inbox and acknowledged straight
+    away; the process_callback_inbox worker does the fulfilment.
+
     URL: /payments/mpesa-callback/
     """
     if request.method != 'POST':
         return HttpResponse(status=200)
 
-    try:
-        raw_body = request.body.decode('utf-8')
-        logger.info(f"[CALLBACK] Received: {raw_body[:500]}")
-        print(f"[CALLBACK] Received from Safaricom")
-
-        callback_data = json.loads(raw_body)
-        mpesa = MpesaService()
-        success = mpesa.process_callback(callback_data)
+    raw_body = request.body.decode('utf-8', errors='replace')
+    logger.info(f"[CALLBACK] Received: {raw_body[:500]}")
 
-        if success:
-            print("[CALLBACK] ✅ Success")
-        else:
-            print("[CALLBACK] ⚠️ Non-success")
-
-    except json.JSONDecodeError as e:
-        logger.error(f"[CALLBACK] Invalid JSON: {e}")
+    try:
+        entry = store_callback(raw_body)
+        print(f"[CALLBACK] Queued {entry.checkout_request_id or '?'} (inbox #{entry.id})")
     except Exception as e:
-        logger.error(f"[CALLBACK] Error: {e}", exc_info=True)
+        # Inbox unavailable — fall back to processing inline rather than lose it
+        logger.error(f"[CALLBACK] Inbox write failed, processing inline: {e}", exc_info=True)
+        try:
+            MpesaService().process_callback(json.loads(raw_body))
+        except Exception as e:
+            logger.error(f"[CALLBACK] Error: {e}", exc_info=True)
 
     return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Success'})
 
@@ -192,21 +202,14 @@ def mpesa_callback_test(request):
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
-# CHECK PAYMENT STATUS — with time-guarded STK query fallback
+# CHECK PAYMENT STATUS — pure DB read
 #
-# THE FIX: Don't query Safaricom until at least 15 seconds have passed
-# since the STK push was sent. Before that, the fan hasn't even seen the
-# prompt on their phone yet, and Safaricom returns ambiguous ResultCode 1
-# which was being misinterpreted as "failed".
-#
-# FLOW:
-# 0-15 seconds:  Return "pending" from DB only (no Safaricom query)
-# 15+ seconds:   Query Safaricom directly if still pending
+# Every open checkout tab polls this every 3 seconds, so it never calls
+# Safaricom. Pending pushes are resolved by the callback inbox worker or,
+# if the callback never arrives, by the reconcile_stk_payments worker
+# (payments/reconciliation.py) at a controlled rate.
 # ═══════════════════════════════════════════════════════════════════════════════
 
-# Minimum seconds to wait before querying Safaricom
-STK_QUERY_DELAY_SECONDS = 15
-
 def check_payment_status(request, transaction_id):
     """
     Check payment status — frontend polls this every 3 seconds.
@@ -214,83 +217,21 @@ def check_payment_status(request, transaction_id):
     URL: /payments/check-payment-status/<transaction_id>/
     """
     try:
-        txn = Transaction.objects.filter(transaction_id=transaction_id).first()
+        payload = status_channel.snapshot(transaction_id)
 
-        if not txn:
+        if not payload:
             return JsonResponse({'success': True, 'status': 'pending'})
 
-        # ── Already resolved? Return immediately ──
-        if txn.status in ('success', 'failed', 'cancelled'):
-            return JsonResponse({
-                'success': True,
-                'status': txn.status,
-                'transaction_id': txn.transaction_id,
-                'receipt_number': txn.receipt_number,
-                'amount': float(txn.amount),
-            })
-
-        # ── Still pending ──
-        if txn.checkout_request_id:
-            # Check if enough time has passed to query Safaricom
-            elapsed = (timezone.now() - txn.timestamp).total_seconds()
-
-            if elapsed < STK_QUERY_DELAY_SECONDS:
-                # Too early — fan is still entering PIN
-                # Just return pending, don't query Safaricom yet
-                logger.info(
-                    f"[STATUS] {transaction_id}: {elapsed:.0f}s elapsed, "
-                    f"waiting {STK_QUERY_DELAY_SECONDS}s before query"
-                )
-                return JsonResponse({
-                    'success': True,
-                    'status': 'pending',
-                    'transaction_id': txn.transaction_id,
-                    'amount': float(txn.amount),
-                })
-
-            # Enough time passed — query Safaricom
-            logger.info(f"[STATUS] {transaction_id}: {elapsed:.0f}s elapsed, querying Safaricom")
-            print(f"[STATUS] Querying Safaricom for {transaction_id} ({elapsed:.0f}s elapsed)")
+        # ── Already resolved? ──
+        if payload['status'] in status_channel.TERMINAL_STATUSES:
+            return JsonResponse(payload)
 
-            mpesa = MpesaService()
-            result = mpesa.query_stk_status(txn.checkout_request_id)
-
-            print(f"[STATUS] Query result: {result['status']}")
-
-            if result['status'] == 'success':
-                txn.status = 'success'
-                txn.save()
-                mpesa._create_ticket_from_txn(txn)
-
-                return JsonResponse({
-                    'success': True,
-                    'status': 'success',
-                    'transaction_id': txn.transaction_id,
-                    'receipt_number': txn.receipt_number,
-                    'amount': float(txn.amount),
-                })
-
-            elif result['status'] == 'cancelled':
-                txn.status = 'cancelled'
-                txn.description = result.get('description', 'Cancelled by user')
-                txn.save()
-                return JsonResponse({'success': True, 'status': 'cancelled'})
-
-            elif result['status'] == 'failed':
-                txn.status = 'failed'
-                txn.description = result.get('description', 'Payment failed')
-                txn.save()
-                return JsonResponse({'success': True, 'status': 'failed'})
-
-            # result['status'] == 'pending' — still waiting
-            # Fall through to return pending below
-
-        # Still pending
+        # ── Queued or pending — the workers will resolve it ──
         return JsonResponse({
             'success': True,
             'status': 'pending',
-            'transaction_id': txn.transaction_id,
-            'amount': float(txn.amount),
+            'transaction_id': payload['transaction_id'],
+            'amount': payload['amount'],
         })
 
     except Exception as e:
@@ -298,6 +239,75 @@ def check_payment_status(request, transaction_id):
         return JsonResponse({'success': False, 'error': str(e)})
 
 
+# ═══════════════════════════════════════════════════════════════════════════════
+# PUSH-STYLE PAYMENT STATUS — long-poll and Server-Sent Events
+#
+# One held request per checkout instead of a poll every 3 seconds. Both
+# are woken by publish_status() in process_callback / the reconciliation
+# worker (payments/status_channel.py). Async views, served over ASGI
+# (Procfile: uvicorn workers on DopeEvents/asgi.py) so a waiting fan costs
+# no worker thread and SSE events go out as they happen.
+# ═══════════════════════════════════════════════════════════════════════════════
+
+LONG_POLL_TIMEOUT_SECONDS = 25
+SSE_MAX_SECONDS = 180
+SSE_HEARTBEAT_SECONDS = 15
+
+
+async def wait_payment_status(request, transaction_id):
+    """
+    Long-poll: returns as soon as the status differs from ?status=
+    (default 'pending'), or after ?timeout= seconds with the unchanged status.
+
+    URL: /payments/payment-status/<transaction_id>/wait/
+    """
+    known = request.GET.get('status', 'pending')
+    try:
+        timeout = min(float(request.GET.get('timeout', LONG_POLL_TIMEOUT_SECONDS)), LONG_POLL_TIMEOUT_SECONDS)
+    except ValueError:
+        timeout = LONG_POLL_TIMEOUT_SECONDS
+
+    payload = await sync_to_async(status_channel.snapshot)(transaction_id)
+    if payload and payload['status'] != known:
+        return JsonResponse(payload)
+
+    changed = await status_channel.wait_for_change(transaction_id, known, timeout)
+    return JsonResponse(changed or payload or {'success': True, 'status': 'pending'})
+
+
+async def payment_status_stream(request, transaction_id):
+    """
+    Server-Sent Events: one `status` event now, one per change, closes on
+    a final status. Heartbeat comments keep proxies from cutting it.
+
+    URL: /payments/payment-status/<transaction_id>/stream/
+    """
+    async def events():
+        payload = await sync_to_async(status_channel.snapshot)(transaction_id)
+        known = payload['status'] if payload else 'pending'
+        yield _sse(payload or {'success': True, 'status': 'pending'})
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SSE_MAX_SECONDS
+        while known not in status_channel.TERMINAL_STATUSES and loop.time() < deadline:
+            wait = min(SSE_HEARTBEAT_SECONDS, deadline - loop.time())
+            changed = await status_channel.wait_for_change(transaction_id, known, wait)
+            if changed:
+                known = changed['status']
+                yield _sse(changed)
+            else:
+                yield ': keep-alive\n\n'
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _sse(payload):
+    return f"event: status\ndata: {json.dumps(payload)}\n\n"
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # TICKET CONFIRMATION PAGE
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -307,16 +317,23 @@ def ticket_confirmation(request, transaction_id):
     Display ticket confirmation with QR code.
     
     URL: /payments/ticket-confirmation/<transaction_id>/
-    
-    5-layer ticket lookup — never 404s:
-    1. By M-Pesa receipt number
-    2. By TXN_ code
-    3. By QUERY_ code (legacy)
-    4. By buyer details
-    5. Create on the spot
+
+    Ticket lookup — never 404s:
+    1. Via the ticket's transaction link (one indexed join)
+    2. By transaction code, for tickets the backfill left unlinked
+    3. Create on the spot
     """
     try:
-        txn = Transaction.objects.filter(transaction_id=transaction_id).first()
+        ticket = (
+            Ticket.objects.select_related('transaction__event', 'transaction__ticket_category')
+            .filter(transaction_id=transaction_id)
+            .first()
+        )
+        txn = ticket.transaction if ticket else (
+            Transaction.objects.select_related('event', 'ticket_category')
+            .filter(transaction_id=transaction_id)
+            .first()
+        )
 
         if not txn:
             messages.error(request, 'Transaction not found.')
@@ -326,36 +343,19 @@ def ticket_confirmation(request, transaction_id):
             messages.error(request, 'Payment has not been completed.')
             return redirect('home')
 
-        # ── Find the ticket ──
-        ticket = None
-
-        # Layer 1: By receipt number
-        if txn.receipt_number:
-            ticket = Ticket.objects.filter(
-                transaction_code=txn.receipt_number
-            ).first()
-
-        # Layer 2: By TXN_ code
+        # Legacy ticket: find it by code once and link it for next time
         if not ticket:
+            codes = [f"TXN_{txn.transaction_id}", f"QUERY_{txn.transaction_id}"]
+            if txn.receipt_number:
+                codes.append(txn.receipt_number)
             ticket = Ticket.objects.filter(
-                transaction_code=f"TXN_{txn.transaction_id}"
+                transaction__isnull=True,
+                transaction_code__in=codes,
             ).first()
+            if ticket:
+                ticket.transaction = txn
+                ticket.save(update_fields=['transaction'])
 
-        # Layer 3: By QUERY_ code (from older version)
-        if not ticket:
-            ticket = Ticket.objects.filter(
-                transaction_code=f"QUERY_{txn.transaction_id}"
-            ).first()
-
-        # Layer 4: By buyer details
-        if not ticket:
-            ticket = Ticket.objects.filter(
-                event=txn.event,
-                buyer_email=txn.buyer_email,
-                ticket_category=txn.ticket_category,
-            ).order_by('-purchased_at').first()
-
-        # Layer 5: Create it now
         if not ticket:
             logger.warning(f"[CONFIRM] No ticket for {transaction_id}, creating")
             mpesa = MpesaService()